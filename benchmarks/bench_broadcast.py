@@ -0,0 +1,99 @@
+"""
+Draw-to-receive latency of the new_shapes broadcast with many clients.
+
+Runs the headless server in-process on a background thread and connects
+--clients Socket.IO clients to one board. One more client draws --shapes
+shapes at --rate shapes/sec through draw_shape, each stamped with its send
+time, and every other client records when the shape arrives:
+
+    python benchmarks/bench_broadcast.py --clients 100 --shapes 500 --rate 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio
+import uvicorn
+
+import main
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(args):
+    url = f"http://127.0.0.1:{args.port}?board=bench"
+    latencies = []
+    lock = threading.Lock()
+
+    def on_new_shapes(shapes):
+        now = time.perf_counter()
+        with lock:
+            latencies.extend(now - shape["t"] for shape in shapes)
+
+    clients = []
+    for _ in range(args.clients):
+        client = socketio.Client()
+        client.on("new_shapes", on_new_shapes)
+        client.connect(url, transports=["websocket"])
+        clients.append(client)
+    sender = socketio.Client()
+    sender.connect(url, transports=["websocket"])
+
+    start = time.perf_counter()
+    for i in range(args.shapes):
+        # Pace the sender so it draws at the requested rate
+        delay = start + i / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sender.emit("draw_shape", {"type": "line", "start": [i % 800, i % 600],
+                                   "end": [i % 800 + 10, i % 600 + 10], "color": "#FF0000",
+                                   "t": time.perf_counter()})
+
+    expected = args.shapes * args.clients
+    deadline = time.perf_counter() + 30
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        time.sleep(0.05)
+
+    for client in clients + [sender]:
+        client.disconnect()
+
+    ms = [latency * 1e3 for latency in latencies]
+    print(f"{args.clients} clients, {args.shapes} shapes at {args.rate}/s, "
+          f"tick {main.broadcaster.interval * 1e3:.0f} ms")
+    print(f"received {len(ms)}/{expected} shapes")
+    if ms:
+        print(f"latency p50 {statistics.median(ms):7.1f} ms  p99 {percentile(ms, 0.99):7.1f} ms  "
+              f"max {max(ms):7.1f} ms")
+    print(f"broadcast {main.broadcaster.stats()}")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--shapes", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=200, help="shapes per second drawn by the sender")
+    parser.add_argument("--interval-ms", type=float, default=16, help="broadcast tick")
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+    main.broadcaster.interval = args.interval_ms / 1000
+
+    server = uvicorn.Server(uvicorn.Config(main.socket_app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        run(args)
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,96 @@
+"""
+Curve size before and after simplification and compact encoding.
+
+Generates freehand-like strokes sampled about once per pixel, as the mouse
+handlers see them, and reports point count, in-memory size, JSON payload
+size for each wire format and the worst deviation from the original stroke:
+
+    python benchmarks/bench_curve.py --points 5000 --tolerance 0.5
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whiteboard import curve
+
+
+def make_stroke(count, rng):
+    """A wandering stroke with hand jitter, one sample per ~1 px of travel."""
+    x, y, heading = 400.0, 300.0, 0.0
+    points = []
+    for _ in range(count):
+        heading += rng.gauss(0, 0.05)
+        x += math.cos(heading) + rng.gauss(0, 0.05)
+        y += math.sin(heading) + rng.gauss(0, 0.05)
+        points.append((x, y))
+    return points
+
+
+def segment_distance(p, a, b):
+    (px, py), (ax, ay), (bx, by) = p, a, b
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    t = 0 if length_sq == 0 else max(0, min(1, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def max_deviation(original, simplified):
+    """Distance of each original point to the simplified polyline (points are in order)."""
+    worst, segment = 0.0, 0
+    for p in original:
+        while segment < len(simplified) - 2 and p == simplified[segment + 1]:
+            segment += 1
+        worst = max(worst, segment_distance(p, simplified[segment], simplified[segment + 1]))
+    return worst
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=5000)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stroke = make_stroke(args.points, random.Random(args.seed))
+
+    start = time.perf_counter()
+    simplified = curve.simplify(stroke, args.tolerance)
+    simplify_ms = (time.perf_counter() - start) * 1e3
+
+    original_dicts, original_mem = measure_memory(lambda: curve.to_dicts(stroke))
+    simplified_dicts, simplified_mem = measure_memory(lambda: curve.to_dicts(simplified))
+
+    payloads = {
+        "dicts (current)": json.dumps(original_dicts),
+        "dicts simplified": json.dumps(simplified_dicts),
+        "flat simplified": json.dumps(curve.to_flat(simplified)),
+        "delta simplified": curve.encode_delta(simplified),
+    }
+    base = len(payloads["dicts (current)"])
+
+    print(f"points      {len(stroke)} -> {len(simplified)} "
+          f"({len(stroke) / len(simplified):.1f}x fewer) in {simplify_ms:.1f} ms")
+    print(f"max deviation {max_deviation(stroke, simplified):.3f} px (tolerance {args.tolerance})")
+    print(f"memory      {original_mem / 1024:.0f} KiB -> {simplified_mem / 1024:.0f} KiB "
+          f"({original_mem / simplified_mem:.1f}x smaller)")
+    for name, payload in payloads.items():
+        print(f"payload     {name:<17} {len(payload):>8} bytes ({base / len(payload):5.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
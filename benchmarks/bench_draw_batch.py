@@ -0,0 +1,96 @@
+"""
+Compare shapes/sec of the single-shape /draw_line endpoint against /draw_batch.
+
+Runs the server in-process on a background thread (like main.py) with an
+offscreen Qt window, so no display or running server is needed:
+
+    python benchmarks/bench_draw_batch.py --shapes 10000 --batch-size 1000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import uvicorn
+from PySide6.QtCore import QMetaObject, Qt
+from PySide6.QtWidgets import QApplication
+
+import main
+from whiteboard.boards import DEFAULT_BOARD
+from whiteboard.whiteboard import WhiteboardWindow
+
+
+def wait_for_history(whiteboard, count, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while len(whiteboard.history) < count:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"only {len(whiteboard.history)}/{count} shapes drawn")
+        time.sleep(0.001)
+
+
+def line(i):
+    return {"type": "line", "start": (i % 800, i % 600), "end": (i % 800 + 10, i % 600 + 10), "color": "#FF0000"}
+
+
+def run(args, app, whiteboard):
+    base = f"http://127.0.0.1:{args.port}"
+    session = requests.Session()
+    try:
+        # Single-shape endpoint
+        drawn = len(whiteboard.history)
+        start = time.perf_counter()
+        for i in range(args.single_shapes):
+            session.post(f"{base}/draw_line", params={
+                "x": i % 800, "y": i % 600, "width": 10, "height": 10, "color": "#FF0000"
+            }).raise_for_status()
+        wait_for_history(whiteboard, drawn + args.single_shapes)
+        single = args.single_shapes / (time.perf_counter() - start)
+
+        # Batch endpoint
+        drawn = len(whiteboard.history)
+        start = time.perf_counter()
+        for offset in range(0, args.shapes, args.batch_size):
+            count = min(args.batch_size, args.shapes - offset)
+            shapes = [line(offset + i) for i in range(count)]
+            response = session.post(f"{base}/draw_batch", json=shapes)
+            response.raise_for_status()
+            assert len(response.json()["ids"]) == count
+        wait_for_history(whiteboard, drawn + args.shapes)
+        batch = args.shapes / (time.perf_counter() - start)
+
+        print(f"/draw_line  : {args.single_shapes:>8} shapes {single:>12.0f} shapes/sec")
+        print(f"/draw_batch : {args.shapes:>8} shapes {batch:>12.0f} shapes/sec "
+              f"(batch size {args.batch_size}, {batch / single:.1f}x)")
+    finally:
+        QMetaObject.invokeMethod(app, "quit", Qt.QueuedConnection)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shapes", type=int, default=10000)
+    parser.add_argument("--single-shapes", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    main.whiteboard = WhiteboardWindow(main.boards.pin(DEFAULT_BOARD))
+    main.whiteboard.start_dispatch(main.dispatch_queue)
+
+    server = uvicorn.Server(uvicorn.Config(main.socket_app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    threading.Thread(target=run, args=(args, app, main.whiteboard), daemon=True).start()
+    app.exec()
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main_bench()
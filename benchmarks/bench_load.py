@@ -0,0 +1,342 @@
+"""
+Load harness: throughput, latency and memory of the headless server.
+
+Starts the server itself, either as a `main.py --headless` subprocess
+(default, so load generation does not share its GIL) or in-process on a
+background thread (--server inprocess), and runs the workloads on their
+own boards:
+
+    rest     --concurrency threads POST /draw_line, --requests in total
+    curves   --clients Socket.IO clients each draw --curves curves of
+             --curve-points points with draw_shape, waiting for the ack
+    joins    --joins clients connect at once to a board of --history-shapes
+             shapes; latency is until their init snapshot arrives
+             (Socket.IO clients use --format json or binary)
+    history  GET /history of that board --reads times, as JSON and NDJSON
+
+Each workload reports operations per second, p50/p99/max latency, errors
+and the server's RSS (current and peak). Results are written as JSON to
+--out, and --compare OLD.json prints the change against an earlier run,
+exiting with 1 if throughput or p99 got worse by more than --tolerance:
+
+    python benchmarks/bench_load.py --out results.json
+    python benchmarks/bench_load.py --workloads rest,history --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests
+import socketio
+
+WORKLOADS = ["rest", "curves", "joins", "history"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def rss_mb(pid):
+    """(current, peak) resident memory of a process in MiB, from /proc where available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        # Peak of this process only, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak / (2**20 if sys.platform == "darwin" else 1024)
+
+
+class Server:
+    def __init__(self, mode, port, extra_args):
+        self.mode, self.port, self.url = mode, port, f"http://127.0.0.1:{port}"
+        self.process = self.uvicorn = None
+        if mode == "spawn":
+            command = [sys.executable, "main.py", "--headless", "--port", str(port)] + extra_args
+            self.process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL)
+            self.pid = self.process.pid
+        else:
+            import uvicorn
+            import main
+            self.uvicorn = uvicorn.Server(uvicorn.Config(main.socket_app, host="127.0.0.1", port=port,
+                                                         log_level="warning"))
+            threading.Thread(target=self.uvicorn.run, daemon=True).start()
+            self.pid = os.getpid()
+        deadline = time.perf_counter() + 60
+        while time.perf_counter() < deadline:
+            try:
+                requests.get(f"{self.url}/boards", timeout=1).raise_for_status()
+                return
+            except requests.ConnectionError:
+                time.sleep(0.05)
+        self.stop()
+        raise TimeoutError("server did not start")
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+        if self.uvicorn:
+            self.uvicorn.should_exit = True
+
+
+def summarize(name, latencies, elapsed, errors, server, **extra):
+    ms = [latency * 1e3 for latency in latencies]
+    rss, peak = rss_mb(server.pid)
+    result = {
+        "ops": len(ms),
+        "seconds": round(elapsed, 3),
+        "ops_per_s": round(len(ms) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(ms, 0.5), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 3) if ms else None,
+        "max_ms": round(max(ms), 3) if ms else None,
+        "errors": errors,
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "peak_rss_mb": round(peak, 1),
+        **extra,
+    }
+    print(f"{name:8} {result['ops']:7} ops {result['ops_per_s'] or 0:9.1f}/s  "
+          f"p50 {result['p50_ms'] or 0:8.2f} ms  p99 {result['p99_ms'] or 0:8.2f} ms  "
+          f"errors {errors}  rss {result['rss_mb']} MiB (peak {result['peak_rss_mb']})")
+    return result
+
+
+def run_rest(server, args):
+    board = f"load-rest-{os.getpid()}"
+    local = threading.local()
+    rng = random.Random(1)
+    params = [{"x": rng.uniform(0, 5000), "y": rng.uniform(0, 5000), "width": 20, "height": 10,
+               "color": "#FF0000", "board": board} for _ in range(args.requests)]
+
+    def draw(p):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        ok = session.post(f"{server.url}/draw_line", params=p).status_code == 200
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(draw, params))
+    elapsed = time.perf_counter() - start
+    return summarize("rest", [r[0] for r in results if r[1]], elapsed,
+                     sum(not r[1] for r in results), server, concurrency=args.concurrency)
+
+
+def run_curves(server, args):
+    url = f"{server.url}?board=load-curves-{os.getpid()}&format={args.format}"
+    clients = []
+    for _ in range(args.clients):
+        client = socketio.Client()
+        client.connect(url, transports=["websocket"])
+        clients.append(client)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def draw(index, client):
+        rng = random.Random(index)
+        mine, failed = [], 0
+        for _ in range(args.curves):
+            x, y = rng.uniform(0, 5000), rng.uniform(0, 5000)
+            points = [[x + k * 3, y + rng.uniform(-20, 20)] for k in range(args.curve_points)]
+            start = time.perf_counter()
+            try:
+                reply = client.call("draw_shape", {"type": "curve", "points": points, "color": "#0000FF"},
+                                    timeout=30)
+            except socketio.exceptions.TimeoutError:
+                failed += 1
+                continue
+            if reply and reply.get("status") == "error":
+                failed += 1
+            else:
+                mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=draw, args=(i, c)) for i, c in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.disconnect()
+    return summarize("curves", latencies, elapsed, sum(errors), server,
+                     clients=args.clients, curve_points=args.curve_points, format=args.format)
+
+
+def fill(server, board, count):
+    rng = random.Random(2)
+    session = requests.Session()
+    for done in range(0, count, 1000):
+        batch = []
+        for _ in range(min(1000, count - done)):
+            x, y = rng.uniform(0, 10000), rng.uniform(0, 10000)
+            batch.append({"type": "rect", "start": [x, y], "end": [x + 30, y + 20], "color": "#00FF00"})
+        session.post(f"{server.url}/draw_batch", params={"board": board}, json=batch).raise_for_status()
+
+
+def run_joins(server, args, board):
+    url = f"{server.url}?board={board}&format={args.format}"
+    latencies, errors = [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.joins)
+    clients = []
+
+    def join():
+        client = socketio.Client()
+        got_init = threading.Event()
+        client.on("init", lambda shapes: got_init.set())
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            client.connect(url, transports=["websocket"], wait_timeout=30)
+            ok = got_init.wait(30)
+        except socketio.exceptions.ConnectionError:
+            ok = False
+        with lock:
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(1)
+            clients.append(client)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=join) for _ in range(args.joins)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        if client.connected:
+            client.disconnect()
+    return summarize("joins", latencies, elapsed, len(errors), server, board_shapes=args.history_shapes,
+                     format=args.format)
+
+
+def run_history(server, args, board):
+    session = requests.Session()
+    results = {}
+    for label, params in (("history", {"board": board}), ("ndjson", {"board": board, "format": "ndjson"})):
+        latencies, size = [], 0
+        start = time.perf_counter()
+        for _ in range(args.reads):
+            t = time.perf_counter()
+            response = session.get(f"{server.url}/history", params=params)
+            response.raise_for_status()
+            size = len(response.content)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+        results[label] = summarize(label, latencies, elapsed, 0, server, board_shapes=args.history_shapes,
+                                   mb_per_s=round(size * len(latencies) / elapsed / 2**20, 1))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print changes against a baseline; returns True if something regressed beyond tolerance."""
+    regressed = False
+    print(f"\ncompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('time')})")
+    for name, new in results["workloads"].items():
+        old = baseline["workloads"].get(name)
+        if not old:
+            continue
+        for key, worse_if in (("ops_per_s", "lower"), ("p99_ms", "higher")):
+            if not old.get(key) or new.get(key) is None:
+                continue
+            change = new[key] / old[key] - 1
+            bad = change < -tolerance if worse_if == "lower" else change > tolerance
+            regressed |= bad
+            print(f"{name:8} {key:9} {old[key]:10.2f} -> {new[key]:10.2f}  {change:+7.1%}"
+                  f"{'  REGRESSION' if bad else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="comma separated, of " + ", ".join(WORKLOADS))
+    parser.add_argument("--server", choices=["spawn", "inprocess"], default="spawn")
+    parser.add_argument("--server-args", default="", help="extra main.py arguments when spawning, e.g. '--workers 2'")
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--requests", type=int, default=5000, help="rest: total draw requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="rest: threads sending requests")
+    parser.add_argument("--clients", type=int, default=20, help="curves: Socket.IO clients")
+    parser.add_argument("--curves", type=int, default=100, help="curves: curves per client")
+    parser.add_argument("--curve-points", type=int, default=50)
+    parser.add_argument("--joins", type=int, default=50, help="joins: clients connecting at once")
+    parser.add_argument("--history-shapes", type=int, default=20_000, help="joins/history: board size")
+    parser.add_argument("--format", choices=["json", "binary"], default="json",
+                        help="curves/joins: wire format of the Socket.IO clients")
+    parser.add_argument("--reads", type=int, default=10, help="history: reads per format")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="a previous --out file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args()
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    server = Server(args.server, args.port, shlex.split(args.server_args))
+    results = {
+        "meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "args": vars(args)},
+        "workloads": {},
+    }
+    try:
+        idle, _ = rss_mb(server.pid)
+        results["meta"]["idle_rss_mb"] = idle and round(idle, 1)
+        board = f"load-history-{os.getpid()}"
+        if {"joins", "history"} & set(workloads):
+            fill(server, board, args.history_shapes)
+        for name in workloads:
+            if name == "rest":
+                results["workloads"]["rest"] = run_rest(server, args)
+            elif name == "curves":
+                results["workloads"]["curves"] = run_curves(server, args)
+            elif name == "joins":
+                results["workloads"]["joins"] = run_joins(server, args, board)
+            elif name == "history":
+                results["workloads"].update(run_history(server, args, board))
+    finally:
+        server.stop()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
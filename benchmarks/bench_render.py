@@ -0,0 +1,98 @@
+"""
+Frame time of the whiteboard view over a generated large board.
+
+Fills an offscreen window with lines, rects and long freehand curves, then
+repaints the viewport at several zoom levels and positions in both render
+modes. Each view is painted twice; the second paint shows the effect of
+the item caches:
+
+    python benchmarks/bench_render.py --shapes 20000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtWidgets import QApplication
+
+from whiteboard.whiteboard import WhiteboardWindow
+
+BOARD = 20000  # board side in scene units
+ZOOMS = (1.0, 0.25, 0.05)
+
+
+def make_shapes(count, curve_points, rng):
+    shapes = []
+    for i in range(count):
+        x, y = rng.uniform(0, BOARD), rng.uniform(0, BOARD)
+        if i % 5 == 0:
+            heading, points = rng.uniform(0, 6.3), []
+            for _ in range(curve_points):
+                heading += rng.gauss(0, 0.1)
+                x, y = x + math.cos(heading), y + math.sin(heading)
+                points.append({"x": x, "y": y})
+            shapes.append({"type": "curve", "points": points, "color": "#0000FF"})
+        else:
+            shapes.append({"type": ("line", "rect")[i % 2], "start": (x, y),
+                           "end": (x + rng.uniform(5, 80), y + rng.uniform(5, 80)), "color": "#FF0000"})
+    return shapes
+
+
+def frame_times(window, app, positions):
+    """Return (first, second) mean paint time in ms per zoom level."""
+    view = window.view
+    results = {}
+    for zoom in ZOOMS:
+        view.resetTransform()
+        view.scale(zoom, zoom)
+        window.update_antialiasing()
+        passes = []
+        for _ in range(2):
+            start = time.perf_counter()
+            for x, y in positions:
+                view.centerOn(x, y)
+                view.viewport().grab()
+            passes.append((time.perf_counter() - start) / len(positions) * 1e3)
+            app.processEvents()
+        results[zoom] = passes
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shapes", type=int, default=20000)
+    parser.add_argument("--curve-points", type=int, default=300)
+    parser.add_argument("--frames", type=int, default=10, help="view positions per zoom level")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    rng = random.Random(1)
+    shapes = make_shapes(args.shapes, args.curve_points, rng)
+    positions = [(rng.uniform(0, BOARD), rng.uniform(0, BOARD)) for _ in range(args.frames)]
+
+    window = WhiteboardWindow()
+    window.resize(1200, 800)
+    window.show()
+    window.curve_tolerance = 0  # keep the full point count to stress the renderer
+    # Added in one pass with scene indexing suspended, as redraw_history does
+    window.board.apply("add", shapes, source=window)
+    with window.suspended_index():
+        for shape_data in shapes:
+            window.add_item(shape_data)
+    window.scene.setSceneRect(0, 0, BOARD, BOARD)
+
+    print(f"{args.shapes} shapes, {args.curve_points} points per curve, 1200x800 view")
+    for mode in ("quality", "fast"):
+        window.set_render_mode(mode)
+        window.scene.setSceneRect(0, 0, BOARD, BOARD)
+        for zoom, (first, second) in frame_times(window, app, positions).items():
+            print(f"{mode:<8} zoom {zoom:5.2f}: first paint {first:8.2f} ms  repaint {second:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
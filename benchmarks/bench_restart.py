@@ -0,0 +1,87 @@
+"""
+Restart time of a persisted board: snapshot load plus log tail replay.
+
+Writes a board of --shapes shapes to a temporary data directory, the last
+--tail of them (the --snapshot-every default, the most a server leaves
+after its latest snapshot) in the log tail and the rest in a snapshot, then
+measures how long a fresh History takes to restore it. With --scene the QGraphicsScene is rebuilt
+too, using an offscreen Qt window:
+
+    python benchmarks/bench_restart.py --shapes 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whiteboard.history import History
+from whiteboard.persistence import HistoryLog
+
+
+def make_shape(i, rng):
+    x, y = rng.uniform(0, 10000), rng.uniform(0, 10000)
+    if i % 10 == 0:
+        return {"type": "curve", "color": "#0000FF", "id": i + 1,
+                "points": [{"x": x + k, "y": y + k % 3} for k in range(8)]}
+    return {"type": "line", "start": (x, y), "end": (x + 20, y + 10), "color": "#FF0000", "id": i + 1}
+
+
+def write_board(data_dir, count, rng, tail):
+    log = HistoryLog(data_dir, snapshot_every=count + 1)
+    history = History()
+    history.attach_log(log)
+    writer = None
+    for i in range(count):
+        history.append(make_shape(i, rng))
+        if i == max(count - tail, 0) - 1:
+            writer = history.compact()
+    if writer:
+        writer.join()
+    log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shapes", type=int, default=1_000_000)
+    parser.add_argument("--tail", type=int, default=100_000, help="shapes written after the snapshot")
+    parser.add_argument("--scene", action="store_true", help="also rebuild the Qt scene")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        start = time.perf_counter()
+        write_board(data_dir, args.shapes, random.Random(1), args.tail)
+        print(f"write   {args.shapes} shapes: {time.perf_counter() - start:6.2f}s")
+        size = sum(os.path.getsize(os.path.join(data_dir, f)) for f in os.listdir(data_dir))
+        print(f"on disk {size / 2**20:.1f} MiB: {sorted(os.listdir(data_dir))}")
+
+        log = HistoryLog(data_dir)
+        start = time.perf_counter()
+        seq, _, _, store, entries = log.load()
+        count = len(entries) + (len(store) if store is not None else 0)
+        print(f"load    snapshot + log tail: {time.perf_counter() - start:6.2f}s ({count} shapes)")
+
+        history = History()
+        start = time.perf_counter()
+        history.attach_log(log)
+        print(f"restore (load + index):      {time.perf_counter() - start:6.2f}s")
+        log.close()
+
+        if args.scene:
+            os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+            from PySide6.QtWidgets import QApplication
+            from whiteboard.whiteboard import WhiteboardWindow
+            app = QApplication(sys.argv[:1])
+            window = WhiteboardWindow()
+            window.history = history
+            start = time.perf_counter()
+            window.redraw_history()
+            print(f"rebuild scene:               {time.perf_counter() - start:6.2f}s "
+                  f"({len(window.scene.items())} items)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Memory per shape and scan throughput of ShapeStore against a list of dicts.
+
+Builds the same board both ways (lines, rects, circles and 10% curves of
+eight points) and times a type + color + region scan over all shapes:
+
+    python benchmarks/bench_shape_store.py --shapes 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whiteboard.geometry import intersects, shape_bbox
+from whiteboard.shape_store import ShapeStore
+
+COLORS = ["#000000", "#FF0000", "#00FF00", "#0000FF"]
+TYPES = ["line", "rect", "circle"]
+
+
+def make_shapes(count, rng):
+    for i in range(count):
+        x, y = rng.uniform(0, 10000), rng.uniform(0, 10000)
+        color = COLORS[i % len(COLORS)]
+        if i % 10 == 0:
+            yield {"type": "curve", "color": color, "id": i + 1, "seq": i + 1,
+                   "points": [{"x": x + k, "y": y + k % 3} for k in range(8)]}
+        else:
+            yield {"type": TYPES[i % len(TYPES)], "start": (x, y), "end": (x + 20, y + 10),
+                   "color": color, "id": i + 1, "seq": i + 1}
+
+
+def timed(label, count, fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {best * 1e3:9.1f} ms  {count / best / 1e6:8.2f} M shapes/sec  ({result} hits)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shapes", type=int, default=1_000_000)
+    args = parser.parse_args()
+    count = args.shapes
+    region = (2000, 2000, 6000, 6000)
+
+    gc.collect()
+    tracemalloc.start()
+    dicts = list(make_shapes(count, random.Random(1)))
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    store = ShapeStore(capacity=count)
+    for shape in make_shapes(count, random.Random(1)):
+        store.append(shape)
+    store_bytes = store.nbytes()
+
+    print(f"memory list of dicts   {dict_bytes / count:8.1f} bytes/shape")
+    print(f"memory ShapeStore      {store_bytes / count:8.1f} bytes/shape "
+          f"({dict_bytes / store_bytes:.1f}x smaller)")
+
+    dict_time = timed("scan list of dicts", count, lambda: sum(
+        1 for s in dicts
+        if s["type"] == "rect" and s["color"] == "#FF0000" and intersects(shape_bbox(s), region)))
+    store_time = timed("scan ShapeStore", count, lambda: len(
+        store.scan(0, len(store), ["rect"], ["#FF0000"], region)))
+    print(f"scan speedup {dict_time / store_time:.0f}x")
+
+    rows = store.scan(0, len(store), ["rect"], ["#FF0000"], region)
+    timed("materialize matching rows", len(rows), lambda: len(store.rows(rows)))
+
+
+if __name__ == "__main__":
+    main()
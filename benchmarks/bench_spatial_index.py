@@ -0,0 +1,74 @@
+"""
+Viewport query time of the grid index against a linear scan of the history.
+
+Shapes are spread at constant density, so a fixed 800x600 viewport holds
+about the same number of shapes at every board size and the index query
+time should stay nearly flat while the scan grows linearly:
+
+    python benchmarks/bench_spatial_index.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whiteboard.geometry import intersects
+from whiteboard.spatial_index import GridIndex
+
+SHAPES_PER_MILLION_PX = 20  # shapes per 1000x1000 board area
+VIEWPORT = (800, 600)
+
+
+def make_boxes(count, rng):
+    side = (count / SHAPES_PER_MILLION_PX) ** 0.5 * 1000
+    boxes = []
+    for _ in range(count):
+        x, y = rng.uniform(0, side), rng.uniform(0, side)
+        boxes.append((x, y, x + rng.uniform(1, 60), y + rng.uniform(1, 60)))
+    return side, boxes
+
+
+def bench(count, queries, rng):
+    side, boxes = make_boxes(count, rng)
+    index = GridIndex()
+    start = time.perf_counter()
+    for key, bbox in enumerate(boxes):
+        index.insert(key, bbox, key)
+    build = time.perf_counter() - start
+
+    viewports = []
+    for _ in range(queries):
+        x, y = rng.uniform(0, side - VIEWPORT[0]), rng.uniform(0, side - VIEWPORT[1])
+        viewports.append((x, y, x + VIEWPORT[0], y + VIEWPORT[1]))
+
+    start = time.perf_counter()
+    hits = sum(len(index.query(viewport)) for viewport in viewports)
+    indexed = (time.perf_counter() - start) / queries
+
+    scan_queries = viewports[:max(1, queries // 20)]
+    start = time.perf_counter()
+    for viewport in scan_queries:
+        [key for key, bbox in enumerate(boxes) if intersects(bbox, viewport)]
+    scan = (time.perf_counter() - start) / len(scan_queries)
+
+    print(f"{count:>9} shapes  build {build:7.2f}s  "
+          f"index {indexed * 1e3:8.3f} ms/query  scan {scan * 1e3:9.2f} ms/query  "
+          f"avg hits {hits / queries:6.1f}  speedup {scan / indexed:8.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    for count in args.sizes:
+        bench(count, args.queries, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Cold start time of the server, headless and with the Qt window.
+
+Starts main.py as a subprocess and times until GET /history answers, taking
+the best of --runs starts per mode. The window mode runs with the offscreen
+Qt platform, so no display is needed:
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_start(extra_args, port, timeout=60):
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py", "--port", str(port)] + extra_args,
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}")
+            try:
+                requests.get(f"http://127.0.0.1:{port}/history", timeout=1).raise_for_status()
+                return time.perf_counter() - start
+            except requests.ConnectionError:
+                time.sleep(0.005)
+        raise TimeoutError("server did not start")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def imports_qt():
+    """Whether importing the app module pulls in PySide6."""
+    out = subprocess.run([sys.executable, "-c", "import sys, main; print('PySide6' in sys.modules)"],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.strip() == "True"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    print(f"import main loads PySide6: {imports_qt()}")
+    for label, extra_args in (("headless", ["--headless"]), ("window", [])):
+        times = [time_start(extra_args, args.port) for _ in range(args.runs)]
+        print(f"{label:<9} first response best {min(times) * 1e3:7.0f} ms  "
+              f"median {statistics.median(times) * 1e3:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Size and speed of the binary wire format against the dict/JSON path.
+
+Builds a board (lines, rects, circles and 10% curves of --curve-points
+points) in a ShapeStore and encodes it the way init sends it: as dicts
+serialized to JSON, and as a binary frame:
+
+    python benchmarks/bench_wire.py --shapes 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from whiteboard import wire
+from whiteboard.shape_store import ShapeStore
+
+COLORS = ["#000000", "#FF0000", "#00FF00", "#0000FF"]
+TYPES = ["line", "rect", "circle"]
+
+
+def make_store(count, curve_points, rng):
+    store = ShapeStore(capacity=count)
+    for i in range(count):
+        x, y = round(rng.uniform(0, 10000), 1), round(rng.uniform(0, 10000), 1)
+        color = COLORS[i % len(COLORS)]
+        if i % 10 == 0:
+            shape = {"type": "curve", "color": color, "id": i + 1, "seq": i + 1,
+                     "points": [{"x": x + k, "y": y + k % 3} for k in range(curve_points)]}
+        else:
+            shape = {"type": TYPES[i % len(TYPES)], "start": (x, y), "end": (x + 20, y + 10),
+                     "color": color, "id": i + 1, "seq": i + 1}
+        store.append(shape)
+    return store
+
+
+def best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def frame_size(frame):
+    binary = len(frame["shapes"]) + len(frame["points"])
+    rest = {k: v for k, v in frame.items() if k not in ("shapes", "points")}
+    return binary + len(json.dumps(rest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shapes", type=int, default=100_000)
+    parser.add_argument("--curve-points", type=int, default=8)
+    args = parser.parse_args()
+    store = make_store(args.shapes, args.curve_points, random.Random(1))
+    rows = np.arange(len(store))
+
+    json_enc, text = best_of(lambda: json.dumps(store.rows(rows)))
+    json_dec, _ = best_of(lambda: json.loads(text))
+    bin_enc, frame = best_of(lambda: wire.encode_rows(store, rows))
+    bin_dec, _ = best_of(lambda: wire.decode(frame))
+    raw_dec, _ = best_of(lambda: np.frombuffer(frame["shapes"], wire.RECORD))
+
+    json_size, bin_size = len(text.encode()), frame_size(frame)
+    print(f"{args.shapes} shapes, {args.curve_points} points per curve")
+    print(f"size   json {json_size / 2**20:8.2f} MiB  binary {bin_size / 2**20:8.2f} MiB  "
+          f"({json_size / bin_size:.1f}x smaller)")
+    print(f"encode json {json_enc * 1e3:8.1f} ms   binary {bin_enc * 1e3:8.1f} ms  "
+          f"({json_enc / bin_enc:.1f}x faster)")
+    print(f"decode json {json_dec * 1e3:8.1f} ms   binary to dicts {bin_dec * 1e3:8.1f} ms, "
+          f"to a record array {raw_dec * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
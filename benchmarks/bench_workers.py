@@ -0,0 +1,117 @@
+"""
+Requests per second of the headless server with 1, 2, 4 and 8 workers.
+
+Starts `main.py --headless --workers N` as a subprocess for each N, fills
+a board with --shapes lines, then lets --clients load processes hammer it
+for --duration seconds over keep-alive HTTP, once with writes (POST
+/draw_line) and once with reads (GET /shapes over a 200x200 region):
+
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --clients 16
+
+Throughput can only grow with the worker count while there are free
+cores; on a machine with fewer cores than workers it stays flat.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOARD = "bench"
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/boards")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def request_path(kind, rng):
+    x, y = rng.uniform(0, 10000), rng.uniform(0, 10000)
+    if kind == "write":
+        return "POST", f"/draw_line?x={x:.1f}&y={y:.1f}&width=20&height=10&color=%23FF0000&board={BOARD}"
+    return "GET", f"/shapes?bbox={x:.0f},{y:.0f},{x + 200:.0f},{y + 200:.0f}&board={BOARD}"
+
+
+def load(port, kind, duration, seed, results):
+    """One load process: send requests back to back until the time is up."""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    done = errors = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        method, path = request_path(kind, rng)
+        conn.request(method, path)
+        response = conn.getresponse()
+        response.read()
+        if response.status == 200:
+            done += 1
+        else:
+            errors += 1
+    results.put((done, errors))
+
+
+def drive(port, kind, clients, duration):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=load, args=(port, kind, duration, i, results))
+             for i in range(clients)]
+    for proc in procs:
+        proc.start()
+    counts = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return sum(c[0] for c in counts) / duration, sum(c[1] for c in counts)
+
+
+def fill(port, shapes):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    rng = random.Random(0)
+    for start in range(0, shapes, 1000):
+        batch = [{"type": "line", "start": [x, y], "end": [x + 20, y + 10], "color": "#000000"}
+                 for x, y in ((rng.uniform(0, 10000), rng.uniform(0, 10000))
+                              for _ in range(min(1000, shapes - start)))]
+        conn.request("POST", f"/draw_batch?board={BOARD}", body=json.dumps(batch),
+                     headers={"Content-Type": "application/json"})
+        conn.getresponse().read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=16, help="load processes")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--shapes", type=int, default=20_000, help="shapes on the board before reading")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.clients} load processes, {args.duration:.0f} s per run")
+    print(f"{'workers':>7} {'write req/s':>12} {'read req/s':>11} {'errors':>7}")
+    for workers in args.workers:
+        command = [sys.executable, os.path.join(ROOT, "main.py"), "--headless",
+                   "--port", str(args.port), "--workers", str(workers)]
+        server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            fill(args.port, args.shapes)
+            writes, write_errors = drive(args.port, "write", args.clients, args.duration)
+            reads, read_errors = drive(args.port, "read", args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{workers:>7} {writes:>12.0f} {reads:>11.0f} {write_errors + read_errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
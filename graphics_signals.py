@@ -1,5 +0,0 @@
-
-from PySide6.QtCore import Qt, QPointF, Signal, QObject
-
-class GraphicsSignals(QObject):
-    add_shape = Signal(dict)
\ No newline at end of file
@@ -1,23 +1,40 @@
+import os
 import sys
+import json
+import math
+import argparse
+import asyncio
+import itertools
+import logging
 import threading
-from PySide6.QtWidgets import (
-    QApplication
-)
-
-from fastapi import FastAPI
+import time
+from urllib.parse import parse_qs
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import socketio
-import uvicorn
-from graphics_signals import GraphicsSignals
-from whiteboard.whiteboard import WhiteboardWindow
-from whiteboard.point import Point
-from typing import List
+from whiteboard.shape import Shape, check_shape
+from whiteboard.geometry import intersects, parse_bbox, shape_bbox
+from whiteboard.shape_store import ShapeView
+from whiteboard.boards import Board, BoardRegistry, DEFAULT_BOARD, InvalidBoard
+from whiteboard import curve, metrics, transfer, wire
+from whiteboard.dispatch import DispatchQueue, QueueFull
+from whiteboard.broadcast import Broadcaster
+from whiteboard.tiles import MAX_ZOOM, MIN_ZOOM, TileCache
+from whiteboard.bus import LocalBus, Sequencer, SocketBus
+from whiteboard.ratelimit import OverBurst, RateLimited, RateLimiter
+from whiteboard.history_cache import RawJSON, splice_json
+from typing import Dict, List, Optional
+from pydantic import TypeAdapter, ValidationError
 
 # Socket.IO 配置
 sio = socketio.AsyncServer(
     async_mode='asgi',
     cors_allowed_origins='*',  # Allow all origins
     transports=['websocket'],  # Use WebSocket transport only
+    json=splice_json,  # lets cached history JSON go out as is
 )
 app = FastAPI()
 # Add CORS middleware to the FastAPI app
@@ -29,32 +46,323 @@ app.add_middleware(
     allow_headers=["*"],
 )
 socket_app = socketio.ASGIApp(sio, app)
-whiteboard = None
+whiteboard = None  # the Qt window, None when headless
+boards = BoardRegistry()
+bus = LocalBus()  # applies board operations; a SocketBus in --workers processes
+client_boards = {}  # sid -> id of the board the client has joined
+viewports = {}  # sid -> bbox of the client's visible area
+binary_clients = set()  # sids that negotiated the binary wire format
+stroking = set()  # sids that began a stroke on their current board
+client_keys = {}  # sid -> rate limit key of the API key the client connected with
+limiter = RateLimiter()  # token buckets per connection and API key, off until --rate-limit
+imports = {}  # job id -> progress of the latest /import requests
+import_ids = itertools.count(1)
+import_batch = 1000  # shapes applied to the board at a time by /import
+playbacks = {}  # sid -> task playing a board's history back to the client
+playback_chunk = 1000  # events read from the history at a time during playback
+playback_max_gap = 2.0  # longest pause in seconds between played back events
+
+def encode_for(sid, shapes):
+    """Shapes (a list of dicts or a ShapeView) in the client's wire format."""
+    if sid in binary_clients:
+        return wire.encode_view(shapes) if isinstance(shapes, ShapeView) else wire.encode(shapes)
+    return shapes.tolist() if isinstance(shapes, ShapeView) else shapes
+
+def snapshot_for(sid, history):
+    """A board's shapes for init or join_board; JSON clients get the history's cached JSON."""
+    if sid in binary_clients:
+        return wire.encode_view(history.view())
+    return RawJSON(history.to_json()[1])
+
+broadcaster = Broadcaster(sio, viewport_of=viewports.get, encode_for=encode_for)  # new shapes -> other clients, once per tick
+boards.subscribe(broadcaster.publish)
+tile_cache = TileCache()  # rendered PNG tiles, invalidated by board changes
+boards.subscribe(tile_cache.on_change)
+curve_tolerance = 0.5  # max deviation in px when simplifying curves, 0 keeps all points
+dispatch_queue = DispatchQueue()  # board changes waiting to be rendered by the window
+queue_timeout = 5.0  # seconds a caller waits for room in a full queue, 0 rejects at once
+logger = logging.getLogger("whiteboard")
+
+REQUEST_SECONDS = metrics.histogram("whiteboard_request_seconds", "Time to handle a drawing request", ["route"])
+EVENT_SECONDS = metrics.histogram("whiteboard_event_seconds", "Time to handle a Socket.IO event", ["event"])
+metrics.gauge("whiteboard_clients", "Connected Socket.IO clients", lambda: len(client_boards))
+metrics.gauge("whiteboard_board_shapes", "Shapes in the history of each loaded board",
+              lambda: {(board_id, ): b["shapes"] for board_id, b in boards.stats()["boards"].items()}, ["board"])
+metrics.gauge("whiteboard_board_bytes", "Bytes held by the history of each loaded board",
+              lambda: {(board_id, ): b["bytes"] for board_id, b in boards.stats()["boards"].items()}, ["board"])
+metrics.gauge("whiteboard_scene_items", "Shape items in the window's scene",
+              lambda: whiteboard.item_count if whiteboard is not None else 0)
+metrics.gauge("whiteboard_dispatch_queue_depth", "Shapes waiting to be rendered by the window",
+              lambda: len(dispatch_queue))
+
+async def wait_for_window(op, shapes=None):
+    """Wait until the window's queue has room for an operation; raises QueueFull."""
+    if dispatch_queue.has_room(op, shapes):
+        return
+    # Full: wait in a worker thread so the event loop keeps serving
+    await asyncio.to_thread(dispatch_queue.wait_for_room, op, shapes, queue_timeout)
+
+async def open_board(board_id: str) -> Board:
+    """Return a board, loading it in a worker thread if it is not in memory."""
+    board = boards.loaded(board_id)
+    if board is None:
+        await bus.prepare(board_id)
+        board = await asyncio.to_thread(boards.get, board_id)
+    return board
+
+async def apply(board: Board, op, shapes=None, source=None):
+    """
+    Apply an operation to a board. If the window shows the board, wait for
+    room in its render queue first, so a lagging GUI pushes back on callers.
+    source is the sid of the client that sent it, which is not echoed back.
+    Returns (op, shapes) as applied, see Board.apply.
+    """
+    if whiteboard is not None and board is whiteboard.board:
+        await wait_for_window(op, shapes)
+    if metrics.TRACER.sample_rate and op == "add":
+        metrics.TRACER.start(shapes)
+    applied = await bus.submit(board, op, shapes, source)
+    if metrics.TRACER.active and op == "add":
+        metrics.TRACER.mark(shapes, "applied", applied[1])
+    return applied
+shape_list = TypeAdapter(List[Shape])
+
+def compact_curve(data, encoding="json", tolerance=None):
+    """
+    Decode, check and simplify the points of a curve in place.
+    encoding: json (list of {x, y}, [x, y] pairs or flat numbers) or delta
+    """
+    if encoding == "delta":
+        points = curve.decode_delta(data["points"])
+    else:
+        points = curve.to_tuples(data["points"])
+    if len(points) < 2:
+        raise ValueError("a curve needs at least two points")
+    tolerance = curve_tolerance if tolerance is None else tolerance
+    data["points"] = curve.to_dicts(curve.simplify(points, tolerance))
+
+def checked(data: dict) -> dict:
+    """The shape built by a REST draw route, checked like an imported one (finite coordinates)."""
+    try:
+        return check_shape(data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def submit_shapes(board: Board, shapes: List[Shape], source=None) -> List[int]:
+    """Add a validated batch to a board as one unit and return the shape ids."""
+    batch = [shape.to_data() for shape in shapes]
+    for data in batch:
+        if data["type"] == "curve":
+            compact_curve(data)
+    # Ids are assigned when the batch is applied
+    op, applied = await apply(board, "add", batch, source)
+    return [data["id"] for data in applied]
+
+def iter_ndjson(shapes, chunk_size=1000):
+    """Serialize shapes as NDJSON, yielding a chunk every chunk_size lines."""
+    lines = []
+    for shape in shapes:
+        lines.append(json.dumps(shape, allow_nan=False))
+        if len(lines) == chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def api_key(request: Request) -> str:
+    """The rate limit key of a REST caller: its X-API-Key header, else its address."""
+    key = request.headers.get("x-api-key")
+    if key:
+        return f"key:{key}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+async def throttle(request: Request) -> str:
+    """
+    Dependency of the drawing routes: charge one operation to the caller's
+    bucket, or answer 429. Returns the caller's key, which is also the
+    source of its changes, so the window serves REST callers in turn too.
+    """
+    key = api_key(request)
+    limiter.charge([key], 1, "rest")
+    return key
+
+def throttle_client(sid, cost: int = 1):
+    """Charge a Socket.IO event to the connection and to its API key, if it has one."""
+    limiter.charge([sid, client_keys.get(sid)], cost, "socket")
+
+def error_reply(e: Exception) -> dict:
+    """The acknowledgement of an event that was turned away."""
+    reply = {"status": "error", "message": str(e)}
+    if isinstance(e, RateLimited) and e.retry_after is not None:
+        reply["retry_after"] = round(e.retry_after, 3)
+    return reply
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request, exc):
+    if isinstance(exc, OverBurst):
+        # No wait makes it fit, so it is not a 429 with Retry-After
+        return JSONResponse(status_code=413, content={"status": "error", "message": str(exc)})
+    return JSONResponse(status_code=429, content={"status": "error", "message": str(exc)},
+                        headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request, exc):
+    return JSONResponse(status_code=503, content={"status": "error", "message": str(exc)},
+                        headers={"Retry-After": "1"})
+
+@app.exception_handler(InvalidBoard)
+async def invalid_board_handler(request, exc):
+    return JSONResponse(status_code=400, content={"status": "error", "message": str(exc)})
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request, exc):
+    # As FastAPI's own handler, except that inputs JSON can't hold (NaN, inf) are left out
+    errors = jsonable_encoder(exc.errors())
+    for error in errors:
+        try:
+            json.dumps(error.get("input"), allow_nan=False)
+        except ValueError:
+            del error["input"]
+    return JSONResponse(status_code=422, content={"detail": errors})
+
 # FastAPI路由
 @app.get("/history")
-async def get_history():
-    return whiteboard.history
+async def get_history(
+    request: Request,
+    response: Response,
+    cursor: int = 0,
+    limit: Optional[int] = Query(None, ge=1),
+    type: Optional[List[str]] = Query(None),
+    color: Optional[List[str]] = Query(None),
+    bbox: Optional[str] = None,
+    format: str = "json",
+    board: str = DEFAULT_BOARD,
+):
+    """
+    Return the drawing history of a board.
+    cursor: only return entries with a seq above this value
+    limit: maximum number of entries; X-Next-Cursor is set when more remain
+    type, color: only return matching shapes (may be repeated)
+    bbox: x1,y1,x2,y2, only return shapes intersecting this region
+    format: json (default) or ndjson to stream one shape per line
+    board: board id, every route defaults to the "default" board
+    Responses carry an ETag of the board's version; If-None-Match with it
+    gives 304 while the board is unchanged. The whole board (no parameters
+    but board) is served from the history's cached JSON.
+    """
+    try:
+        region = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    history = (await open_board(board)).history
+    # Taken before reading, so the body is never older than its ETag
+    etag = history.etag()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    if not (cursor or limit or type or color or region) and format == "json":
+        seq, text = await asyncio.to_thread(history.to_json)
+        return Response(text, media_type="application/json", headers={"ETag": history.etag(seq)})
+    # Filters run on the history columns; dicts are built while serializing,
+    # outside the history lock, so drawing is not held up.
+    shapes, next_cursor = history.select(cursor, type, color, region, limit)
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if format == "ndjson":
+        return StreamingResponse(iter_ndjson(shapes), media_type="application/x-ndjson", headers=headers)
+    response.headers.update(headers)
+    return shapes.tolist()
+
+@app.get("/history/at")
+async def get_history_at(t: float, board: str = DEFAULT_BOARD):
+    """
+    Return the board as it was at time t (Unix seconds): the shapes on it
+    after the last event at or before t, with that event's seq and time.
+    complete is false for a time before the board's known timeline (before
+    it was loaded from disk, or in an epoch that was dropped), when only the
+    shapes that are still on the board from then are known.
+    """
+    history = (await open_board(board)).history
+    seq = history.seq_at(t)
+    view, complete = history.at(seq)
+    shapes = await asyncio.to_thread(view.tolist)
+    return {"seq": seq, "t": history.time_of(seq), "complete": complete, "shapes": shapes}
+
+@app.get("/shapes")
+async def get_shapes(bbox: str, board: str = DEFAULT_BOARD):
+    """
+    Return the shapes whose bounding box intersects a region.
+    bbox: x1,y1,x2,y2
+    """
+    try:
+        region = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return (await open_board(board)).history.in_region(region)
+
+@app.get("/tiles/{z}/{x}/{y}.png")
+async def get_tile(request: Request, z: int, x: int, y: int, board: str = DEFAULT_BOARD):
+    """
+    Return a 256x256 PNG of a board region. At zoom z one tile covers
+    256 / 2**z board units, so tile x, y spans [x * span, (x + 1) * span).
+    Tiles are rendered in a worker thread and cached until a change
+    touches them; If-None-Match with the ETag gives 304.
+    """
+    if not MIN_ZOOM <= z <= MAX_ZOOM:
+        raise HTTPException(status_code=400, detail=f"z must be between {MIN_ZOOM} and {MAX_ZOOM}")
+    history = (await open_board(board)).history
+    png, etag = await asyncio.to_thread(tile_cache.get, board, history, z, x, y)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(png, media_type="image/png", headers=headers)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters, gauges and latency histograms in the Prometheus text format."""
+    if not metrics.REGISTRY.enabled:
+        raise HTTPException(status_code=404, detail="metrics are disabled (--no-metrics)")
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+async def get_traces():
+    """The latest sampled traces (--trace-sample), each following one shape through the pipeline."""
+    return metrics.TRACER.recent()
+
+@app.get("/boards")
+async def get_boards():
+    """Loaded boards with their size and clients, the load/eviction, broadcast and rate limit counters."""
+    # The pid tells the --workers processes apart, each reports its own clients and counters
+    return {**boards.stats(), "broadcast": broadcaster.stats(), "tiles": tile_cache.stats(),
+            "rate_limit": limiter.stats(), "pid": os.getpid()}
+
+@app.get("/queue")
+async def get_queue_stats():
+    """Depth and counters of the dispatch queue to the GUI thread."""
+    return dispatch_queue.stats()
 
 @app.post("/clear")
-async def clear_board():
-    whiteboard.scene.clear()
-    whiteboard.history.clear()
-    await sio.emit('clear')
+@metrics.timed(REQUEST_SECONDS, "/clear")
+async def clear_board(board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
+    # The broadcaster sends "clear" to the board's clients, the sender included
+    await apply(await open_board(board), "clear", source=source)
     return {"status": "cleared"}
 
 @app.post("/draw_line")
-async def draw_line(x: float, y: float, width: float, height:float, color: str):
+@metrics.timed(REQUEST_SECONDS, "/draw_line")
+async def draw_line(x: float, y: float, width: float, height:float, color: str, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
     data = {
         "type": "line",
         "start": (x, y),
         "end": (x + width, y + height),
         "color": color
     }
-    signals.add_shape.emit(data)
+    await apply(await open_board(board), "add", [checked(data)], source)
     return {"status": "line drawn"}
 
 @app.post("/draw_dotted_line")
-async def draw_dotted_line(x: float, y: float, width: float, height: float, color: str, dot_interval: float = 5):
+@metrics.timed(REQUEST_SECONDS, "/draw_dotted_line")
+async def draw_dotted_line(x: float, y: float, width: float, height: float, color: str, dot_interval: float = 5, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
     """
     Draw a dotted line on the whiteboard.
     x, y: start coordinates
@@ -69,22 +377,24 @@ async def draw_dotted_line(x: float, y: float, width: float, height: float, colo
         "color": color,
         "dot_interval": dot_interval
     }
-    signals.add_shape.emit(data)
+    await apply(await open_board(board), "add", [checked(data)], source)
     return {"status": "dotted line drawn"}
 
 @app.post("/draw_ellipse")
-async def draw_ellipse(x: float, y: float, rx: float, ry: float, color: str):
+@metrics.timed(REQUEST_SECONDS, "/draw_ellipse")
+async def draw_ellipse(x: float, y: float, rx: float, ry: float, color: str, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
     data = {
         "type": "circle",
         "start": (x, y),
         "end": (x + rx, y + ry),
         "color": color
     }
-    signals.add_shape.emit(data)
+    await apply(await open_board(board), "add", [checked(data)], source)
     return {"status": "ellipse drawn"} 
 
 @app.post("/draw_circle")
-async def draw_circle(x: float, y: float, radius: float, color: str):
+@metrics.timed(REQUEST_SECONDS, "/draw_circle")
+async def draw_circle(x: float, y: float, radius: float, color: str, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
     """
     Draw a circle with specified center position and radius.
     x, y: center coordinates
@@ -97,65 +407,720 @@ async def draw_circle(x: float, y: float, radius: float, color: str):
         "end": (x + radius, y + radius),
         "color": color
     }
-    signals.add_shape.emit(data)
+    await apply(await open_board(board), "add", [checked(data)], source)
     return {"status": "circle drawn"}
     
 @app.post("/draw_rect")
-async def draw_rect(x: float, y: float, width: float, height:float, color: str):
+@metrics.timed(REQUEST_SECONDS, "/draw_rect")
+async def draw_rect(x: float, y: float, width: float, height:float, color: str, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
     data = {
         "type": "rect",
         "start": (x, y),
         "end": (x + width, y + height),
         "color": color
     }
-    signals.add_shape.emit(data)
+    await apply(await open_board(board), "add", [checked(data)], source)
     return {"status": "rectangle drawn"}
 
 @app.post("/draw_curve") 
-async def draw_curve(points: str, color: str):
+@metrics.timed(REQUEST_SECONDS, "/draw_curve")
+async def draw_curve(points: str, color: str, encoding: str = "json", tolerance: Optional[float] = None, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
     """
-    Draw a curve based on at least three points.
-    Each point is an instance of the Point struct.
+    Draw a curve based on at least two points.
+    points: JSON list of {x, y} points, [x, y] pairs or flat [x0, y0, x1, y1, ...],
+            or with encoding=delta the base64 delta encoding from whiteboard.curve
+    tolerance: simplification tolerance in px, defaults to the server setting
     """
     data = {
         "type": "curve",
         "points": points,
         "color": color
     }
-    signals.add_shape.emit(data)
+    try:
+        compact_curve(data, encoding, tolerance)
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"invalid points: {e}")
+    await apply(await open_board(board), "add", [data], source)
     return {"status": "curve drawn"}
 
+@app.post("/draw_batch")
+@metrics.timed(REQUEST_SECONDS, "/draw_batch")
+async def draw_batch(request: Request, shapes: List[Shape], board: str = DEFAULT_BOARD):
+    """
+    Draw a list of mixed shapes in one request.
+    Returns the ids of the shapes in request order.
+    """
+    source = api_key(request)
+    # Every shape costs a token
+    limiter.charge([source], len(shapes), "rest")
+    ids = await submit_shapes(await open_board(board), shapes, source)
+    return {"status": "batch drawn", "ids": ids}
+
+@app.get("/shapes/{shape_id}")
+async def get_shape(shape_id: int, board: str = DEFAULT_BOARD):
+    shape = (await open_board(board)).history.get(shape_id)
+    if shape is None:
+        raise HTTPException(status_code=404, detail=f"no shape {shape_id}")
+    return shape
+
+@app.patch("/shapes/{shape_id}")
+@metrics.timed(REQUEST_SECONDS, "/shapes/{id}")
+async def update_shape(shape_id: int, patch: Dict = Body(...), board: str = DEFAULT_BOARD,
+                       source: str = Depends(throttle)):
+    """
+    Change some keys of a shape, e.g. {"color": "#FF0000"} or new
+    start/end/points; a null value removes a key. The other clients get
+    the new version in "update_shapes". Returns the new version.
+    """
+    patch = {k: v for k, v in patch.items() if k not in ("id", "seq")}
+    target = await open_board(board)
+    current = target.history.get(shape_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail=f"no shape {shape_id}")
+    try:
+        if patch.get("points") is not None:
+            compact_curve(patch)
+        # The merged shape is checked like a new one, circle radius included
+        merged = check_shape({k: v for k, v in {**current, **patch}.items() if v is not None})
+        op, shapes = await apply(target, "update", [{**{k: merged.get(k, v) for k, v in patch.items()}, "id": shape_id}], source)
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"invalid shape: {e}")
+    if not shapes:
+        raise HTTPException(status_code=404, detail=f"no shape {shape_id}")
+    return {"status": "shape updated", "shape": shapes[0]}
+
+@app.delete("/shapes/{shape_id}")
+@metrics.timed(REQUEST_SECONDS, "/shapes/{id}")
+async def delete_shape(shape_id: int, board: str = DEFAULT_BOARD, source: str = Depends(throttle)):
+    """Remove a shape; the other clients get its id in "delete_shapes"."""
+    op, shapes = await apply(await open_board(board), "delete", [{"id": shape_id}], source)
+    if not shapes:
+        raise HTTPException(status_code=404, detail=f"no shape {shape_id}")
+    return {"status": "shape deleted", "id": shape_id}
+
+@app.get("/export")
+async def export_board(board: str = DEFAULT_BOARD, format: str = "ndjson"):
+    """
+    Download a board as a gzip compressed file, built a chunk at a time.
+    format: ndjson (one shape per line) or binary (wire frames), see transfer.py
+    """
+    if format not in transfer.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(transfer.FORMATS)}")
+    view = (await open_board(board)).history.view()
+    suffix = "ndjson" if format == "ndjson" else "bin"
+    headers = {"Content-Disposition": f'attachment; filename="{board}.{suffix}.gz"'}
+    return StreamingResponse(transfer.export_chunks(view, format), media_type="application/gzip", headers=headers)
+
+@app.post("/import")
+@metrics.timed(REQUEST_SECONDS, "/import")
+async def import_board(request: Request, board: str = DEFAULT_BOARD, format: str = "ndjson",
+                       replace: bool = False):
+    """
+    Add the shapes of an uploaded board file (gzip or plain, see /export).
+    The body is parsed as it arrives and the shapes are added in batches of
+    import_batch, which reach the window and the clients like any other
+    batch; the shapes get new ids. replace clears the board first.
+    Every batch (and the clear) is charged to the caller's rate limit like
+    /draw_batch, so with a rate limit the batches are at most the burst:
+    without the tokens for the first one the answer is 429, after that the
+    import waits for them. The board stays loaded until the
+    import ends. Progress is listed by /imports. Bad input stops the import
+    with 400; the shapes before it stay on the board.
+    """
+    source = api_key(request)
+    try:
+        reader = transfer.BoardReader(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await open_board(board)
+    # Held like a client's, so the registry can't evict the board while the body streams in
+    target = boards.join(board)
+    job_id = str(next(import_ids))
+    job = imports[job_id] = {"board": board, "format": format, "bytes": 0, "shapes": 0, "done": False}
+    if len(imports) > 100:
+        del imports[next(iter(imports))]
+    logger.info("Import %s into board %s started", job_id, board)
+
+    started = False
+    async def charge(cost):
+        nonlocal started
+        while True:
+            try:
+                limiter.charge([source], cost, "rest")
+                break
+            except RateLimited as e:
+                if not started or e.retry_after is None:
+                    raise
+                # Past the first batch a 429 would leave half the file on the board
+                await asyncio.sleep(e.retry_after)
+        started = True
+
+    # A batch costing more than the burst would never be let through
+    size = max(1, min(import_batch, int(limiter.burst))) if limiter.rate else import_batch
+    pending = []
+    async def add(shapes, final=False):
+        pending.extend(shapes)
+        while len(pending) >= size or (final and pending):
+            batch = pending[:size]
+            del pending[:size]
+            await charge(len(batch))
+            await apply(target, "add", batch, source)
+            job["shapes"] += len(batch)
+
+    try:
+        if replace:
+            await charge(1)
+            await apply(target, "clear", None, source)
+        async for data in request.stream():
+            reader.feed(data)
+            job["bytes"] = reader.bytes_in
+            while shapes := await asyncio.to_thread(reader.read):
+                await add(shapes)
+        while shapes := await asyncio.to_thread(reader.close):
+            await add(shapes)
+        await add([], final=True)
+    except RateLimited as e:
+        job["error"] = str(e)
+        raise
+    except ValueError as e:
+        job["error"] = str(e)
+        await add([], final=True)
+        logger.warning("Import %s into board %s failed after %d shapes: %s", job_id, board, job["shapes"], e)
+        raise HTTPException(status_code=400, detail=f"{e} ({job['shapes']} shapes imported)")
+    finally:
+        job["done"] = True
+        boards.leave(board)
+    logger.info("Import %s into board %s done: %d shapes from %d bytes", job_id, board, job["shapes"], job["bytes"])
+    return {"status": "board imported", "shapes": job["shapes"], "job": job_id}
+
+@app.get("/imports")
+async def get_imports():
+    """Progress of the latest imports of this process: bytes received and shapes added so far."""
+    return imports
+
 # Socket.IO事件处理
+async def enter_board(sid, board_id: str) -> Board:
+    """Move a client into a board's room, leaving its previous board."""
+    board = await open_board(board_id)
+    boards.join(board_id)
+    previous = client_boards.get(sid)
+    if previous is not None:
+        await drop_strokes(sid, previous)
+        await sio.leave_room(sid, previous)
+        boards.leave(previous)
+    client_boards[sid] = board_id
+    viewports.pop(sid, None)
+    await sio.enter_room(sid, board_id)
+    # Last, so the snapshot the caller sends next and the broadcasts line up
+    broadcaster.join(sid, board_id)
+    return board
+
+async def drop_strokes(sid, board_id: str):
+    """Cancel the strokes a client left unfinished on a board."""
+    if sid in stroking:
+        stroking.discard(sid)
+        await bus.submit(boards.get(board_id), "stroke_cancel", None, sid)
+
+def client_board(sid) -> Board:
+    # A joined board stays loaded, so this never has to load
+    return boards.get(client_boards[sid])
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "connect")
+async def connect(sid, environ, auth=None):
+    """
+    Join the board from the ?board= query (or auth {"board": ...}), "default" if none.
+    ?format=binary (or auth {"format": "binary"}) selects the binary wire format.
+    ?key= (or auth {"key": ...}) is the API key whose rate limit the client shares.
+    """
+    broadcaster.start()
+    options = {key: values[0] for key, values in parse_qs(environ.get("QUERY_STRING", "")).items()}
+    if isinstance(auth, dict):
+        options.update(auth)
+    if options.get("format", "json") not in ("json", "binary"):
+        raise socketio.exceptions.ConnectionRefusedError(f"unknown format {options['format']!r}")
+    try:
+        board = await enter_board(sid, options.get("board", DEFAULT_BOARD))
+    except InvalidBoard as e:
+        raise socketio.exceptions.ConnectionRefusedError(str(e))
+    # Only once joined: a refused connection gets no disconnect that would remove it
+    if options.get("format") == "binary":
+        binary_clients.add(sid)
+    if options.get("key"):
+        client_keys[sid] = f"key:{options['key']}"
+    # Only the joining client needs the snapshot
+    await sio.emit('init', snapshot_for(sid, board.history), to=sid)
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "set_format")
+async def set_format(sid, format):
+    """Switch the client between the "json" and "binary" wire formats."""
+    if format == "binary":
+        binary_clients.add(sid)
+    elif format == "json":
+        binary_clients.discard(sid)
+    else:
+        return {"status": "error", "message": f"unknown format {format!r}"}
+    return {"format": format}
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "join_board")
+async def join_board(sid, board_id):
+    """Switch the client to another board; returns its snapshot like init."""
+    try:
+        board = await enter_board(sid, board_id)
+    except InvalidBoard as e:
+        return {"status": "error", "message": str(e)}
+    return {"board": board_id, "seq": board.history.seq, "shapes": snapshot_for(sid, board.history)}
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "sync")
+async def sync(sid, since_seq=0):
+    """
+    Return the history entries after since_seq for a reconnecting client,
+    which include new versions of updated shapes, and the ids of the shapes
+    deleted since. reset is True when the board was cleared in between (or
+    the deletes are too old to be known); the client should then drop its
+    shapes and use the returned entries as the full board.
+    """
+    try:
+        if isinstance(since_seq, bool) or (isinstance(since_seq, float) and not since_seq.is_integer()):
+            raise ValueError("not a whole number")
+        since_seq = int(since_seq or 0)
+        if since_seq < 0:
+            raise ValueError("negative")
+    except (ValueError, TypeError, OverflowError) as e:
+        return {"status": "error", "message": f"invalid seq {since_seq!r}: {e}"}
+    history = client_board(sid).history
+    reset, shapes, deleted = history.since(since_seq)
+    if sid in viewports:
+        shapes = [s for s in shapes if intersects(shape_bbox(s), viewports[sid])]
+    return {"seq": history.seq, "reset": reset, "shapes": encode_for(sid, shapes), "deleted": deleted}
+
 @sio.event
-async def connect(sid, environ):
-    await sio.emit('init', whiteboard.history)
+@metrics.timed(EVENT_SECONDS, "set_viewport")
+async def set_viewport(sid, bbox):
+    """
+    Subscribe a client to its visible area, given as [x1, y1, x2, y2] or "x1,y1,x2,y2".
+    Returns the shapes inside it; later sync calls are limited to it as well.
+    Passing None drops the subscription.
+    """
+    if bbox is None:
+        viewports.pop(sid, None)
+        return {"status": "viewport cleared"}
+    try:
+        region = parse_bbox(bbox if isinstance(bbox, str) else ",".join(str(v) for v in bbox))
+    except (TypeError, ValueError) as e:
+        return {"status": "error", "message": str(e)}
+    viewports[sid] = region
+    history = client_board(sid).history
+    return {"seq": history.seq, "shapes": encode_for(sid, history.in_region(region))}
 
 @sio.event
+@metrics.timed(EVENT_SECONDS, "draw_shape")
 async def draw_shape(sid, data):
-    signals.add_shape.emit(data)
+    """Add one shape; a curve's points may be in any curve format, or with "encoding": "delta" delta encoded."""
+    try:
+        if isinstance(data, dict) and data.get("encoding") == "delta":
+            data = {**data, "points": curve.decode_delta(data.get("points"))}
+        # Ids are assigned by the board; check_shape drops a client's own id, which would replace that shape
+        data = check_shape(data)
+        if data["type"] == "curve":
+            compact_curve(data)
+    except (ValueError, KeyError, TypeError) as e:
+        return {"status": "error", "message": f"invalid shape: {e}"}
+    try:
+        throttle_client(sid)
+        op, shapes = await apply(client_board(sid), "add", [data], sid)
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+    return {"status": "shape drawn", "id": shapes[0]["id"]}
 
 @sio.event
+@metrics.timed(EVENT_SECONDS, "draw_shapes")
+async def draw_shapes(sid, data):
+    """Add a list of shapes, as dicts or as a binary wire frame."""
+    try:
+        if wire.is_frame(data):
+            data = wire.decode(data)
+        shapes = shape_list.validate_python(data)
+    except ValidationError as e:
+        return {"status": "error", "message": str(e)}
+    except (ValueError, IndexError, KeyError, TypeError) as e:
+        return {"status": "error", "message": f"invalid frame: {e}"}
+    try:
+        throttle_client(sid, len(shapes))
+        ids = await submit_shapes(client_board(sid), shapes, sid)
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+    return {"status": "shapes drawn", "ids": ids}
+
+def stroke_points(data) -> List[float]:
+    return curve.to_flat(curve.to_tuples(data.get("points") or []))
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "stroke_begin")
+async def stroke_begin(sid, data):
+    """
+    Start streaming a curve: {"color", "points"} with its first points in
+    any curve format. Returns {"id"}, the id the finished curve will have.
+    The other clients of the board get "stroke_begin".
+    """
+    try:
+        points = stroke_points(data)
+        if not points:
+            raise ValueError("a stroke starts with at least one point")
+        stroke = {"color": str(data.get("color", "#000000")), "points": points}
+        throttle_client(sid)
+        op, strokes = await apply(client_board(sid), "stroke_begin", [stroke], sid)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {"status": "error", "message": f"invalid stroke: {e}"}
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+    stroking.add(sid)
+    return {"id": strokes[0]["id"]}
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "stroke_append")
+async def stroke_append(sid, data):
+    """
+    Add {"id", "points"} to the client's stroke. Meant to be sent without
+    an acknowledgement, throttled to a few chunks per second.
+    """
+    try:
+        throttle_client(sid)
+        await apply(client_board(sid), "stroke_append", [{"id": int(data["id"]), "points": stroke_points(data)}], sid)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {"status": "error", "message": f"invalid stroke: {e}"}
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "stroke_end")
+async def stroke_end(sid, data):
+    """
+    Finish the client's stroke {"id", "points"} (points are the last ones,
+    may be empty): it is simplified and added as a curve with the stroke's
+    id, which the other clients get in "new_shapes". A stroke with fewer
+    than two points is cancelled.
+    """
+    board = client_board(sid)
+    try:
+        throttle_client(sid)
+        shape_id = int(data["id"])
+        points = stroke_points(data)
+        if points:
+            await apply(board, "stroke_append", [{"id": shape_id, "points": points}], sid)
+        stroke = board.stroke(shape_id, sid)
+        if stroke is None:
+            return {"status": "error", "message": f"no stroke {shape_id}"}
+        shape = {"type": "curve", "color": stroke["color"], "points": stroke["points"], "id": shape_id}
+        try:
+            compact_curve(shape)
+        except ValueError as e:
+            await apply(board, "stroke_cancel", [{"id": shape_id}], sid)
+            return {"status": "error", "message": f"invalid stroke: {e}"}
+        await apply(board, "add", [shape], sid)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {"status": "error", "message": f"invalid stroke: {e}"}
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+    return {"status": "shape drawn", "id": shape_id}
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "clear")
 async def clear(sid):
-    await clear_board()
+    try:
+        throttle_client(sid)
+        await apply(client_board(sid), "clear", source=sid)
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+
+async def revert(sid, op):
+    try:
+        throttle_client(sid)
+        op, shapes = await apply(client_board(sid), op, source=sid)
+    except (QueueFull, RateLimited) as e:
+        return error_reply(e)
+    if op == "delete":
+        return {"op": op, "ids": [s["id"] for s in shapes]}
+    return {"op": op, "shapes": encode_for(sid, shapes)}
 
 @sio.event
+@metrics.timed(EVENT_SECONDS, "undo")
+async def undo(sid):
+    """
+    Revert the client's latest add, update or delete on its board. Returns
+    what that did, as {"op": "add"|"update", "shapes"} or {"op": "delete",
+    "ids"}, for the client to apply itself; op is None if there was nothing
+    to undo. The other clients get it as a normal change.
+    """
+    return await revert(sid, "undo")
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "redo")
+async def redo(sid):
+    """Reapply the client's latest undo; returns like undo."""
+    return await revert(sid, "redo")
+
+def playback_message(events) -> dict:
+    """Merge consecutive history events of one kind into a "playback" message."""
+    merged = []
+    for seq, t, op, data in events:
+        key, items = ("ids", data) if op == "delete" else ("shapes", [data])
+        if op == "clear":
+            merged.append({"op": op})
+        elif merged and merged[-1]["op"] == op:
+            merged[-1][key].extend(items)
+        else:
+            merged.append({"op": op, key: list(items)})
+    seq, t = events[-1][:2]
+    return {"events": merged, "seq": seq, "t": t}
+
+async def play(sid, history, seq: int, until: int, speed: float):
+    """
+    Send a client the board after event seq of a history, then the events
+    up to until, as many seconds apart as they happened divided by speed,
+    with pauses capped at playback_max_gap. Events due within a frame go
+    out in one message.
+    """
+    board_t = history.time_of(seq)
+    deadline = time.monotonic()
+    pending = []
+    try:
+        view, complete = history.at(seq)
+        shapes = await asyncio.to_thread(view.tolist)
+        await sio.emit("playback", {"events": [{"op": "reset", "shapes": shapes}], "seq": seq, "t": board_t,
+                                    "complete": complete}, to=sid)
+        while seq < until:
+            end = min(seq + playback_chunk, until)
+            for event in await asyncio.to_thread(history.changes, seq, end):
+                t = event[1]
+                deadline += min((t - board_t) / speed, playback_max_gap) if board_t is not None else 0
+                board_t = t
+                delay = deadline - time.monotonic()
+                if delay > 0.02 and pending:
+                    await sio.emit("playback", playback_message(pending), to=sid)
+                    pending = []
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                pending.append(event)
+            seq = end
+        if pending:
+            await sio.emit("playback", playback_message(pending), to=sid)
+        await sio.emit("playback_end", {"seq": until, "t": history.time_of(until)}, to=sid)
+    finally:
+        if playbacks.get(sid) is asyncio.current_task():
+            del playbacks[sid]
+
+def stop_playback(sid) -> bool:
+    task = playbacks.pop(sid, None)
+    if task is not None:
+        task.cancel()
+    return task is not None
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "play_history")
+async def play_history(sid, data):
+    """
+    Play the client's board back from time data["t"] (Unix seconds) at
+    data["speed"] times the original pace (default 1) until data["until"]
+    (default now). Returns the seq and time playback starts from. "playback"
+    messages {"events": [{"op", "shapes" | "ids"}, ...], "seq", "t"} carry
+    the board, first as a "reset" to the board at t (with "complete" as in
+    /history/at), then its changes: "add", "update", "delete" and "clear".
+    "playback_end" {"seq", "t"} follows the last.
+    Playback reads the history only, so live drawing goes on as usual and
+    the client keeps getting its live events. A new play_history or
+    stop_history ends a running playback.
+    """
+    try:
+        throttle_client(sid)
+        t = float(data["t"])
+        speed = float(data.get("speed", 1))
+        if not speed > 0:
+            raise ValueError("speed must be positive")
+        history = client_board(sid).history
+        until = history.seq if data.get("until") is None else history.seq_at(float(data["until"]))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {"status": "error", "message": f"invalid playback: {e}"}
+    except RateLimited as e:
+        return error_reply(e)
+    stop_playback(sid)
+    seq = history.seq_at(t)
+    playbacks[sid] = asyncio.create_task(play(sid, history, seq, max(seq, until), speed))
+    return {"status": "playing", "seq": seq, "t": history.time_of(seq)}
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "stop_history")
+async def stop_history(sid):
+    """End the client's playback, if it has one."""
+    return {"status": "stopped" if stop_playback(sid) else "not playing"}
+
+@sio.event
+@metrics.timed(EVENT_SECONDS, "disconnect")
 async def disconnect(sid):
-    print(f"Client {sid} disconnected")
+    viewports.pop(sid, None)
+    stop_playback(sid)
+    binary_clients.discard(sid)
+    broadcaster.leave(sid)
+    limiter.forget(sid)
+    client_keys.pop(sid, None)
+    board_id = client_boards.pop(sid, None)
+    if board_id is not None:
+        await drop_strokes(sid, board_id)
+        boards.leave(board_id)
+    logger.info("Client %s disconnected", sid)
+
+def start_server(host="0.0.0.0", port=8000):
+    import uvicorn
+    uvicorn.run(socket_app, host=host, port=port)
+
+def configure(args, loader=None):
+    """Apply the command line settings to the server state."""
+    global curve_tolerance, queue_timeout, dispatch_queue, boards
+    curve_tolerance = args.curve_tolerance
+    queue_timeout = args.queue_timeout
+    dispatch_queue = DispatchQueue(args.queue_size)
+    boards = BoardRegistry(None if loader else args.data_dir, int(args.memory_budget_mb * 2**20),
+                           args.snapshot_every, loader)
+    boards.subscribe(broadcaster.publish)
+    boards.subscribe(tile_cache.on_change)
+    broadcaster.interval = args.broadcast_interval_ms / 1000
+    tile_cache.max_tiles = args.tile_cache_size
+    metrics.REGISTRY.enabled = not args.no_metrics
+    metrics.TRACER.sample_rate = args.trace_sample
+    limiter.rate = args.rate_limit
+    limiter.burst = args.rate_burst
+
+WORKER_RESTART = 3  # exit code of a worker that lost the sequencer, run_workers starts a new one
+
+def run_worker(args, sock, bus_path):
+    """One process of --workers: serves on the shared socket with boards copied from the sequencer."""
+    global bus
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(socket_app, log_level="warning"))
+    # Its copies of the boards are stale without the sequencer; a new process loads them again
+    bus = SocketBus(bus_path, on_lost=lambda: setattr(server, "should_exit", True))
+    configure(args, loader=bus.load_board)
+    server.run(sockets=[sock])
+    if bus.lost:
+        sys.exit(WORKER_RESTART)
+
+def run_workers(args):
+    """
+    Serve from args.workers headless processes on one port. Boards are kept
+    in step by a sequencer in this process, which also persists them.
+    """
+    import multiprocessing
+    import multiprocessing.connection
+    import signal
+    import socket
+    import tempfile
+    registry = BoardRegistry(args.data_dir, int(args.memory_budget_mb * 2**20), args.snapshot_every)
+    sequencer = Sequencer(registry)
+    bus_path = os.path.join(tempfile.mkdtemp(prefix="whiteboard-"), "bus.sock")
+    started = threading.Event()
+    threading.Thread(target=lambda: asyncio.run(sequencer.serve(bus_path, started)), daemon=True).start()
+    started.wait()
 
-def start_server():
-    uvicorn.run(socket_app, host="0.0.0.0", port=8000)
+    # Bound once here; the workers accept on the same socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Accepted sockets inherit it; without it small responses wait on delayed ACKs
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    context = multiprocessing.get_context("spawn")
+
+    def start_worker():
+        worker = context.Process(target=run_worker, args=(args, sock, bus_path), daemon=True)
+        worker.start()
+        return worker
+
+    workers = [start_worker() for _ in range(args.workers)]
+    # Stopping the parent stops the workers too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while workers:
+            multiprocessing.connection.wait([worker.sentinel for worker in workers])
+            for worker in [worker for worker in workers if not worker.is_alive()]:
+                workers.remove(worker)
+                if worker.exitcode == WORKER_RESTART:
+                    logger.warning("Worker %s lost the sequencer, starting a new one", worker.pid)
+                    workers.append(start_worker())
+    finally:
+        for worker in workers:
+            worker.terminate()
+        registry.close()
 
 if __name__ == "__main__":
-    app_qt = QApplication(sys.argv)
-    whiteboard = WhiteboardWindow()
-    signals = GraphicsSignals()
-    
-    # 信号连接
-    signals.add_shape.connect(whiteboard.add_remote_shape)
+    parser = argparse.ArgumentParser(description="Collaborative whiteboard")
+    parser.add_argument("--headless", action="store_true",
+                        help="run only the server, without Qt or a window")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="serve from this many headless processes sharing the port")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--data-dir", help="persist each board in a subdirectory of this directory")
+    parser.add_argument("--board", default=DEFAULT_BOARD, help="id of the board shown in the window")
+    parser.add_argument("--memory-budget-mb", type=float, default=1024,
+                        help="evict idle boards once loaded histories exceed this (needs --data-dir)")
+    parser.add_argument("--snapshot-every", type=int, default=100_000,
+                        help="write a snapshot after this many logged events")
+    parser.add_argument("--curve-tolerance", type=float, default=curve_tolerance,
+                        help="simplify curves to within this many px, 0 keeps all points")
+    parser.add_argument("--queue-size", type=int, default=dispatch_queue.capacity,
+                        help="max shapes waiting for the GUI thread")
+    parser.add_argument("--queue-timeout", type=float, default=queue_timeout,
+                        help="seconds a caller waits when the queue is full before a 503, 0 rejects at once")
+    parser.add_argument("--frame-budget-ms", type=float, default=8,
+                        help="GUI time per 16 ms frame spent adding queued shapes")
+    parser.add_argument("--broadcast-interval-ms", type=float, default=16,
+                        help="new shapes are sent to other clients in one frame per this interval")
+    parser.add_argument("--tile-cache-size", type=int, default=tile_cache.max_tiles,
+                        help="max rendered map tiles kept in memory")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="turn off the latency histograms and counters behind /metrics")
+    parser.add_argument("--trace-sample", type=float, default=0,
+                        help="fraction of drawing operations traced from ingress to render, see /traces")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="shapes per second each connection and API key may draw, 0 for no limit")
+    parser.add_argument("--rate-burst", type=float, default=limiter.burst,
+                        help="shapes a connection or API key may draw at once before --rate-limit applies")
+    parser.add_argument("--render-mode", choices=["quality", "fast"], default="quality",
+                        help="fast uses level of detail and item caching for large boards")
+    args, qt_args = parser.parse_known_args()
+    if args.workers > 1:
+        run_workers(args)
+        sys.exit(0)
+    configure(args)
+
+    if args.headless:
+        try:
+            start_server(args.host, args.port)
+        finally:
+            boards.close()
+        sys.exit(0)
+
+    # Qt is only imported for the window, headless startup never pays for it
+    from PySide6.QtWidgets import QApplication
+    from whiteboard.whiteboard import WhiteboardWindow
+
+    app_qt = QApplication(sys.argv[:1] + qt_args)
+    whiteboard = WhiteboardWindow(boards.pin(BoardRegistry.check_id(args.board)))
+    whiteboard.curve_tolerance = curve_tolerance
+    metrics.TRACER.final = "rendered"
+    # Also rebuilds the scene from a restored history
+    whiteboard.set_render_mode(args.render_mode)
+
+    # GUI线程按帧处理队列
+    whiteboard.start_dispatch(dispatch_queue, budget_ms=args.frame_budget_ms)
     
     # 启动服务器线程
-    server_thread = threading.Thread(target=start_server, daemon=True)
+    server_thread = threading.Thread(target=start_server, args=(args.host, args.port), daemon=True)
     server_thread.start()
     whiteboard.show()
     res = app_qt.exec()
-    sys.exit(res)
\ No newline at end of file
+    boards.close()
+    sys.exit(res)
@@ -1,12 +1,54 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import time
 import pytest
 import requests
 from socketio import Client
+from whiteboard import curve, wire
+from whiteboard.dispatch import DispatchQueue, drain
 
 BASE_URL = "http://localhost:8000"
 
+@pytest.fixture(scope="session", autouse=True)
+def server():
+    """Use the server already running on localhost:8000, or start a headless one for the session."""
+    try:
+        requests.get(f"{BASE_URL}/boards", timeout=1)
+        yield
+        return
+    except requests.ConnectionError:
+        pass
+    process = spawn_server(8000)
+    yield
+    process.terminate()
+    process.wait()
+
+def spawn_server(port, *args, headless=True):
+    """Start a server (headless, or with an offscreen window) with extra command line args and wait until it answers."""
+    mode = ["--headless"] if headless else []
+    env = {**os.environ, "QT_QPA_PLATFORM": os.environ.get("QT_QPA_PLATFORM", "offscreen")}
+    process = subprocess.Popen([sys.executable, "main.py", *mode, "--port", str(port), *args],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.time() + 30
+    while True:
+        try:
+            requests.get(f"http://localhost:{port}/boards", timeout=1)
+            return process
+        except (requests.ConnectionError, requests.Timeout):  # --workers: bound, not serving yet
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                pytest.exit("could not start the server", returncode=1)
+            time.sleep(0.1)
+
 @pytest.fixture
 def client():
-    return Client(transports=["websocket"])
+    sio_client = Client()
+    sio_client.connect(BASE_URL, transports=["websocket"])
+    yield sio_client
+    sio_client.disconnect()
 
 def test_get_history():
     response = requests.get(f"{BASE_URL}/history")
@@ -67,10 +109,699 @@ def test_draw_rect():
     assert response.status_code == 200
     assert response.json() == {"status": "rectangle drawn"}
     print("test_draw_rect passed!")
+
+def test_draw_curve_simplified():
+    """Collinear points are simplified away; flat and delta encodings are accepted."""
+    flat = [v for i in range(100) for v in (i, 2 * i)]
+    response = requests.post(f"{BASE_URL}/draw_curve", params={"points": json.dumps(flat), "color": "#0000FF"})
+    assert response.status_code == 200
+    assert response.json() == {"status": "curve drawn"}
+    time.sleep(0.2)
+    last = requests.get(f"{BASE_URL}/history").json()[-1]
+    assert last["points"] == [{"x": 0, "y": 0}, {"x": 99, "y": 198}]
+
+    encoded = curve.encode_delta([(0, 0), (10, 5), (20, 0)])
+    response = requests.post(f"{BASE_URL}/draw_curve", params={"points": encoded, "color": "#0000FF", "encoding": "delta"})
+    assert response.status_code == 200
+    response = requests.post(f"{BASE_URL}/draw_curve", params={"points": "[1]", "color": "#0000FF"})
+    assert response.status_code == 400
+    too_long = [[i, i % 7] for i in range(curve.MAX_POINTS + 1)]
+    response = requests.post(f"{BASE_URL}/draw_batch", json=[{"type": "curve", "points": too_long, "color": "#0000FF"}])
+    assert response.status_code == 422
+    print("test_draw_curve_simplified passed!")
+
+def test_draw_batch():
+    """Test the /draw_batch endpoint with mixed shapes."""
+    shapes = [
+        {"type": "line", "start": [0, 0], "end": [10, 10], "color": "#FF0000"},
+        {"type": "rect", "start": [20, 20], "end": [40, 40], "color": "#00FF00"},
+        {"type": "curve", "points": [{"x": 0, "y": 0}, {"x": 5, "y": 8}, {"x": 10, "y": 0}], "color": "#0000FF"},
+    ]
+    response = requests.post(f"{BASE_URL}/draw_batch", json=shapes)
+    assert response.status_code == 200
+    ids = response.json()["ids"]
+    assert len(ids) == len(shapes)
+    assert len(set(ids)) == len(shapes)
+    print("test_draw_batch passed!")
+
+def test_draw_batch_invalid():
+    """A batch with an invalid shape is rejected as a whole."""
+    shapes = [
+        {"type": "line", "start": [0, 0], "end": [10, 10], "color": "#FF0000"},
+        {"type": "curve", "points": [], "color": "#0000FF"},
+    ]
+    response = requests.post(f"{BASE_URL}/draw_batch", json=shapes)
+    assert response.status_code == 422
+    print("test_draw_batch_invalid passed!")
+
+def test_draw_non_finite():
+    """NaN and infinite coordinates are rejected before they reach the board."""
+    before = requests.get(f"{BASE_URL}/history").json()
+    for x in ["nan", "inf", "1e400"]:
+        params = {"x": x, "y": 0, "width": 10, "height": 10, "color": "#FF0000"}
+        response = requests.post(f"{BASE_URL}/draw_line", params=params)
+        assert response.status_code == 422
+    response = requests.post(f"{BASE_URL}/draw_batch", data='[{"type": "line", "start": [0, 1e400], "end": [1, 1], "color": "#FF0000"}]',
+                             headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    response = requests.post(f"{BASE_URL}/draw_curve", params={"points": "[0, 0, NaN, 1]", "color": "#FF0000"})
+    assert response.status_code == 400
+    # Nothing half-applied, and the history is still valid JSON
+    assert json.loads(requests.get(f"{BASE_URL}/history").text) == before
+    print("test_draw_non_finite passed!")
+
+def test_draw_shape_invalid(client):
+    """draw_shape acknowledges a malformed shape with an error instead of storing it."""
+    for data in [{"type": "line"}, {"type": "hexagon", "start": [0, 0], "end": [1, 1]}, "line", [1, 2],
+                 {"type": "line", "start": [0, 0], "end": [1, 1], "color": 5},
+                 {"type": "curve", "points": "not base64", "encoding": "delta"}]:
+        result = client.call("draw_shape", data)
+        assert result["status"] == "error", data
+    result = client.call("draw_shape", {"type": "line", "start": [0, 0], "end": [1, 1], "color": "#FF0000"})
+    assert result["status"] == "shape drawn"
+    print("test_draw_shape_invalid passed!")
+
+def test_queue_stats():
+    """The dispatch queue reports its depth and counters."""
+    response = requests.get(f"{BASE_URL}/queue")
+    assert response.status_code == 200
+    stats = response.json()
+    assert 0 <= stats["depth"] <= max(stats["capacity"], stats["max_depth"])
+    assert stats["drained"] <= stats["enqueued"]
+    print("test_queue_stats passed!")
+
+def test_queue_full():
+    """While the window renders a bulk batch, writes get 503 at once with --queue-timeout 0, or wait for room."""
+    lines = [{"type": "line", "start": [i, 0], "end": [i, 1], "color": "#FF0000"} for i in range(5000)]
+    line = {"type": "line", "start": [0, 0], "end": [1, 1], "color": "#FF0000"}
+    for port, timeout in ((8014, "0"), (8015, "30")):
+        # One chunk of 256 shapes per 16 ms frame, so the batch takes a while to render
+        process = spawn_server(port, "--queue-size", "1", "--queue-timeout", timeout, "--frame-budget-ms", "0.1",
+                               headless=False)
+        url = f"http://localhost:{port}"
+        try:
+            assert requests.post(f"{url}/draw_batch", json=lines).status_code == 200
+            response = requests.post(f"{url}/draw_batch", json=[line])
+            stats = requests.get(f"{url}/queue").json()
+            if timeout == "0":
+                assert response.status_code == 503
+                assert response.headers["Retry-After"] == "1"
+                assert stats["rejected"] == 1 and stats["waited"] == 0
+                assert len(requests.get(f"{url}/history").json()) == len(lines)
+            else:
+                assert response.status_code == 200
+                assert stats["rejected"] == 0 and stats["waited"] == 1
+                assert len(requests.get(f"{url}/history").json()) == len(lines) + 1
+        finally:
+            process.terminate()
+            process.wait()
+    print("test_queue_full passed!")
+
+def test_dispatch_turns():
+    """A source drawing in bulk and one drawing single shapes take turns; a delete or clear keeps its place."""
+    queue = DispatchQueue()
+    queue.push("add", [{"id": i} for i in range(1000)], "flood")
+    for i in range(3):
+        queue.push("add", [{"id": 1000 + i}], "single")
+    queue.push("delete", [{"id": 0}], "single")  # e.g. an undo
+    queue.push("add", [{"id": 2000}], "flood")
+    queue.push("clear", None, "single")
+    queue.push("add", [{"id": 3000}], "single")
+    handled = []
+    while len(queue):
+        drain(queue, lambda op, shapes: handled.append((op, [s["id"] for s in shapes or []])), 1, chunk=64)
+    order = [(op, shape_id) for op, ids in handled for shape_id in ids or [None]]
+    # The single shapes are not held up behind the bulk batch
+    singles = [order.index(("add", 1000 + i)) for i in range(3)]
+    assert singles == sorted(singles) and singles[-1] < 4 * 64
+    assert order.index(("add", 999)) > singles[-1]
+    # Barriers wait for everything queued before them and hold back everything after
+    delete = order.index(("delete", 0))
+    assert delete == 1003 and order[delete + 1:] == [("add", 2000), ("clear", None), ("add", 3000)]
+    print("test_dispatch_turns passed!")
+
+def test_sync(client):
+    """A reconnecting client only receives the entries after its last seq."""
+    seq = client.call("sync", 0)["seq"]
+    requests.post(
+        f"{BASE_URL}/draw_line",
+        params={"x": 1, "y": 2, "width": 3, "height": 4, "color": "#FF0000"}
+    )
+    time.sleep(0.2)  # the shape is added on the GUI thread
+    result = client.call("sync", seq)
+    assert result["reset"] is False
+    assert len(result["shapes"]) == 1
+    assert result["shapes"][0]["seq"] > seq
+    assert result["seq"] == result["shapes"][0]["seq"]
+    for since_seq in ["abc", -1, 1.5, [1], {"seq": 1}, True]:
+        assert client.call("sync", since_seq)["status"] == "error"
+    print("test_sync passed!")
+
+def test_get_history_paginated():
+    """Walk the history with cursor/limit and filter by type."""
+    requests.post(f"{BASE_URL}/draw_batch", json=[
+        {"type": "rect", "start": [i, i], "end": [i + 5, i + 5], "color": "#00FF00"}
+        for i in range(5)
+    ])
+    time.sleep(0.2)
+    cursor, pages = 0, []
+    while True:
+        response = requests.get(f"{BASE_URL}/history", params={"cursor": cursor, "limit": 2, "type": "rect"})
+        assert response.status_code == 200
+        pages.append(response.json())
+        assert len(pages[-1]) <= 2
+        assert all(shape["type"] == "rect" for shape in pages[-1])
+        if "X-Next-Cursor" not in response.headers:
+            break
+        cursor = int(response.headers["X-Next-Cursor"])
+    seqs = [shape["seq"] for page in pages for shape in page]
+    assert seqs == sorted(set(seqs))
+    assert len(seqs) >= 5
+    print("test_get_history_paginated passed!")
+
+def test_get_history_ndjson():
+    """Stream the history as NDJSON restricted to a region."""
+    response = requests.get(f"{BASE_URL}/history", params={"format": "ndjson", "bbox": "0,0,3,3"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    for line in response.text.splitlines():
+        shape = json.loads(line)
+        assert "seq" in shape
+    assert requests.get(f"{BASE_URL}/history", params={"bbox": "1,2"}).status_code == 400
+    print("test_get_history_ndjson passed!")
+
+def test_get_history_etag():
+    """Unchanged polls get 304 and a change a new ETag; init carries the same cached shapes."""
+    board = f"test-{int(time.time() * 1000)}"
+    url = f"{BASE_URL}/history"
+    requests.post(f"{BASE_URL}/draw_line", params={
+        "x": 1, "y": 1, "width": 2, "height": 2, "color": "#123456", "board": board
+    })
+    first = requests.get(url, params={"board": board})
+    etag = first.headers["ETag"]
+    assert first.headers["content-type"] == "application/json"
+    assert requests.get(url, params={"board": board}, headers={"If-None-Match": etag}).status_code == 304
+    requests.post(f"{BASE_URL}/draw_rect", params={
+        "x": 5, "y": 5, "width": 3, "height": 3, "color": "#654321", "board": board
+    })
+    second = requests.get(url, params={"board": board}, headers={"If-None-Match": etag})
+    assert second.status_code == 200 and second.headers["ETag"] != etag
+    assert [shape["color"] for shape in second.json()] == ["#123456", "#654321"]
+    init = []
+    sio_client = Client()
+    sio_client.on("init", init.append)
+    sio_client.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        time.sleep(0.2)
+        assert init == [second.json()]
+    finally:
+        sio_client.disconnect()
+    print("test_get_history_etag passed!")
+
+def test_get_shapes_bbox():
+    """Only shapes intersecting the region are returned."""
+    requests.post(f"{BASE_URL}/draw_batch", json=[
+        {"type": "line", "start": [5000, 5000], "end": [5010, 5010], "color": "#FF0000"},
+        {"type": "line", "start": [9000, 9000], "end": [9010, 9010], "color": "#FF0000"},
+    ])
+    time.sleep(0.2)
+    response = requests.get(f"{BASE_URL}/shapes", params={"bbox": "4990,4990,5020,5020"})
+    assert response.status_code == 200
+    shapes = response.json()
+    assert shapes and all(shape["start"] == [5000, 5000] for shape in shapes)
+    assert requests.get(f"{BASE_URL}/shapes", params={"bbox": "nan,0,1,1"}).status_code == 400
+    assert requests.get(f"{BASE_URL}/history", params={"bbox": "0,0,inf,inf"}).status_code == 400
+    print("test_get_shapes_bbox passed!")
+
+def test_set_viewport(client):
+    """A viewport subscription returns the shapes in view and scopes sync."""
+    result = client.call("set_viewport", [4990, 4990, 5020, 5020])
+    assert result["shapes"]
+    assert all(shape["start"] == [5000, 5000] for shape in result["shapes"])
+    synced = client.call("sync", 0)
+    assert all(shape["start"] == [5000, 5000] for shape in synced["shapes"])
+    assert client.call("set_viewport", "0,0,inf,1")["status"] == "error"
+    print("test_set_viewport passed!")
+
+def test_boards_isolated():
+    """Shapes and clears on one board do not reach another board or its clients."""
+    board = f"test-{int(time.time() * 1000)}"
+    cleared = []
+    sio_client = Client()
+    sio_client.on("clear", lambda: cleared.append(True))
+    sio_client.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        requests.post(f"{BASE_URL}/draw_line", params={
+            "x": 1, "y": 1, "width": 2, "height": 2, "color": "#123456", "board": board
+        })
+        shapes = requests.get(f"{BASE_URL}/history", params={"board": board}).json()
+        assert [shape["color"] for shape in shapes] == ["#123456"]
+        assert sio_client.call("sync", 0)["shapes"] == shapes
+        default = requests.get(f"{BASE_URL}/history", params={"color": "#123456"}).json()
+        assert default == []
+        requests.post(f"{BASE_URL}/clear")
+        time.sleep(0.2)
+        assert cleared == []
+        requests.post(f"{BASE_URL}/clear", params={"board": board})
+        time.sleep(0.2)
+        assert cleared == [True]
+        assert requests.get(f"{BASE_URL}/history", params={"board": "bad/id"}).status_code == 400
+    finally:
+        sio_client.disconnect()
+    print("test_boards_isolated passed!")
+
+def test_new_shapes_broadcast():
+    """Shapes drawn by one client reach the others in a batched frame, but not the sender."""
+    board = f"test-{int(time.time() * 1000)}"
+    received = {"a": [], "b": []}
+    clients = {}
+    for name in received:
+        clients[name] = Client()
+        clients[name].on("new_shapes", lambda shapes, name=name: received[name].extend(shapes))
+        clients[name].connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        result = clients["a"].call("draw_shapes", [
+            {"type": "line", "start": [i, i], "end": [i + 1, i + 1], "color": "#FF0000"} for i in range(3)
+        ])
+        time.sleep(0.3)
+        assert [shape["id"] for shape in received["b"]] == result["ids"]
+        assert received["a"] == []
+    finally:
+        for sio_client in clients.values():
+            sio_client.disconnect()
+    print("test_new_shapes_broadcast passed!")
+
+def test_update_delete_undo():
+    """Updates, deletes and undos reach the other clients as deltas keyed by shape id."""
+    board = f"test-{int(time.time() * 1000)}"
+    received = []
+    other = Client()
+    other.on("update_shapes", lambda shapes: received.append(("update", shapes)))
+    other.on("delete_shapes", lambda ids: received.append(("delete", ids)))
+    other.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    sio_client = Client()
+    sio_client.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        shape_id = sio_client.call("draw_shape", {
+            "type": "line", "start": [0, 0], "end": [10, 10], "color": "#000000"})["id"]
+        url = f"{BASE_URL}/shapes/{shape_id}"
+        response = requests.patch(url, params={"board": board}, json={"color": "#FF0000"})
+        assert response.status_code == 200
+        assert response.json()["shape"]["color"] == "#FF0000"
+        for patch in ({"start": None}, {"end": ["a", 1]}, {"color": 5}):
+            assert requests.patch(url, params={"board": board}, json=patch).status_code == 422, patch
+        time.sleep(0.3)
+        assert received == [("update", [response.json()["shape"]])]
+
+        # The client undoes its draw: the shape is gone for everyone, and redo brings it back
+        result = sio_client.call("undo")
+        assert result == {"op": "delete", "ids": [shape_id]}
+        assert requests.get(url, params={"board": board}).status_code == 404
+        time.sleep(0.3)
+        assert received[-1] == ("delete", [shape_id])
+        result = sio_client.call("redo")
+        assert result["op"] == "add" and result["shapes"][0]["color"] == "#FF0000"
+        assert sio_client.call("redo")["op"] is None
+
+        seq = sio_client.call("sync", 0)["seq"]
+        assert requests.delete(url, params={"board": board}).status_code == 200
+        assert requests.delete(url, params={"board": board}).status_code == 404
+        result = sio_client.call("sync", seq)
+        assert result["reset"] is False and result["deleted"] == [shape_id]
+        assert requests.get(f"{BASE_URL}/history", params={"board": board}).json() == []
+    finally:
+        other.disconnect()
+        sio_client.disconnect()
+    print("test_update_delete_undo passed!")
+
+def test_history_at_and_playback():
+    """The board at an earlier time comes back from the timeline and plays back from there."""
+    board = f"test-{int(time.time() * 1000)}"
+    messages, ended = [], []
+    sio_client = Client()
+    sio_client.on("playback", messages.append)
+    sio_client.on("playback_end", ended.append)
+    sio_client.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        first = sio_client.call("draw_shape", {
+            "type": "line", "start": [0, 0], "end": [10, 10], "color": "#000000"})["id"]
+        time.sleep(0.05)
+        middle = time.time()
+        time.sleep(0.05)
+        second = sio_client.call("draw_shape", {
+            "type": "rect", "start": [5, 5], "end": [20, 20], "color": "#FF0000"})["id"]
+        assert sio_client.call("undo")["ids"] == [second]
+        sio_client.call("clear")
+        now = requests.get(f"{BASE_URL}/history/at", params={"t": time.time() + 1, "board": board}).json()
+        assert now["shapes"] == [] and now["t"] >= middle
+
+        result = sio_client.call("play_history", {"t": middle, "speed": 100})
+        assert result["status"] == "playing" and result["t"] <= middle
+        deadline = time.time() + 5
+        while not ended and time.time() < deadline:
+            time.sleep(0.05)
+        assert ended
+        events = [event for message in messages for event in message["events"]]
+        assert [event["op"] for event in events] == ["reset", "add", "delete", "clear"]
+        assert messages[0]["complete"] is True
+        assert [shape["id"] for shape in events[0]["shapes"]] == [first]
+        assert events[0]["shapes"][0]["t"] <= middle
+        assert events[1]["shapes"][0]["id"] == second and events[2]["ids"] == [second]
+        assert sio_client.call("play_history", {"t": middle, "speed": 0})["status"] == "error"
+        assert sio_client.call("stop_history")["status"] == "not playing"
+    finally:
+        sio_client.disconnect()
+    print("test_history_at_and_playback passed!")
+
+def test_stroke_streaming():
+    """A stroke reaches the other clients in chunks while drawn and ends as one curve with its id."""
+    board = f"test-{int(time.time() * 1000)}"
+    events = []
+    viewer = Client()
+    for name in ("stroke_begin", "stroke_append", "stroke_cancel", "new_shapes"):
+        viewer.on(name, lambda data, name=name: events.append((name, data)))
+    viewer.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    drawer = Client()
+    drawer.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        shape_id = drawer.call("stroke_begin", {"color": "#00FF00", "points": [0, 0]})["id"]
+        drawer.emit("stroke_append", {"id": shape_id, "points": [1, 0, 2, 0]})
+        drawer.emit("stroke_append", {"id": shape_id, "points": [[3, 0], [4, 5]]})
+        time.sleep(0.3)
+        assert events[0] == ("stroke_begin", [{"id": shape_id, "color": "#00FF00", "points": [0, 0]}])
+        streamed = [p for name, chunks in events[1:] for chunk in chunks for p in chunk["points"]]
+        assert streamed == [1, 0, 2, 0, 3, 0, 4, 5]
+        # Not in the history until it ends
+        assert requests.get(f"{BASE_URL}/history", params={"board": board}).json() == []
+
+        result = drawer.call("stroke_end", {"id": shape_id, "points": [10, 5]})
+        assert result["id"] == shape_id
+        time.sleep(0.3)
+        name, shapes = events[-1]
+        assert name == "new_shapes" and shapes[0]["id"] == shape_id and shapes[0]["type"] == "curve"
+        assert shapes[0]["points"][-1] == {"x": 10, "y": 5}
+        assert requests.get(f"{BASE_URL}/shapes/{shape_id}", params={"board": board}).status_code == 200
+
+        # A stroke left unfinished is cancelled when its client leaves
+        other_id = drawer.call("stroke_begin", {"points": [{"x": 1, "y": 1}]})["id"]
+        drawer.disconnect()
+        time.sleep(0.3)
+        assert events[-1] == ("stroke_cancel", [other_id])
+    finally:
+        viewer.disconnect()
+        if drawer.connected:
+            drawer.disconnect()
+    print("test_stroke_streaming passed!")
+
+def test_rate_limit():
+    """Past its burst a caller is turned away with 429 or an error ack and counted; others still draw."""
+    url = "http://localhost:8011"
+    process = spawn_server(8011, "--rate-limit", "1", "--rate-burst", "3")
+    line = {"x": 1, "y": 1, "width": 2, "height": 2, "color": "#000000"}
+    sio_client = Client()
+    try:
+        # A new caller has its whole burst
+        batch = [{"type": "line", "start": [0, 0], "end": [1, 1]}] * 3
+        assert requests.post(f"{url}/draw_batch", json=batch, headers={"X-API-Key": "fresh"}).status_code == 200
+
+        statuses = [requests.post(f"{url}/draw_line", params=line, headers={"X-API-Key": "bot"}).status_code
+                    for _ in range(4)]
+        assert statuses == [200, 200, 200, 429]
+        response = requests.post(f"{url}/draw_line", params=line, headers={"X-API-Key": "bot"})
+        assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1
+        # A batch costs one token per shape; one above the burst never fits and takes no tokens
+        response = requests.post(f"{url}/draw_batch", json=batch * 2, headers={"X-API-Key": "human"})
+        assert response.status_code == 413 and "Retry-After" not in response.headers
+        assert requests.post(f"{url}/draw_batch", json=batch, headers={"X-API-Key": "human"}).status_code == 200
+        # So does an import
+        upload = gzip.compress(b'{"type": "line", "start": [0, 0], "end": [1, 1]}\n' * 2)
+        assert requests.post(f"{url}/import", data=upload, headers={"X-API-Key": "importer"}).status_code == 200
+        assert requests.post(f"{url}/import", data=upload, headers={"X-API-Key": "importer"}).status_code == 429
+
+        # A connection has its own bucket, and shares its API key's one
+        sio_client.connect(f"{url}?key=bot", transports=["websocket"])
+        result = sio_client.call("draw_shape", {"type": "line", "start": [0, 0], "end": [1, 1]})
+        assert result["status"] == "error" and result["retry_after"] > 0
+        stats = requests.get(f"{url}/boards").json()["rate_limit"]
+        assert stats["throttled"] == 5
+        assert 'whiteboard_throttled_total{surface="socket"} 1' in requests.get(f"{url}/metrics").text
+
+        # An import comes in batches of at most the burst and waits for the tokens of the later ones
+        upload = gzip.compress(b'{"type": "line", "start": [0, 0], "end": [1, 1]}\n' * 5)
+        response = requests.post(f"{url}/import", data=upload, headers={"X-API-Key": "bulk"})
+        assert response.status_code == 200 and response.json()["shapes"] == 5
+    finally:
+        sio_client.disconnect()
+        process.terminate()
+        process.wait()
+    print("test_rate_limit passed!")
+
+def test_workers():
+    """With --workers 2 every client gets every shape in seq order, whichever process it and the drawer are on."""
+    url = "http://localhost:8013"
+    board = f"test-{int(time.time() * 1000)}"
+    process = spawn_server(8013, "--workers", "2")
+    clients, received = [], []
+    try:
+        # Every request is a new connection, so both processes answer some
+        assert len({requests.get(f"{url}/boards").json()["pid"] for _ in range(20)}) == 2
+        for _ in range(4):
+            shapes = []
+            sio_client = Client()
+            sio_client.on("new_shapes", lambda data, shapes=shapes: shapes.extend(data))
+            sio_client.connect(f"{url}?board={board}", transports=["websocket"])
+            clients.append(sio_client)
+            received.append(shapes)
+        for i in range(20):
+            requests.post(f"{url}/draw_line", params={
+                "x": i, "y": i, "width": 5, "height": 5, "color": "#FF0000", "board": board
+            })
+        for i, sio_client in enumerate(clients):
+            assert sio_client.call("draw_shape", {"type": "rect", "start": [i, i], "end": [9, 9]})["status"] == "shape drawn"
+        history = requests.get(f"{url}/history", params={"board": board}).json()
+        assert len(history) == 24
+        deadline = time.time() + 5
+        # A client does not get back its own shape
+        while any(len(shapes) < 23 for shapes in received) and time.time() < deadline:
+            time.sleep(0.05)
+        seqs = [shape["seq"] for shape in history]
+        for i, shapes in enumerate(received):
+            assert [shape["seq"] for shape in shapes] == [seq for j, seq in enumerate(seqs) if j != 20 + i]
+
+        # An operation the sequencer refuses fails alone; both processes keep their connection to it
+        circle = requests.post(f"{url}/draw_ellipse", params={"x": 0, "y": 0, "rx": 5, "ry": 5, "color": "#FF0000", "board": board})
+        assert circle.status_code == 200
+        circle_id = requests.get(f"{url}/history", params={"board": board}).json()[-1]["id"]
+        response = requests.patch(f"{url}/shapes/{circle_id}", params={"board": board}, json={"radius": "big"})
+        assert response.status_code == 422
+        for i in range(10):
+            assert requests.post(f"{url}/draw_line", params={
+                "x": i, "y": i, "width": 5, "height": 5, "color": "#FF0000", "board": board
+            }).status_code == 200
+    finally:
+        for sio_client in clients:
+            sio_client.disconnect()
+        process.terminate()
+        process.wait()
+    print("test_workers passed!")
+
+def test_persistence(tmp_path):
+    """A restarted server loads its snapshot, replays the log after it and skips a torn or corrupt last line."""
+    url = "http://localhost:8012"
+    args = ("--data-dir", str(tmp_path), "--snapshot-every", "5")
+    board_dir = tmp_path / "saved"
+
+    def restart():
+        process = spawn_server(8012, *args)
+        try:
+            return requests.get(f"{url}/history", params={"board": "saved"}).json()
+        finally:
+            process.terminate()
+            process.wait()
+
+    process = spawn_server(8012, *args)
+    try:
+        for i in range(8):
+            line = {"x": i, "y": i, "width": 5, "height": 5, "color": "#FF0000", "board": "saved"}
+            assert requests.post(f"{url}/draw_line", params=line).status_code == 200
+        ids = [shape["id"] for shape in requests.get(f"{url}/history", params={"board": "saved"}).json()]
+        # One shape from the snapshot deleted and one changed in the log after it
+        assert requests.delete(f"{url}/shapes/{ids[1]}", params={"board": "saved"}).status_code == 200
+        assert requests.patch(f"{url}/shapes/{ids[2]}", params={"board": "saved"},
+                              json={"color": "#00FF00"}).status_code == 200
+        history = requests.get(f"{url}/history", params={"board": "saved"}).json()
+        # No client ever connected, so no change waits for a broadcast
+        assert requests.get(f"{url}/boards").json()["broadcast"]["waiting"] == 0
+        time.sleep(0.5)  # the log is fsynced in batches
+    finally:
+        process.terminate()
+        process.wait()
+    assert list(board_dir.glob("snapshot-*.npz"))
+    assert len(history) == 7 and history[-1]["color"] == "#00FF00"
+    assert restart() == history
+
+    # A crash in the middle of a write leaves a torn last line
+    log = sorted(board_dir.glob("events-*.log"))[-1]
+    with open(log, "ab") as f:
+        f.write(b'{"type": "line", "sta')
+    assert restart() == history
+    # A corrupt complete line is skipped
+    log = sorted(board_dir.glob("events-*.log"))[-1]
+    with open(log, "ab") as f:
+        f.write(b'{"type": "line", "start": [0\n')
+    assert restart() == history
+
+    # Ids are not handed out again after a restart, even once the top one is deleted and the board cleared
+    top = max(shape["id"] for shape in history)
+    saved = {"board": "saved"}
+    process = spawn_server(8012, *args)
+    try:
+        assert requests.delete(f"{url}/shapes/{top}", params=saved).status_code == 200
+        assert requests.post(f"{url}/clear", params=saved).status_code == 200
+        time.sleep(0.5)
+    finally:
+        process.terminate()
+        process.wait()
+    process = spawn_server(8012, *args)
+    try:
+        line = {"x": 0, "y": 0, "width": 5, "height": 5, "color": "#FF0000", **saved}
+        assert requests.post(f"{url}/draw_line", params=line).status_code == 200
+        [shape] = requests.get(f"{url}/history", params=saved).json()
+        assert shape["id"] > top
+    finally:
+        process.terminate()
+        process.wait()
+    print("test_persistence passed!")
+
+def test_binary_wire_format():
+    """A binary client gets init and new_shapes as wire frames and can draw with one."""
+    board = f"test-{int(time.time() * 1000)}"
+    requests.post(f"{BASE_URL}/draw_rect", params={
+        "x": 1, "y": 2, "width": 3, "height": 4, "color": "#00FF00", "board": board
+    })
+    frames = {"init": [], "new_shapes": []}
+    binary = Client()
+    binary.on("init", lambda frame: frames["init"].append(frame))
+    binary.on("new_shapes", lambda frame: frames["new_shapes"].append(frame))
+    binary.connect(f"{BASE_URL}?board={board}&format=binary", transports=["websocket"])
+    sender = Client()
+    sender.connect(f"{BASE_URL}?board={board}", transports=["websocket"])
+    try:
+        time.sleep(0.2)
+        [init] = frames["init"]
+        assert isinstance(init["shapes"], bytes)
+        assert [(s["type"], s["start"], s["color"]) for s in wire.decode(init)] == [("rect", (1, 2), "#00FF00")]
+        points = [{"x": 0, "y": 0}, {"x": 10, "y": 5}, {"x": 20, "y": 0}]
+        result = sender.call("draw_shapes", wire.encode([
+            {"type": "curve", "points": points, "color": "#0000FF"},
+            {"type": "dotted_line", "start": [0, 0], "end": [5, 5], "dot_interval": 3},
+        ]))
+        assert len(result["ids"]) == 2
+        time.sleep(0.3)
+        received = [shape for frame in frames["new_shapes"] for shape in wire.decode(frame)]
+        assert [shape["id"] for shape in received] == result["ids"]
+        assert received[0]["points"] == points
+        assert received[1]["dot_interval"] == 3
+        # Malformed frames are refused with an error, not a server error
+        frame = wire.encode([{"type": "line", "start": [0, 0], "end": [1, 1], "color": "#FF0000"}])
+        for broken in ({"points": None}, {"palette": 5}, {"extras": 7}, {"shapes": b"\x00"}, {"v": 99}):
+            result = sender.call("draw_shapes", {**frame, **broken})
+            assert result["status"] == "error", broken
+    finally:
+        binary.disconnect()
+        sender.disconnect()
+    print("test_binary_wire_format passed!")
+
+def test_export_import():
+    """A board exported in either format imports into another board as the same shapes."""
+    board = f"test-{int(time.time() * 1000)}"
+    requests.post(f"{BASE_URL}/draw_batch", params={"board": board}, json=[
+        {"type": "curve", "points": [{"x": 0, "y": 0}, {"x": 10, "y": 5}, {"x": 20, "y": 0}], "color": "#0000FF"},
+        {"type": "dotted_line", "start": [0, 0], "end": [5, 5], "dot_interval": 3, "color": "#FF0000"},
+        {"type": "rect", "start": [1, 2], "end": [3, 4], "color": "#00FF00"},
+    ])
+    strip = lambda shapes: [{k: v for k, v in shape.items() if k not in ("id", "seq", "t")} for shape in shapes]
+    original = strip(requests.get(f"{BASE_URL}/history", params={"board": board}).json())
+    # /imports lists the imports of one process: a session's one connection stays with it under --workers
+    session = requests.Session()
+    for format in ("ndjson", "binary"):
+        exported = requests.get(f"{BASE_URL}/export", params={"board": board, "format": format})
+        assert exported.status_code == 200
+        assert exported.content.startswith(b"\x1f\x8b")
+        copy = f"{board}-{format}"
+        imported = session.post(f"{BASE_URL}/import", params={"board": copy, "format": format},
+                                data=exported.content).json()
+        assert imported["shapes"] == 3
+        job = session.get(f"{BASE_URL}/imports").json()[imported["job"]]
+        assert job["done"] and job["shapes"] == 3 and job["board"] == copy and "error" not in job
+        assert strip(requests.get(f"{BASE_URL}/history", params={"board": copy}).json()) == original
+    bad = gzip.compress(b'{"type": "line", "start": [0, 0], "end": [1, 1]}\n{"type": "line"}\n')
+    response = session.post(f"{BASE_URL}/import", params={"board": f"{board}-bad"}, data=bad)
+    assert response.status_code == 400
+    assert "record 2" in response.json()["detail"]
+    jobs = session.get(f"{BASE_URL}/imports").json()
+    job = jobs[max(jobs, key=int)]
+    assert job["done"] and job["board"] == f"{board}-bad" and "record 2" in job["error"]
+    # The good record before the bad one is on the board
+    assert job["shapes"] == 1
+    assert len(session.get(f"{BASE_URL}/history", params={"board": f"{board}-bad"}).json()) == 1
+    session.close()
+    assert requests.get(f"{BASE_URL}/export", params={"format": "csv"}).status_code == 400
+    print("test_export_import passed!")
+
+def test_tiles():
+    """Tiles are PNGs with ETags that only change when a shape touches them."""
+    board = f"test-{int(time.time() * 1000)}"
+    url = f"{BASE_URL}/tiles/0/0/0.png"
+    far = f"{BASE_URL}/tiles/0/10/10.png"
+    requests.post(f"{BASE_URL}/draw_line", params={
+        "x": 10, "y": 10, "width": 100, "height": 50, "color": "#FF0000", "board": board
+    })
+    first = requests.get(url, params={"board": board})
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "image/png"
+    assert first.content.startswith(b"\x89PNG")
+    etag = first.headers["ETag"]
+    assert requests.get(url, params={"board": board}, headers={"If-None-Match": etag}).status_code == 304
+    far_etag = requests.get(far, params={"board": board}).headers["ETag"]
+
+    requests.post(f"{BASE_URL}/draw_rect", params={
+        "x": 50, "y": 50, "width": 20, "height": 20, "color": "#0000FF", "board": board
+    })
+    assert requests.get(url, params={"board": board}).headers["ETag"] != etag
+    assert requests.get(far, params={"board": board}, headers={"If-None-Match": far_etag}).status_code == 304
+    assert requests.get(f"{BASE_URL}/tiles/99/0/0.png").status_code == 400
+
+    # Only the dashes inside a tile are drawn, however long the line; the interval must be positive
+    dotted = {"x": 0, "y": 0, "width": 1e9, "height": 1e9, "color": "#000000", "board": board}
+    assert requests.post(f"{BASE_URL}/draw_dotted_line", params={**dotted, "dot_interval": 0.5}).status_code == 200
+    assert requests.get(f"{BASE_URL}/tiles/4/0/0.png", params={"board": board}, timeout=10).status_code == 200
+    for interval in (0, -1):
+        response = requests.post(f"{BASE_URL}/draw_dotted_line", params={**dotted, "dot_interval": interval})
+        assert response.status_code == 422
+    print("test_tiles passed!")
+
+def test_metrics():
+    """Drawing routes show up in the Prometheus latency histograms."""
+    requests.post(f"{BASE_URL}/draw_rect", params={"x": 1, "y": 1, "width": 5, "height": 5, "color": "#000000"})
+    response = requests.get(f"{BASE_URL}/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert "# TYPE whiteboard_request_seconds histogram" in lines
+    count = [l for l in lines if l.startswith('whiteboard_request_seconds_count{route="/draw_rect"}')]
+    assert count and int(count[0].split()[-1]) >= 1
+    assert any(l.startswith('whiteboard_board_shapes{board="default"}') for l in lines)
+    assert isinstance(requests.get(f"{BASE_URL}/traces").json(), list)
+    print("test_metrics passed!")
     
+
 if __name__ == "__main__":
     test_draw_line()
     test_draw_ellipse()
     test_draw_rect()
+    test_draw_curve_simplified()
+    test_draw_batch()
+    test_draw_batch_invalid()
     test_get_history()
-    test_clear_board()
\ No newline at end of file
+    test_clear_board()
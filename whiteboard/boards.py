@@ -0,0 +1,362 @@
+import functools
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from . import curve
+from .history import History
+from .persistence import HistoryLog
+
+DEFAULT_BOARD = "default"
+_BOARD_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class InvalidBoard(ValueError):
+    """Raised for a board id that is not 1-64 letters, digits, '_' or '-'."""
+
+class Board:
+    """
+    One whiteboard: its history, which is the board's scene model, and the
+    allocator of its shape ids. This is plain Python; the REST and Socket.IO
+    layers change a board through apply(), and views such as the Qt window
+    subscribe to hear about every applied operation.
+
+    Every source (a client sid, the window) can undo its own operations and
+    redo what it undid, up to undo_depth steps. A board replicated from
+    another one, which resolves the undos, uses undo_depth 0.
+
+    Curves can be streamed while they are drawn: a stroke gets the id of
+    the curve it becomes, collects points until its source adds the
+    finished curve with that id, and is never written to the history.
+    """
+    def __init__(self, board_id: str, log: Optional[HistoryLog] = None, undo_depth: int = 100,
+                 max_undo_sources: int = 1000):
+        self.board_id = board_id
+        self.history = History()
+        if log:
+            self.history.attach_log(log)
+        self._shape_ids = itertools.count(self.history.max_id() + 1)
+        self._listeners: List[Callable] = []
+        self.undo_depth = undo_depth
+        self.max_undo_sources = max_undo_sources
+        self._undo: "OrderedDict[object, list]" = OrderedDict()  # source -> operations reverting its changes
+        self._redo: "OrderedDict[object, list]" = OrderedDict()  # source -> operations reverting its undos
+        self._strokes: Dict[int, Tuple[object, Dict]] = {}  # shape id -> (source, curve being drawn)
+        # Serializes operations, so listeners hear them in the order they were applied
+        self._lock = threading.RLock()
+
+    def subscribe(self, listener: Callable):
+        """
+        Call listener(op, shapes, source, previous) after every applied
+        operation; previous holds the replaced versions of an "update".
+        """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable):
+        self._listeners.remove(listener)
+
+    def next_shape_id(self) -> int:
+        """Allocate a shape id; safe to call from any thread."""
+        return next(self._shape_ids)
+
+    def apply(self, op: str, shapes: Optional[List[Dict]] = None, source=None,
+              t: Optional[float] = None) -> Tuple[Optional[str], List[Dict]]:
+        """
+        Apply an operation to the history, then notify the listeners.
+        source identifies who made the change, so a listener can skip its
+        own operations, and whose undo stack it goes on. t is the time of a
+        delete or clear on the board this one copies (see History.keep_times).
+
+          "add"     shapes are added; ids are assigned if missing
+          "update"  each shape's keys are merged into the shape with its id;
+                    a None value removes a key
+          "replace" each shape replaces the shape with its id as it is;
+                    applied as an "update"
+          "delete"  the shapes with the ids in shapes are removed
+          "clear"   every shape is removed; this also forgets all undo steps
+          "undo"    source's latest operation is reverted
+          "redo"    source's latest undo is reverted
+
+        Strokes, from their source only, with points as flat [x0, y0, ...]:
+
+          "stroke_begin"   [{"color", "points"}] starts a stroke; an id is
+                           assigned if missing
+          "stroke_append"  [{"id", "points"}] extends it
+          "stroke_cancel"  [{"id"}] drops it, None drops all of source's
+          "add"            of a shape with the stroke's id ends it
+
+        Returns (op, shapes) as applied: undo and redo come back as the add,
+        update or delete that they resolved to, and shapes are the added,
+        new or removed versions. Unknown ids are skipped, and an operation
+        that changed nothing returns no shapes and is not passed on.
+        """
+        with self._lock:
+            if op in ("undo", "redo"):
+                op, shapes, previous = self._revert(op, source)
+            elif op.startswith("stroke_"):
+                op, shapes, previous = self._stroke(op, shapes, source)
+            else:
+                op, shapes, previous = self._change(op, shapes, t)
+                if shapes and source is not None and self.undo_depth:
+                    self._push(self._undo, source, self._inverse(op, shapes, previous))
+                    self._redo.pop(source, None)
+            if op == "clear" or shapes:
+                for listener in self._listeners:
+                    listener(op, shapes, source, previous)
+            return op, shapes or []
+
+    def _change(self, op: str, shapes: Optional[List[Dict]], t: Optional[float] = None):
+        if op == "add":
+            for shape_data in shapes:
+                if "id" not in shape_data:
+                    shape_data["id"] = self.next_shape_id()
+                self._strokes.pop(shape_data["id"], None)
+                self.history.append(shape_data)
+            return op, shapes, None
+        if op in ("update", "replace"):
+            new, previous = [], []
+            for shape_data in shapes:
+                if op == "update":
+                    current = self.history.get(shape_data.get("id"))
+                    if current is None:
+                        continue
+                    merged = {**current, **shape_data}
+                    shape_data = {k: v for k, v in merged.items() if v is not None}
+                old = self.history.replace(shape_data)
+                if old is not None:
+                    previous.append(old)
+                    new.append(shape_data)
+            return "update", new, previous
+        if op == "delete":
+            return op, self.history.delete((shape_data["id"] for shape_data in shapes), t), None
+        if op == "clear":
+            self.history.clear(t)
+            self._undo.clear()
+            self._redo.clear()
+            return op, None, None
+        raise ValueError(f"unknown operation {op!r}")
+
+    def _stroke(self, op: str, shapes: Optional[List[Dict]], source):
+        if op == "stroke_begin":
+            applied = []
+            for stroke in shapes:
+                shape_id = stroke.get("id") or self.next_shape_id()
+                color = stroke.get("color", "#000000")
+                self._strokes[shape_id] = (source, {"color": color, "points": curve.to_tuples(stroke["points"])})
+                applied.append({"id": shape_id, "color": color, "points": stroke["points"]})
+            return op, applied, None
+        if op == "stroke_append":
+            applied = []
+            for stroke in shapes:
+                owner, drawn = self._strokes.get(stroke["id"], (None, None))
+                if drawn is not None and owner == source and stroke["points"]:
+                    points = curve.to_tuples(stroke["points"])
+                    if len(drawn["points"]) + len(points) > curve.MAX_POINTS:
+                        raise ValueError(f"a curve has at most {curve.MAX_POINTS} points")
+                    drawn["points"].extend(points)
+                    applied.append({"id": stroke["id"], "points": stroke["points"]})
+            return op, applied, None
+        if op == "stroke_cancel":
+            ids = list(self._strokes) if shapes is None else [stroke["id"] for stroke in shapes]
+            ids = [i for i in ids if i in self._strokes and self._strokes[i][0] == source]
+            for shape_id in ids:
+                del self._strokes[shape_id]
+            return op, [{"id": shape_id} for shape_id in ids], None
+        raise ValueError(f"unknown operation {op!r}")
+
+    def stroke(self, shape_id: int, source=None) -> Optional[Dict]:
+        """Return {"color", "points"} of source's stroke with this id, or None."""
+        with self._lock:
+            owner, drawn = self._strokes.get(shape_id, (None, None))
+            if drawn is None or owner != source:
+                return None
+            return {"color": drawn["color"], "points": list(drawn["points"])}
+
+    @staticmethod
+    def _inverse(op: str, shapes: List[Dict], previous: Optional[List[Dict]]):
+        """The operation that reverts an applied one."""
+        if op == "add":
+            return "delete", [{"id": shape_data["id"]} for shape_data in shapes]
+        if op == "delete":
+            return "add", shapes
+        return "replace", previous
+
+    def _push(self, stacks: OrderedDict, source, step):
+        stack = stacks.get(source)
+        if stack is None:
+            stack = stacks[source] = []
+            if len(stacks) > self.max_undo_sources:
+                stacks.popitem(last=False)
+        else:
+            stacks.move_to_end(source)
+        stack.append(step)
+        del stack[:-self.undo_depth]
+
+    def _revert(self, op: str, source):
+        stacks, other = (self._undo, self._redo) if op == "undo" else (self._redo, self._undo)
+        stack = stacks.get(source)
+        while stack:
+            # Steps whose shapes are all gone by now revert nothing; skip them
+            step_op, step_shapes = stack.pop()
+            applied, shapes, previous = self._change(step_op, [dict(s) for s in step_shapes])
+            if shapes:
+                self._push(other, source, self._inverse(applied, shapes, previous))
+                return applied, shapes, previous
+        return None, [], None
+
+    def nbytes(self) -> int:
+        return self.history.nbytes()
+
+    def close(self):
+        self.history.close()
+
+class BoardRegistry:
+    """
+    Boards by id, loaded on first use and evicted least recently used first
+    once the loaded histories exceed memory_budget bytes.
+
+    With a data_dir every board is persisted in data_dir/<board id> and an
+    evicted board is restored from its log on the next access. Without one
+    boards only live in memory and are never evicted. Pinned boards (the one
+    shown in the window) and boards with joined clients stay loaded.
+    A loader(board_id) -> Board replaces loading from data_dir, e.g. to get
+    boards from an event bus.
+    """
+    def __init__(self, data_dir: Optional[str] = None, memory_budget: int = 1 << 30,
+                 snapshot_every: int = 100_000, loader: Optional[Callable[[str], Board]] = None):
+        self.data_dir = data_dir
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.snapshot_every = snapshot_every
+        self._boards: "OrderedDict[str, Board]" = OrderedDict()
+        self._pinned = set()
+        self._members: Dict[str, int] = {}  # board id -> joined clients
+        self._listeners: List[Callable] = []
+        self._lock = threading.Lock()  # guards the maps above
+        self._load_lock = threading.Lock()  # one board is loaded at a time
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def check_id(board_id: str) -> str:
+        if not isinstance(board_id, str) or not _BOARD_ID.fullmatch(board_id):
+            raise InvalidBoard(f"invalid board id {board_id!r}")
+        return board_id
+
+    def loaded(self, board_id: str) -> Optional[Board]:
+        """Return the board if it is in memory, marking it as recently used."""
+        self.check_id(board_id)
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board:
+                self._boards.move_to_end(board_id)
+        return board
+
+    def get(self, board_id: str) -> Board:
+        """Return a board, loading or creating it first if needed."""
+        board = self.loaded(board_id)
+        if board:
+            return board
+        with self._load_lock:
+            board = self.loaded(board_id)
+            if board is None:
+                board = self._load(board_id)
+                with self._lock:
+                    self._boards[board_id] = board
+                self.loads += 1
+        self.evict()
+        return board
+
+    def _load(self, board_id: str) -> Board:
+        if self.loader:
+            board = self.loader(board_id)
+        else:
+            log = None
+            if self.data_dir:
+                log = HistoryLog(os.path.join(self.data_dir, board_id), snapshot_every=self.snapshot_every)
+            board = Board(board_id, log)
+        for listener in self._listeners:
+            board.subscribe(functools.partial(listener, board_id))
+        return board
+
+    def subscribe(self, listener: Callable):
+        """
+        Call listener(board_id, op, shapes, source, previous) after every
+        operation applied to any board, including boards loaded later.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            boards = list(self._boards.items())
+        for board_id, board in boards:
+            board.subscribe(functools.partial(listener, board_id))
+
+    def pin(self, board_id: str) -> Board:
+        """Load a board and keep it loaded."""
+        board = self.get(board_id)
+        with self._lock:
+            self._pinned.add(board_id)
+        return board
+
+    def join(self, board_id: str) -> Board:
+        """Load a board for a client; it is not evicted while clients remain."""
+        board = self.get(board_id)
+        with self._lock:
+            self._members[board_id] = self._members.get(board_id, 0) + 1
+        return board
+
+    def leave(self, board_id: str):
+        with self._lock:
+            count = self._members.get(board_id, 0) - 1
+            if count > 0:
+                self._members[board_id] = count
+            else:
+                self._members.pop(board_id, None)
+
+    def evict(self) -> List[str]:
+        """
+        Evict idle boards, least recently used first, until the loaded ones
+        fit the memory budget. The most recently used board is kept so the
+        caller that just loaded it can use it. Returns the evicted ids.
+        """
+        if not self.data_dir:
+            return []
+        evicted = []
+        with self._lock:
+            total = sum(board.nbytes() for board in self._boards.values())
+            for board_id in list(self._boards)[:-1]:
+                if total <= self.memory_budget:
+                    break
+                if board_id in self._pinned or self._members.get(board_id):
+                    continue
+                board = self._boards.pop(board_id)
+                total -= board.nbytes()
+                evicted.append(board)
+            self.evictions += len(evicted)
+        for board in evicted:
+            board.close()
+        return [board.board_id for board in evicted]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            boards = {board_id: {"shapes": len(board.history), "bytes": board.nbytes(),
+                                 "clients": self._members.get(board_id, 0),
+                                 "pinned": board_id in self._pinned,
+                                 "json_cache": board.history.cache_stats()}
+                      for board_id, board in self._boards.items()}
+        return {
+            "loaded": len(boards),
+            "bytes": sum(b["bytes"] for b in boards.values()),
+            "memory_budget": self.memory_budget,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "boards": boards,
+        }
+
+    def close(self):
+        """Close the logs of all loaded boards."""
+        with self._lock:
+            boards = list(self._boards.values())
+            self._boards.clear()
+        for board in boards:
+            board.close()
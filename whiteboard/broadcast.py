@@ -0,0 +1,231 @@
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+from . import metrics
+from .geometry import BBox, intersects, shape_bbox
+
+FANOUT = metrics.histogram("whiteboard_broadcast_fanout_seconds",
+                           "Time to send one tick's changes to all clients, for ticks that sent any")
+
+# Operation -> the event that sends it
+EVENTS = {"add": "new_shapes", "update": "update_shapes", "delete": "delete_shapes",
+          "stroke_begin": "stroke_begin", "stroke_append": "stroke_append", "stroke_cancel": "stroke_cancel"}
+
+class _Client:
+    __slots__ = ("board_id", "pending", "size", "cleared", "sent", "resync")
+
+    def __init__(self, board_id: str):
+        self.board_id = board_id
+        self.pending: List[list] = []  # [op, shapes or ids] waiting to be sent, in order
+        self.size = 0  # shapes and ids in pending
+        self.cleared = False  # a clear is waiting to be sent before the pending changes
+        self.sent = deque()  # times of the sends not acknowledged yet, oldest first
+        self.resync = False  # changes were dropped, the client must sync
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.sent)
+
+    def queue(self, op: str, items: List):
+        if not self.pending or self.pending[-1][0] != op:
+            self.pending.append([op, []])
+        batch = self.pending[-1][1]
+        if op == "stroke_append":
+            # Points of one stroke in a row become one chunk; chunks are copied as other clients share them
+            for item in items:
+                if batch and batch[-1]["id"] == item["id"]:
+                    batch[-1]["points"].extend(item["points"])
+                else:
+                    batch.append({"id": item["id"], "points": list(item["points"])})
+        else:
+            batch.extend(items)
+        self.size += len(items)
+
+    def drop(self):
+        self.pending = []
+        self.size = 0
+
+class Broadcaster:
+    """
+    Fans board changes out to the Socket.IO clients of each board.
+
+    Changes are collected as they are applied (from any thread) and sent
+    every interval seconds, so each client gets at most one frame per run of
+    operations of the same kind per tick, preceded by "clear" if the board
+    was cleared: "new_shapes" (added shapes), "update_shapes" (their new
+    versions) or "delete_shapes" (a list of ids). A client does not get back
+    its own changes, and with a viewport it only gets the shapes whose new
+    or old version is inside it; deletes are always sent. encode_for(sid,
+    shapes) puts shapes into the client's wire format.
+
+    Curves being drawn go out as "stroke_begin" ([{"id", "color",
+    "points"}]), "stroke_append" ([{"id", "points"}], the points of a stroke
+    merged per tick) and "stroke_cancel" (a list of ids), as JSON in every
+    wire format and regardless of the viewport.
+
+    A tick's frames are sent with an acknowledgement on the last one. A
+    client with max_in_flight unacknowledged sends is slow: its changes are
+    merged into the pending frames, and once more than max_pending pile up
+    they are dropped and the client gets "resync" instead, telling it to
+    call sync with its last seq. "clear" and "resync" are sent whether or
+    not the client is slow, and a send not acknowledged within ack_timeout
+    seconds no longer counts, so a client that stopped acknowledging gets
+    its changes again rather than waiting forever.
+    """
+    def __init__(self, sio, interval: float = 0.016, max_in_flight: int = 4,
+                 max_pending: int = 10_000, viewport_of: Callable[[str], Optional[BBox]] = None,
+                 encode_for: Callable[[str, List[Dict]], object] = None, ack_timeout: float = 10.0):
+        self.sio = sio
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.ack_timeout = ack_timeout
+        self.viewport_of = viewport_of or (lambda sid: None)
+        self.encode_for = encode_for or (lambda sid, shapes: shapes)
+        self._clients: Dict[str, _Client] = {}
+        self._watchers: Counter = Counter()  # board id -> clients, changes of other boards are not kept
+        self._ops: Dict[str, list] = {}  # board id -> [(op, shapes, source, previous)] since the last tick
+        self._lock = threading.Lock()
+        self._task = None
+        self.frames = 0
+        self.merged = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def start(self):
+        """Start the flush loop on the running event loop, once."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def join(self, sid: str, board_id: str):
+        """
+        Add a client; it gets the changes published from now on. Changes
+        still waiting for the tick go to the other clients only, as the
+        newcomer's snapshot already has them.
+        """
+        with self._lock:
+            ops, self._ops = self._ops, {}
+        self._collect_all(ops)
+        self.leave(sid)
+        self._clients[sid] = _Client(board_id)
+        with self._lock:
+            self._watchers[board_id] += 1
+
+    def leave(self, sid: str):
+        client = self._clients.pop(sid, None)
+        if client is not None:
+            with self._lock:
+                self._watchers[client.board_id] -= 1
+                if not self._watchers[client.board_id]:
+                    del self._watchers[client.board_id]
+
+    def publish(self, board_id: str, op: str, shapes=None, source=None, previous=None):
+        """
+        Record a board change; a board listener, safe to call from any
+        thread. Changes of a board without clients are not kept: whoever
+        joins it later starts from a snapshot.
+        """
+        with self._lock:
+            if board_id in self._watchers:
+                self._ops.setdefault(board_id, []).append((op, shapes, source, previous))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Send every client the changes of its board since the last tick."""
+        with self._lock:
+            ops, self._ops = self._ops, {}
+        self._collect_all(ops)
+        start = time.perf_counter()
+        expiry = time.monotonic() - self.ack_timeout
+        sent = False
+        for sid, client in list(self._clients.items()):
+            while client.sent and client.sent[0] < expiry:
+                client.sent.popleft()
+                self.expired += 1
+            if client.cleared or client.resync:
+                await self._send_control(sid, client)
+                sent = True
+            if client.in_flight < self.max_in_flight and client.pending:
+                await self._send(sid, client)
+                sent = True
+        if sent:
+            FANOUT.observe(time.perf_counter() - start)
+
+    def _collect_all(self, ops):
+        if ops:
+            for sid, client in list(self._clients.items()):
+                if client.board_id in ops:
+                    self._collect(sid, client, ops[client.board_id])
+
+    def _collect(self, sid: str, client: _Client, ops):
+        viewport = self.viewport_of(sid)
+        for op, shapes, source, previous in ops:
+            if op == "clear":
+                client.drop()
+                client.cleared = True
+                client.resync = False  # nothing from before the clear is needed
+            elif source != sid and not client.resync:
+                if op in ("delete", "stroke_cancel"):
+                    client.queue(op, [s["id"] for s in shapes])
+                    continue
+                if op.startswith("stroke_"):
+                    client.queue(op, shapes)
+                    continue
+                if viewport:
+                    if op == "update":
+                        shapes = [s for s, old in zip(shapes, previous)
+                                  if intersects(shape_bbox(s), viewport) or intersects(shape_bbox(old), viewport)]
+                    else:
+                        shapes = [s for s in shapes if intersects(shape_bbox(s), viewport)]
+                if shapes:
+                    client.queue(op, shapes)
+        if client.in_flight >= self.max_in_flight:
+            self.merged += 1
+            if client.size > self.max_pending:
+                self.dropped += client.size
+                client.drop()
+                client.resync = True
+
+    async def _send_control(self, sid: str, client: _Client):
+        if client.cleared:
+            client.cleared = False
+            await self.sio.emit('clear', to=sid)
+        if client.resync:
+            client.resync = False
+            await self.sio.emit('resync', to=sid)
+
+    async def _send(self, sid: str, client: _Client):
+        pending = client.pending
+        client.drop()
+        client.sent.append(time.monotonic())
+        for i, (op, items) in enumerate(pending):
+            self.frames += 1
+            # Frames arrive in order, so acknowledging the last one covers the send
+            last = i == len(pending) - 1
+            encoded = op in ("add", "update")
+            data = self.encode_for(sid, items) if encoded else items
+            await self.sio.emit(EVENTS[op], data, to=sid,
+                                callback=(lambda *_: self._acked(client)) if last else None)
+            if metrics.TRACER.active and encoded:
+                metrics.TRACER.mark(items, "broadcast")
+
+    def _acked(self, client: _Client):
+        if client.sent:  # unless the send already expired
+            client.sent.popleft()
+
+    def stats(self) -> Dict:
+        return {
+            "clients": len(self._clients),
+            "waiting": sum(len(ops) for ops in self._ops.values()),
+            "frames": self.frames,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "slow_clients": sum(c.in_flight >= self.max_in_flight for c in self._clients.values()),
+        }
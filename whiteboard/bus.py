@@ -0,0 +1,214 @@
+"""
+Event buses carry board operations from the server to the boards.
+
+A bus has two coroutines, prepare(board_id), called before a board is
+first used, and submit(board, op, shapes, source), which applies an
+operation and returns it as applied, like Board.apply: (op, shapes). Either
+LocalBus, for one process, or SocketBus, for a group of worker processes
+kept in step by a Sequencer, can be plugged into main.
+
+Sequencer and SocketBus talk over a Unix socket with length-prefixed JSON
+messages:
+
+    worker -> sequencer  {"t": "load", "board", "req"}
+                         {"t": "op", "board", "op", "shapes", "source", "req"}
+    sequencer -> worker  {"t": "snapshot", "board", "seq", "time", "clear_seq", "token", "shapes", "req"}
+                         {"t": "op", "board", "op", "shapes", "source", "time"[, "req"]}
+                         {"t": "error", "board", "error", "invalid", "req"}
+
+The sequencer applies every operation to its own copy of the board first,
+which assigns ids and seqs, resolves undo and redo and writes the log, then
+sends the operation as applied to every worker that loaded the board (only
+to the one that sent it if it changed nothing). Each worker receives a board's operations in
+the sequencer's order and applies them to its copy. The copies therefore
+stay identical, and every worker fans changes out to its own clients.
+"time" is when the sequencer stamped the latest event, which the copies
+take for their deletes and clears (shapes carry their own "t") and, with a
+snapshot, as the time of its seq, so they all have the same timeline.
+An operation the sequencer's board refuses comes back to its sender only,
+as "error"; "invalid" tells a bad value (ValueError for the caller) from a
+failure of the sequencer.
+"""
+import asyncio
+import itertools
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+from .boards import Board, BoardRegistry
+from .history_cache import RawJSON, splice_json
+
+logger = logging.getLogger(__name__)
+
+async def read_message(reader: asyncio.StreamReader) -> Dict:
+    size = int.from_bytes(await reader.readexactly(4), "big")
+    return json.loads(await reader.readexactly(size))
+
+def encode_message(message: Dict) -> bytes:
+    data = splice_json.dumps(message).encode()
+    return len(data).to_bytes(4, "big") + data
+
+class LocalBus:
+    """Operations are applied in this process as they come."""
+    async def prepare(self, board_id: str):
+        pass
+
+    async def submit(self, board: Board, op: str, shapes: Optional[List[Dict]] = None, source=None):
+        return board.apply(op, shapes, source)
+
+class SocketBus:
+    """
+    A worker's connection to the Sequencer. Boards are copies fed by the
+    sequencer; use load_board as the loader of the worker's BoardRegistry.
+    The copies miss every operation once the connection is lost, so the
+    bus does not reconnect: requests fail from then on and on_lost() is
+    called, which should restart the worker.
+    """
+    def __init__(self, path: str, on_lost: Callable[[], None] = None):
+        self.path = path
+        self.on_lost = on_lost
+        self.lost: Optional[str] = None
+        self.boards: Dict[str, Board] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connecting: Optional[asyncio.Task] = None
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._requests = itertools.count(1)
+
+    async def _connect(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        asyncio.get_running_loop().create_task(self._read(reader))
+
+    async def _request(self, message: Dict):
+        if self.lost:
+            raise ConnectionError(self.lost)
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        await self._connecting
+        req = next(self._requests)
+        future = self._pending[req] = asyncio.get_running_loop().create_future()
+        self._writer.write(encode_message({**message, "req": req}))
+        await self._writer.drain()
+        return await future
+
+    async def prepare(self, board_id: str):
+        """Fetch a snapshot of the board; its operations follow from then on."""
+        if board_id in self.boards:
+            return
+        task = self._loading.get(board_id)
+        if task is None:
+            task = self._loading[board_id] = asyncio.ensure_future(
+                self._request({"t": "load", "board": board_id}))
+        await task
+
+    def load_board(self, board_id: str) -> Board:
+        return self.boards[board_id]
+
+    async def submit(self, board: Board, op: str, shapes: Optional[List[Dict]] = None, source=None):
+        """Send an operation to the sequencer; returns once it is applied here."""
+        return await self._request({"t": "op", "board": board.board_id, "op": op,
+                                    "shapes": shapes, "source": source})
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                message = await read_message(reader)
+                result = None
+                if message["t"] == "error":
+                    future = self._pending.pop(message["req"], None)
+                    if future:
+                        future.set_exception((ValueError if message["invalid"] else RuntimeError)(message["error"]))
+                    continue
+                if message["t"] == "snapshot":
+                    board = Board(message["board"], undo_depth=0)
+                    board.history.keep_times = True  # events come stamped by the sequencer
+                    board.history.restore(message["seq"], message["clear_seq"], message["shapes"],
+                                          t=message.get("time"))
+                    board.history.token = message["token"]  # the same ETags on every copy
+                    self.boards[board.board_id] = board
+                elif message["op"] is None:
+                    result = None, []
+                else:
+                    result = self.boards[message["board"]].apply(message["op"], message["shapes"], message["source"],
+                                                                 message.get("time"))
+                future = self._pending.pop(message.get("req"), None)
+                if future:
+                    future.set_result(result)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.lost = f"lost the sequencer: {e}"
+            for future in self._pending.values():
+                future.set_exception(ConnectionError(self.lost))
+            self._pending.clear()
+            logger.error("%s", self.lost)
+            if self.on_lost:
+                self.on_lost()
+
+class Sequencer:
+    """
+    Orders the operations of every board for a group of workers and keeps
+    the authoritative copy of each board, persisted if the registry has a
+    data directory. Runs on one event loop, so each operation is applied
+    and queued to all subscribed workers before the next one is looked at.
+    """
+    def __init__(self, registry: BoardRegistry):
+        self.registry = registry
+        self._subscribers: Dict[str, list] = {}  # board id -> writers of the workers that loaded it
+        self.operations = 0
+
+    async def serve(self, path: str, started=None):
+        server = await asyncio.start_unix_server(self._handle, path)
+        if started:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loaded = []
+        try:
+            while True:
+                message = await read_message(reader)
+                board_id = message["board"]
+                if message["t"] == "load":
+                    # Snapshot and subscription in one step, so no operation falls in between
+                    board = self.registry.join(board_id)
+                    loaded.append(board_id)
+                    self._subscribers.setdefault(board_id, []).append(writer)
+                    writer.write(encode_message({
+                        "t": "snapshot", "board": board_id, "req": message["req"],
+                        "seq": board.history.seq, "time": board.history.time_of(board.history.seq),
+                        "clear_seq": board.history.clear_seq,
+                        "token": board.history.token,
+                        "shapes": RawJSON(board.history.to_json()[1])}))
+                else:
+                    self._apply(writer, message)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for board_id in loaded:
+                self._subscribers[board_id].remove(writer)
+                self.registry.leave(board_id)
+            writer.close()
+
+    def _apply(self, origin: asyncio.StreamWriter, message: Dict):
+        try:
+            board = self.registry.get(message["board"])
+            op, shapes = board.apply(message["op"], message.get("shapes"), message.get("source"))
+        except Exception as e:
+            # Fails this operation only; the worker stays connected
+            invalid = isinstance(e, (ValueError, KeyError, TypeError))
+            if not invalid:
+                logger.exception("sequencer failed to apply %s to board %s", message.get("op"), message.get("board"))
+            origin.write(encode_message({"t": "error", "board": message.get("board"), "req": message["req"],
+                                         "error": str(e), "invalid": invalid}))
+            return
+        self.operations += 1
+        # Updates go out as the new versions, which replace the old ones as they are
+        applied = {"t": "op", "board": board.board_id, "op": "replace" if op == "update" else op,
+                   "shapes": shapes, "source": message.get("source"),
+                   "time": board.history.time_of(board.history.seq)}
+        if not shapes and op != "clear":
+            origin.write(encode_message({**applied, "req": message["req"]}))
+            return
+        data = encode_message(applied)
+        for writer in self._subscribers.get(board.board_id, ()):
+            writer.write(encode_message({**applied, "req": message["req"]}) if writer is origin else data)
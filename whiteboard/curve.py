@@ -0,0 +1,119 @@
+import base64
+import json
+import math
+from typing import List, Sequence, Tuple
+import numpy as np
+
+XY = Tuple[float, float]
+
+MAX_POINTS = 10_000  # per curve; simplifying is superlinear, so one request cannot stall the server
+
+def to_tuples(points) -> List[XY]:
+    """
+    Normalize curve points to a list of (x, y) tuples.
+    Accepts a JSON string or a list of {"x", "y"} dicts, [x, y] pairs or
+    flat numbers [x0, y0, x1, y1, ...].
+    """
+    if isinstance(points, str):
+        points = json.loads(points)
+    if not points:
+        return []
+    first = points[0]
+    if isinstance(first, dict):
+        pairs = [(float(p["x"]), float(p["y"])) for p in points]
+    elif isinstance(first, (list, tuple)):
+        pairs = [(float(x), float(y)) for x, y in points]
+    else:
+        if len(points) % 2:
+            raise ValueError("flat points need an even number of values")
+        values = [float(v) for v in points]
+        pairs = list(zip(values[0::2], values[1::2]))
+    if len(pairs) > MAX_POINTS:
+        raise ValueError(f"a curve has at most {MAX_POINTS} points")
+    if not all(math.isfinite(x) and math.isfinite(y) for x, y in pairs):
+        raise ValueError("points must be finite numbers")
+    return pairs
+
+def to_dicts(points: Sequence[XY]) -> List[dict]:
+    return [{"x": x, "y": y} for x, y in points]
+
+def to_flat(points: Sequence[XY]) -> List[float]:
+    return [v for point in points for v in point]
+
+def simplify(points: Sequence[XY], tolerance: float) -> List[XY]:
+    """
+    Ramer-Douglas-Peucker simplification: drop points that lie within
+    tolerance of the simplified polyline. A tolerance of 0 keeps all points.
+    The distances of a segment's points are computed in one NumPy pass.
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+    xy = np.asarray(points, dtype=float)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        x1, y1 = xy[first]
+        dx, dy = xy[last] - xy[first]
+        length_sq = dx * dx + dy * dy
+        px = xy[first + 1:last, 0] - x1
+        py = xy[first + 1:last, 1] - y1
+        if length_sq == 0:
+            dist = px * px + py * py
+        else:
+            cross = dx * py - dy * px
+            dist = cross * cross / length_sq
+        index = int(np.argmax(dist))
+        if dist[index] > tolerance_sq:
+            index += first + 1
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [points[i] for i in np.flatnonzero(keep)]
+
+def _write_varint(out: bytearray, value: int):
+    value = value << 1 if value >= 0 else (-value << 1) - 1  # zigzag
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def encode_delta(points: Sequence[XY], decimals: int = 1) -> str:
+    """
+    Encode points as base64 zigzag-varint deltas of coordinates rounded to
+    the given number of decimals. The first byte stores the decimals.
+    """
+    scale = 10 ** decimals
+    out = bytearray([decimals])
+    last_x = last_y = 0
+    for x, y in points:
+        qx, qy = round(x * scale), round(y * scale)
+        _write_varint(out, qx - last_x)
+        _write_varint(out, qy - last_y)
+        last_x, last_y = qx, qy
+    return base64.b64encode(bytes(out)).decode("ascii")
+
+def decode_delta(text: str) -> List[XY]:
+    data = base64.b64decode(text, validate=True)
+    if not data:
+        raise ValueError("empty delta encoding")
+    scale = 10 ** data[0]
+    values, value, shift = [], 0, 0
+    for byte in data[1:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        delta = (value >> 1) ^ -(value & 1)
+        previous = values[-2] if len(values) >= 2 else 0
+        values.append(previous + delta)
+        value, shift = 0, 0
+    if shift or len(values) % 2:
+        raise ValueError("truncated delta encoding")
+    if len(values) > 2 * MAX_POINTS:
+        raise ValueError(f"a curve has at most {MAX_POINTS} points")
+    return [(values[i] / scale, values[i + 1] / scale) for i in range(0, len(values), 2)]
@@ -0,0 +1,169 @@
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+class QueueFull(Exception):
+    """Raised when the dispatch queue cannot take a batch in time."""
+
+class DispatchQueue:
+    """
+    Bounded handoff of drawing operations from the server thread to the GUI.
+
+    Producers push board operations such as ("add", shapes), ("delete",
+    shapes) or ("clear", None); the GUI takes them a limited number of shapes
+    at a time. Capacity is counted in shapes. A producer first waits for
+    room with wait_for_room, which fails at once or after a timeout when
+    the GUI does not catch up.
+
+    Operations are queued per source (a client) and taken round-robin, so a
+    client drawing in bulk does not hold up everybody else's shapes. Each
+    source's operations stay in order. Updates, deletes and clears can
+    depend on shapes from any source, so they are barriers: they are only
+    taken once everything queued before them has been, and nothing queued
+    after them is taken first.
+    """
+    BARRIERS = ("update", "delete", "clear")
+
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self._lanes: "OrderedDict[object, deque]" = OrderedDict()  # source -> [(n, op, shapes, queued_at)]
+        self._barriers: deque = deque()  # n of the queued barriers, in order
+        self._numbers = itertools.count()
+        self._depth = 0
+        self._cond = threading.Condition()
+        self.max_depth = 0
+        self.enqueued = 0
+        self.drained = 0
+        self.rejected = 0
+        self.waited = 0
+        self.last_tick_ms = 0.0
+
+    @staticmethod
+    def _size(op: str, shapes) -> int:
+        return len(shapes) if shapes is not None else 1
+
+    def _fits(self, size: int) -> bool:
+        # An oversized batch is still accepted into an empty queue
+        return self._depth + size <= self.capacity or self._depth == 0
+
+    def _push(self, op: str, shapes, size: int, source):
+        n = next(self._numbers)
+        lane = self._lanes.get(source)
+        if lane is None:
+            lane = self._lanes[source] = deque()
+        lane.append((n, op, shapes, time.perf_counter()))
+        if op in self.BARRIERS:
+            self._barriers.append(n)
+        self._depth += size
+        self.enqueued += size
+        self.max_depth = max(self.max_depth, self._depth)
+
+    def _wait_locked(self, size: int, timeout: float):
+        if not self._fits(size) and timeout > 0:
+            self.waited += 1
+            self._cond.wait_for(lambda: self._fits(size), timeout)
+        if not self._fits(size):
+            self.rejected += 1
+            raise QueueFull(f"dispatch queue full ({self._depth}/{self.capacity} shapes)")
+
+    def has_room(self, op: str, shapes: Optional[List[Dict]] = None) -> bool:
+        with self._cond:
+            return self._fits(self._size(op, shapes))
+
+    def wait_for_room(self, op: str, shapes: Optional[List[Dict]] = None, timeout: float = 0) -> None:
+        """
+        Return once the operation would fit, waiting up to timeout seconds,
+        or raise QueueFull. Lets a producer check for room before it commits
+        the operation elsewhere and push()es it.
+        """
+        with self._cond:
+            self._wait_locked(self._size(op, shapes), timeout)
+
+    def push(self, op: str, shapes: Optional[List[Dict]] = None, source=None) -> None:
+        """Queue an operation without checking capacity."""
+        size = self._size(op, shapes)
+        with self._cond:
+            self._push(op, shapes, size, source)
+
+    def take(self, max_shapes: int) -> List[Tuple[str, Optional[List[Dict]], float]]:
+        """
+        Remove up to max_shapes worth of operations, splitting large ones,
+        one operation per source in turn. Returns (op, shapes, queued_at)
+        with the perf_counter() of the push.
+        """
+        taken = []
+        with self._cond:
+            budget = max_shapes
+            while self._lanes and budget > 0:
+                source, lane = self._next_lane()
+                n, op, shapes, queued_at = lane.popleft()
+                if shapes is not None and len(shapes) > budget:
+                    lane.appendleft((n, op, shapes[budget:], queued_at))
+                    shapes = shapes[:budget]
+                elif op in self.BARRIERS:
+                    self._barriers.popleft()
+                # The source goes to the back of the round
+                if lane:
+                    self._lanes.move_to_end(source)
+                else:
+                    del self._lanes[source]
+                size = self._size(op, shapes)
+                budget -= size
+                self._depth -= size
+                self.drained += size
+                taken.append((op, shapes, queued_at))
+            if taken:
+                self._cond.notify_all()
+        return taken
+
+    def _next_lane(self):
+        # The first source in the round with an operation from before the
+        # oldest barrier; once there is none, the barrier is the oldest of all
+        limit = self._barriers[0] if self._barriers else math.inf
+        for source, lane in self._lanes.items():
+            if lane[0][0] < limit:
+                return source, lane
+        for source, lane in self._lanes.items():
+            if lane[0][0] == limit:
+                return source, lane
+        raise AssertionError("dispatch queue lost its oldest barrier")
+
+    def __len__(self):
+        return self._depth
+
+    def stats(self) -> Dict:
+        return {
+            "depth": self._depth,
+            "sources": len(self._lanes),
+            "capacity": self.capacity,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "drained": self.drained,
+            "rejected": self.rejected,
+            "waited": self.waited,
+            "last_tick_ms": round(self.last_tick_ms, 3),
+        }
+
+def drain(queue: DispatchQueue, handle, budget_s: float, chunk: int = 256, observe=None) -> int:
+    """
+    Pass queued operations to handle(op, shapes) in chunks until the queue
+    is empty or budget_s seconds have been spent. Returns the shapes handled.
+    observe(seconds) is called with the time from push to handled of each
+    operation.
+    """
+    start = time.perf_counter()
+    handled = 0
+    while time.perf_counter() - start < budget_s:
+        ops = queue.take(chunk)
+        if not ops:
+            break
+        for op, shapes, queued_at in ops:
+            handle(op, shapes)
+            handled += len(shapes) if shapes is not None else 1
+            if observe:
+                observe(time.perf_counter() - queued_at)
+    queue.last_tick_ms = (time.perf_counter() - start) * 1e3
+    return handled
@@ -0,0 +1,41 @@
+import json
+import math
+from typing import Dict, Tuple
+
+BBox = Tuple[float, float, float, float]  # (x1, y1, x2, y2) with x1 <= x2, y1 <= y2
+
+def parse_bbox(text: str) -> BBox:
+    """Parse "x1,y1,x2,y2" into a normalized bounding box."""
+    parts = [float(v) for v in text.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be x1,y1,x2,y2")
+    if not all(math.isfinite(v) for v in parts):
+        raise ValueError("bbox values must be finite")
+    x1, y1, x2, y2 = parts
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+def shape_bbox(shape_data: Dict) -> BBox:
+    """Bounding box of a history entry, matching how the whiteboard draws it; ValueError if not finite."""
+    bbox = _shape_bbox(shape_data)
+    if not all(math.isfinite(v) for v in bbox):
+        raise ValueError("shape coordinates must be finite")
+    return bbox
+
+def _shape_bbox(shape_data: Dict) -> BBox:
+    if shape_data['type'] == 'curve':
+        points = shape_data['points']
+        if isinstance(points, str):
+            points = json.loads(points)
+        xs = [p['x'] for p in points]
+        ys = [p['y'] for p in points]
+        return min(xs), min(ys), max(xs), max(ys)
+    x1, y1 = shape_data['start']
+    x2, y2 = shape_data['end']
+    if shape_data['type'] == 'circle':
+        # The ellipse item is placed at start with a radius taken from start/end
+        radius = shape_data.get('radius', ((x2 - x1)**2 + (y2 - y1)**2)**0.5)
+        return x1, y1, x1 + radius * 2, y1 + radius * 2
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+def intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
@@ -0,0 +1,405 @@
+import bisect
+import threading
+import time
+import uuid
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .geometry import BBox, shape_bbox
+from .history_cache import HistoryCache
+from .persistence import HistoryLog
+from .shape_store import ShapeStore, ShapeView
+from .spatial_index import GridIndex
+
+class History:
+    """
+    Drawing history where every entry carries a monotonically increasing
+    sequence number ("seq"), so clients can ask for what they missed.
+
+    Entries live in a columnar ShapeStore and are also kept in a grid index
+    on their bounding boxes for region queries. Reads return dicts in the
+    usual history JSON format, built on demand from the columns.
+
+    Shapes are addressed by their id. Replacing a shape appends its new
+    version with a new seq and retires the old row, so the entries stay in
+    seq order. Deletes consume a seq too and are remembered (up to
+    max_tombstones ids) so that since() can tell a client what to remove.
+
+    Every event is also stamped with its time t (Unix seconds, never
+    decreasing), and the board's past is kept: retired rows stay in the
+    store with the seq that retired them, and a clear keeps the store it
+    replaces as an epoch (up to max_epochs of them). seq_at() finds the
+    event at a time with a binary search over the event times, at() the
+    board after any event with one vectorized pass over the rows before it,
+    and changes() the events between two seqs for playback. Events before
+    timeline_seq (before a restore or in dropped epochs) are not known,
+    other than the time of timeline_seq itself if it was given.
+    A copy fed by another history sets keep_times, so its events keep the
+    times they were stamped with there: shapes carry theirs, deletes and
+    clears are given theirs.
+
+    seq also versions the board: with the history's random token (which
+    copies share) it makes an ETag. to_json() serializes the entries
+    through a HistoryCache, so only what changed since the last call is
+    encoded.
+
+    With a HistoryLog attached every event is also written to disk.
+
+    Entries are appended on the GUI thread and read from the server thread.
+    Appends and the index go through a lock; readers only take the lock to
+    note the store and row count, then build their dicts outside it.
+    """
+    def __init__(self, max_tombstones: int = 100_000, max_epochs: int = 16):
+        self._store = ShapeStore()
+        self._index = GridIndex()
+        self._rows: Dict[int, int] = {}  # shape id -> row of its live version
+        self._lock = threading.Lock()
+        self._log: Optional[HistoryLog] = None
+        self.seq = 0  # seq of the latest event
+        self.clear_seq = 0  # seq of the latest clear
+        self.top_id = 0  # highest shape id ever added, kept across deletes, clears and restarts
+        self.max_tombstones = max_tombstones
+        self._tombstones: List[Tuple[int, int]] = []  # (seq, id) of deletes, in seq order
+        self._tombstone_seqs: List[int] = []
+        self._tombstone_floor = 0  # deletes at or before this seq are not known
+        self.max_epochs = max_epochs
+        self._epochs: List[Tuple[int, ShapeStore]] = []  # (seq of the clear, store it ended)
+        self._times = array("d")  # time of every event after timeline_seq, by seq
+        self.timeline_seq = 0  # events up to this seq are not in the timeline
+        self.timeline_t: Optional[float] = None  # time of event timeline_seq, if known
+        self.keep_times = False
+        self.token = uuid.uuid4().hex[:8]  # tells this history's seqs from another's
+        self._cache = HistoryCache()
+
+    def _stamp_locked(self, t: Optional[float] = None) -> Tuple[int, float]:
+        """Take the next sequence number and note the time of its event (now unless given)."""
+        if t is None or not self.keep_times:
+            t = round(time.time(), 3)
+        last = self._times[-1] if self._times else self.timeline_t
+        if last is not None and last > t:
+            t = last  # the clock went back
+        self.seq += 1
+        self._times.append(t)
+        return self.seq, t
+
+    def _append_locked(self, shape_data: Dict, bbox: BBox):
+        shape_id = shape_data.get("id")
+        # The index goes first: if it rejects the box, the store is untouched
+        row = len(self._store)
+        self._index.insert(shape_data["seq"], bbox, row)
+        try:
+            self._store.append(shape_data, bbox)
+        except Exception:
+            self._index.remove(shape_data["seq"])
+            raise
+        if shape_id in self._rows:
+            # A shape that is already on the board is replaced
+            self._retire_locked(self._rows[shape_id], shape_data["seq"])
+        if shape_id:
+            self._rows[shape_id] = row
+            self.top_id = max(self.top_id, shape_id)
+
+    def _retire_locked(self, row: int, seq: int = 0):
+        self._store.delete(row, seq)
+        self._index.remove(int(self._store.column("seq")[row]))
+
+    def _reset_locked(self, capacity: int = 1024):
+        # Readers may still hold the old store, so start a new one
+        self._store = ShapeStore(capacity)
+        self._index.clear()
+        self._rows.clear()
+        self._tombstones.clear()
+        self._tombstone_seqs.clear()
+
+    def append(self, shape_data: Dict) -> int:
+        """Append a shape and stamp it with the next sequence number and the time."""
+        bbox = shape_bbox(shape_data)
+        with self._lock:
+            shape_data["seq"], shape_data["t"] = self._stamp_locked(shape_data.get("t"))
+            self._append_locked(shape_data, bbox)
+            seq = self.seq
+            if self._log:
+                self._log.append(shape_data)
+        if self._log and self._log.should_compact():
+            self.compact()
+        return seq
+
+    def get(self, shape_id: int) -> Optional[Dict]:
+        """Return the live version of a shape, or None."""
+        with self._lock:
+            store, row = self._store, self._rows.get(shape_id)
+        return None if row is None else store.rows([row])[0]
+
+    def replace(self, shape_data: Dict) -> Optional[Dict]:
+        """
+        Replace the shape with the id of shape_data by it, stamping it with
+        the next sequence number. Returns the previous version, or None
+        (and changes nothing) if there is no such shape.
+        """
+        bbox = shape_bbox(shape_data)
+        with self._lock:
+            row = self._rows.get(shape_data.get("id"))
+            if row is None:
+                return None
+            previous = self._store.rows([row])[0]
+            shape_data["seq"], shape_data["t"] = self._stamp_locked(shape_data.get("t"))
+            self._append_locked(shape_data, bbox)
+            if self._log:
+                # Replayed like an append: a shape with a known id replaces it
+                self._log.append(shape_data)
+        if self._log and self._log.should_compact():
+            self.compact()
+        return previous
+
+    def delete(self, ids: Iterable[int], t: Optional[float] = None) -> List[Dict]:
+        """
+        Remove the shapes with these ids; all of them under one sequence
+        number, at time t with keep_times. Returns the removed versions,
+        skipping unknown ids.
+        """
+        with self._lock:
+            rows = [(i, self._rows.pop(i)) for i in dict.fromkeys(ids) if i in self._rows]
+            if not rows:
+                return []
+            removed = self._store.rows([row for _, row in rows])
+            seq, t = self._stamp_locked(t)
+            for _, row in rows:
+                self._retire_locked(row, seq)
+            ids = [i for i, _ in rows]
+            self._tombstones.extend((self.seq, i) for i in ids)
+            self._tombstone_seqs.extend(self.seq for _ in ids)
+            if len(self._tombstones) > self.max_tombstones:
+                drop = len(self._tombstones) - self.max_tombstones
+                self._tombstone_floor = self._tombstone_seqs[drop - 1]
+                del self._tombstones[:drop], self._tombstone_seqs[:drop]
+            if self._log:
+                self._log.append({"op": "delete", "ids": ids, "seq": seq, "t": t})
+        return removed
+
+    def clear(self, t: Optional[float] = None):
+        """Drop all entries; the clear itself consumes a sequence number (at time t with keep_times)."""
+        with self._lock:
+            seq, t = self._stamp_locked(t)
+            self._epochs.append((seq, self._store))
+            if len(self._epochs) > self.max_epochs:
+                dropped, _ = self._epochs.pop(0)
+                self.timeline_t = self._times[dropped - self.timeline_seq - 1]
+                del self._times[:dropped - self.timeline_seq]
+                self.timeline_seq = dropped
+            self._reset_locked()
+            self.clear_seq = seq
+            if self._log:
+                self._log.append({"op": "clear", "seq": seq, "t": t})
+
+    def restore(self, seq: int, clear_seq: int, entries: List[Dict], store: Optional[ShapeStore] = None,
+                t: Optional[float] = None, top_id: int = 0):
+        """
+        Replace the history with entries (distinct shapes in seq order), e.g. from a log or a
+        snapshot of another copy. A store of live shapes before them, as HistoryLog.load()
+        gives, is taken over as is. The rows are indexed in one pass at the end.
+        t is the time of event seq, if known; top_id the highest shape id used before,
+        if higher than those of the shapes.
+        """
+        bboxes = [shape_bbox(shape_data) for shape_data in entries]
+        with self._lock:
+            self._reset_locked(max(1024, len(entries)))
+            if store is not None:
+                self._store = store
+            for shape_data, bbox in zip(entries, bboxes):
+                self._store.append(shape_data, bbox)
+            self._index_store_locked()
+            self.seq = seq
+            self.clear_seq = clear_seq
+            self.top_id = max([top_id, *self._rows])
+            # Deletes from before are not known, clients behind this need a full sync
+            self._tombstone_floor = seq
+            # Neither is the board before this, other than the shapes still on it
+            self._epochs.clear()
+            self._times = array("d")
+            self.timeline_seq = seq
+            self.timeline_t = t
+
+    def _index_store_locked(self):
+        """Index the rows of a store that was not built through _append_locked."""
+        store = self._store
+        boxes = np.column_stack([store.column(name) for name in ("bx1", "by1", "bx2", "by2")])
+        self._index.insert_many(store.column("seq").tolist(), boxes)
+        ids = store.column("id")
+        rows = np.flatnonzero(ids)
+        self._rows.update(zip(ids[rows].tolist(), rows.tolist()))
+
+    def attach_log(self, log: HistoryLog):
+        """Restore the history from a log and record all further events to it."""
+        seq, clear_seq, top_id, store, entries = log.load()
+        self.restore(seq, clear_seq, entries, store, top_id=top_id)
+        with self._lock:
+            log.open(seq)
+            self._log = log
+
+    def close(self):
+        """Stop recording to the attached log and close it."""
+        with self._lock:
+            log, self._log = self._log, None
+        if log:
+            log.close()
+
+    def compact(self):
+        """Start a new log and write a snapshot of the board in the background."""
+        with self._lock:
+            store, n = self._store, len(self._store)
+            seq, clear_seq, top_id = self.seq, self.clear_seq, self.top_id
+            rows = store.scan(0, n)
+            self._log.rotate(seq)
+        writer = threading.Thread(
+            target=lambda: self._log.write_snapshot(seq, clear_seq, top_id, store, rows),
+            daemon=True)
+        writer.start()
+        return writer
+
+    def _start_after(self, store: ShapeStore, n: int, seq: int) -> int:
+        return int(np.searchsorted(store.column("seq")[:n], seq, side="right"))
+
+    def view(self) -> ShapeView:
+        """Return a view of all entries as they are now."""
+        with self._lock:
+            store, n = self._store, len(self._store)
+        return ShapeView(store, store.scan(0, n))
+
+    def etag(self, seq: Optional[int] = None) -> str:
+        """Return the ETag of the history at seq, the current one by default."""
+        return f'"{self.token}-{self.seq if seq is None else seq}"'
+
+    def to_json(self) -> Tuple[int, str]:
+        """Return the seq and the JSON array of all entries, encoding only what changed."""
+        with self._lock:
+            store, n, seq = self._store, len(self._store), self.seq
+        return seq, self._cache.get(store, n, seq)
+
+    def cache_stats(self) -> Dict:
+        return self._cache.stats()
+
+    def in_region(self, bbox: BBox) -> List[Dict]:
+        """Return the entries whose bounding box intersects bbox, in seq order."""
+        with self._lock:
+            store, rows = self._store, self._index.query(bbox)
+        return store.rows(rows)
+
+    def select(self, cursor: int = 0, types: Optional[Iterable[str]] = None,
+               colors: Optional[Iterable[str]] = None, bbox: Optional[BBox] = None,
+               limit: Optional[int] = None) -> Tuple[ShapeView, Optional[int]]:
+        """
+        Return a view of the entries after cursor that match the filters,
+        together with the cursor of the next page if limit cut it short.
+        Filters run on the columns; dicts are only built when the view is read.
+        """
+        with self._lock:
+            store, n = self._store, len(self._store)
+            region_rows = self._index.query(bbox) if bbox else None
+        start = self._start_after(store, n, cursor)
+        if region_rows is not None:
+            rows = np.asarray(region_rows, np.int64)
+            rows = store.filter_rows(rows[rows >= start], types, colors)
+        else:
+            rows = store.scan(start, n, types, colors)
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = int(store.column("seq")[rows[-1]])
+        return ShapeView(store, rows), next_cursor
+
+    def since(self, since_seq: int) -> Tuple[bool, List[Dict], List[int]]:
+        """
+        Return (reset, entries, deleted ids) for a client that has seen up
+        to since_seq. Entries include the new versions of replaced shapes.
+
+        If a clear happened after since_seq, or deletes the history no longer
+        remembers, the client must drop its board, so reset is True and the
+        full snapshot is returned.
+        """
+        with self._lock:
+            store, n = self._store, len(self._store)
+            reset = since_seq < self.clear_seq or since_seq < self._tombstone_floor
+            deleted = [] if reset else [
+                i for _, i in self._tombstones[bisect.bisect_right(self._tombstone_seqs, since_seq):]]
+        start = 0 if reset else self._start_after(store, n, since_seq)
+        return reset, store.rows(store.scan(start, n)), deleted
+
+    def seq_at(self, t: float) -> int:
+        """Return the seq of the latest event at or before time t."""
+        with self._lock:
+            return self.timeline_seq + bisect.bisect_right(self._times, t)
+
+    def time_of(self, seq: int) -> Optional[float]:
+        """Return the time of event seq, None if it is not in the timeline."""
+        with self._lock:
+            if seq == self.timeline_seq:
+                return self.timeline_t
+            index = seq - self.timeline_seq - 1
+            return self._times[index] if 0 <= index < len(self._times) else None
+
+    def at(self, seq: int) -> Tuple[ShapeView, bool]:
+        """
+        Return a view of the board right after event seq, and whether it is
+        complete; before timeline_seq only the shapes that outlived it are known.
+
+        This is a vectorized pass over the rows of seq's epoch, O(rows) per
+        call: about 2 ms at a million rows. Keyframes are not worth it, as
+        serializing the view that comes back is O(shapes) and costs far more.
+        """
+        with self._lock:
+            i = bisect.bisect_right([clear_seq for clear_seq, _ in self._epochs], seq)
+            store = self._epochs[i][1] if i < len(self._epochs) else self._store
+            complete = seq >= self.timeline_seq
+        return ShapeView(store, store.live_at(seq)), complete
+
+    def changes(self, after: int, until: int) -> List[Tuple[int, float, str, object]]:
+        """
+        Return the events with a seq in (after, until] in order, as (seq, t,
+        op, data): ("add", shape), ("update", shape), ("delete", ids) or
+        ("clear", None). Events before timeline_seq are left out.
+        """
+        with self._lock:
+            after = max(after, self.timeline_seq)
+            until = min(until, self.seq)
+            epochs = self._epochs + [(until + 1, self._store)]
+            times = self._times[after - self.timeline_seq:until - self.timeline_seq]
+        if until <= after:
+            return []
+        events: Dict[int, list] = {}
+        for clear_seq, store in epochs:
+            if clear_seq <= after:
+                continue
+            seqs = store.column("seq")
+            lo, hi = np.searchsorted(seqs, [after, until], side="right")
+            for shape in store.rows(np.arange(lo, hi)):
+                events[shape["seq"]] = ["add", shape]
+            ids = store.column("id")
+            for seq, row in zip(*store.retired(after, until)):
+                event = events.get(seq)
+                if event and event[0] != "delete":
+                    event[0] = "update"  # a new version took the place of the row
+                else:
+                    events.setdefault(seq, ["delete", []])[1].append(int(ids[row]))
+            if clear_seq > until:
+                break
+            events[clear_seq] = ["clear", None]
+        return [(seq, times[seq - after - 1], op, data) for seq, (op, data) in sorted(events.items())]
+
+    def max_id(self) -> int:
+        """
+        Return the highest shape id the board ever had, 0 for a new board.
+        Deleted and cleared shapes count, so a new id never names an old shape.
+        """
+        return self.top_id
+
+    def nbytes(self) -> int:
+        """Bytes held by the history columns, the earlier epochs, the event times and the JSON cache."""
+        return (self._store.nbytes() + sum(store.nbytes() for _, store in self._epochs)
+                + self._times.itemsize * len(self._times) + self._cache.nbytes())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._store) - self._store.deleted
+
+    def __iter__(self):
+        return iter(self.view())
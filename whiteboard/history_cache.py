@@ -0,0 +1,98 @@
+"""
+Serialized history kept between reads.
+
+HistoryCache holds the JSON of a history's live shapes in chunks of
+chunk_size store rows, plus the whole array joined from them. Rows only
+ever go from live to retired, so a chunk is unchanged as long as it has
+the same number of rows and of retired rows; a read re-serializes just the
+chunks where that changed (the last, still filling chunk after appends and
+chunks where shapes were replaced or deleted), and the joined array is
+kept per store and seq, so reading an unchanged board costs nothing.
+
+RawJSON carries such text into a Socket.IO payload: python-socketio is
+given splice_json as its json module, whose dumps() inserts the text as
+is instead of parsing and encoding it again.
+"""
+import json
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .shape_store import DELETED, ShapeStore
+
+class RawJSON:
+    """Text that is already JSON, written out as is by splice_json.dumps."""
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+class splice_json:
+    """A json module for python-socketio that splices RawJSON values into its output."""
+    loads = staticmethod(json.loads)
+
+    @staticmethod
+    def dumps(obj, **kwargs) -> str:
+        raws: List[str] = []
+        token = uuid.uuid4().hex
+
+        def default(value):
+            if isinstance(value, RawJSON):
+                raws.append(value.text)
+                return f"{token}{len(raws) - 1}"
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+        text = json.dumps(obj, default=default, **kwargs)
+        for i, raw in enumerate(raws):
+            text = text.replace(f'"{token}{i}"', raw, 1)
+        return text
+
+class HistoryCache:
+    """The JSON array of a store's live rows, rebuilt chunk by chunk as the store changes."""
+    def __init__(self, chunk_size: int = 1024):
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._store: Optional[ShapeStore] = None
+        self._chunks: Dict[int, Tuple[Tuple[int, int], str]] = {}  # index -> (key, shapes joined by ",")
+        self._seq: Optional[int] = None
+        self._text = ""
+        self.hits = 0
+        self.chunks_built = 0
+
+    def get(self, store: ShapeStore, n: int, seq: int) -> str:
+        """Return the JSON array of the live rows among the first n of store, whose history is at seq."""
+        with self._lock:
+            if store is self._store and seq == self._seq:
+                self.hits += 1
+                return self._text
+            if store is not self._store:
+                self._store = store
+                self._chunks = {}
+            size = self.chunk_size
+            retired = (store.column("flags")[:n] & DELETED) != 0
+            counts = np.add.reduceat(retired, np.arange(0, n, size), dtype=np.int64).tolist() if n else []
+            texts = []
+            for i, count in enumerate(counts):
+                lo = i * size
+                key = (min(size, n - lo), count)
+                cached = self._chunks.get(i)
+                if cached is None or cached[0] != key:
+                    rows = np.flatnonzero(~retired[lo:lo + size]) + lo
+                    # allow_nan=False: strict JSON, as FastAPI's responses on the filtered path
+                    text = json.dumps(store.rows(rows), separators=(",", ":"), allow_nan=False)[1:-1]
+                    cached = self._chunks[i] = (key, text)
+                    self.chunks_built += 1
+                if cached[1]:
+                    texts.append(cached[1])
+            for i in [i for i in self._chunks if i >= len(counts)]:
+                del self._chunks[i]
+            self._seq = seq
+            self._text = "[" + ",".join(texts) + "]"
+            return self._text
+
+    def nbytes(self) -> int:
+        return len(self._text) + sum(len(text) for _, text in self._chunks.values())
+
+    def stats(self) -> Dict:
+        return {"chunks": len(self._chunks), "bytes": self.nbytes(), "hits": self.hits,
+                "chunks_built": self.chunks_built}
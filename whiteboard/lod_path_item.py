@@ -0,0 +1,35 @@
+import math
+from PySide6.QtWidgets import QGraphicsPathItem, QStyleOptionGraphicsItem
+from . import curve
+
+class LodPathItem(QGraphicsPathItem):
+    """
+    Curve item that paints a simplified path when zoomed out.
+
+    The level of detail of the painter gives the size of a device pixel in
+    scene units; points closer than about half of that to the simplified
+    path cannot be seen, so paint() uses a path simplified to that
+    tolerance. Simplified paths are built lazily per power-of-two tolerance
+    and kept for the next frame.
+    """
+    def __init__(self, points, build_path):
+        super().__init__(build_path(points))
+        self._points = points
+        self._build_path = build_path
+        self._paths = {}
+
+    def path_for_lod(self, lod: float):
+        tolerance = 0.5 / lod if lod > 0 else math.inf
+        if tolerance <= 1:
+            return self.path()
+        level = 2 ** math.floor(math.log2(tolerance))
+        path = self._paths.get(level)
+        if path is None:
+            path = self._paths[level] = self._build_path(curve.simplify(self._points, level))
+        return path
+
+    def paint(self, painter, option, widget=None):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        painter.setPen(self.pen())
+        painter.setBrush(self.brush())
+        painter.drawPath(self.path_for_lod(lod))
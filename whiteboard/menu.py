@@ -1,4 +1,4 @@
-from PySide6.QtGui import QAction
+from PySide6.QtGui import QAction, QKeySequence
 
 class WBMenu:
     def __init__(self, whiteboard):
@@ -15,6 +15,18 @@ class WBMenu:
         """Create the menu bar for selecting shapes and colors."""
         menu_bar = self.whiteboard.menuBar()
 
+        # Edit menu
+        edit_menu = menu_bar.addMenu("Edit")
+        undo_action = QAction("Undo", self.whiteboard)
+        undo_action.setShortcut(QKeySequence.Undo)
+        undo_action.triggered.connect(self.whiteboard.undo)
+        edit_menu.addAction(undo_action)
+
+        redo_action = QAction("Redo", self.whiteboard)
+        redo_action.setShortcut(QKeySequence.Redo)
+        redo_action.triggered.connect(self.whiteboard.redo)
+        edit_menu.addAction(redo_action)
+
         # Shapes menu
         shapes_menu = menu_bar.addMenu("Shapes")
         line_action = QAction("Line", self.whiteboard)
@@ -55,6 +67,16 @@ class WBMenu:
         blue_action.triggered.connect(lambda: self.whiteboard.set_pen_color("#0000FF"))
         colors_menu.addAction(blue_action)
 
+        # View menu
+        view_menu = menu_bar.addMenu("View")
+        quality_action = QAction("Quality Rendering", self.whiteboard)
+        quality_action.triggered.connect(lambda: self.whiteboard.set_render_mode("quality"))
+        view_menu.addAction(quality_action)
+
+        fast_action = QAction("Fast Rendering (large boards)", self.whiteboard)
+        fast_action.triggered.connect(lambda: self.whiteboard.set_render_mode("fast"))
+        view_menu.addAction(fast_action)
+
     def add_menu(self, menu_name, options):
         """
         Add a menu with a list of options.
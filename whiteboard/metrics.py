@@ -0,0 +1,237 @@
+"""
+Prometheus metrics and sampled traces for the draw pipeline.
+
+Metrics are declared where they are measured, with histogram(), counter()
+and gauge(), and REGISTRY.render() returns them all in the Prometheus text
+format. Gauges are read from a callback at scrape time, so the hot path
+only pays for histograms and counters: a bisect and two additions under a
+lock. With REGISTRY.enabled off, timed() and Histogram.time() skip the
+clock, and observe()/inc() return at once.
+
+TRACER follows single shapes through the pipeline. With a sample_rate, that
+fraction of operations is traced: the first shape of the operation is
+watched, and every stage it passes (applied, broadcast, queued, rendered)
+adds a span with the time since ingress. With a sample rate of 0 nothing
+is watched, and a stage costs one truthiness check.
+"""
+import bisect
+import functools
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return "{%s}" % pairs
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    def __init__(self):
+        self.enabled = True
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        if not REGISTRY.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in values.items()]
+
+class Gauge:
+    """A value read at scrape time: collect() returns a number, or {label values: number}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        value = self.collect()
+        if not self.labels:
+            return [f"{self.name} {_number(value)}"]
+        return [f"{self.name}{_labels(self.labels, key)} {_number(v)}" for key, v in value.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # label values -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        if not REGISTRY.enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = []
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = _labels(self.labels + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter() if REGISTRY.enabled else None
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+def gauge(name: str, help: str, collect: Callable, labels: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, collect, labels))
+
+def histogram(name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+# (name, start) of the request or event being handled, the start of its traces
+_ingress: ContextVar = ContextVar("ingress", default=None)
+
+def timed(histogram: Histogram, label: str):
+    """Decorate a coroutine function to observe its duration under label."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return await fn(*args, **kwargs)
+            start = time.perf_counter()
+            if TRACER.sample_rate:
+                _ingress.set((label, start))
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, label)
+        return wrapper
+    return decorate
+
+class Trace:
+    __slots__ = ("name", "started", "start", "shape_id", "spans")
+
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.started = time.time() - (time.perf_counter() - start)
+        self.start = start
+        self.shape_id = None
+        self.spans: List[Tuple[str, float]] = []
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "started": self.started, "shape_id": self.shape_id,
+                "spans": [{"stage": stage, "ms": round(ms, 3)} for stage, ms in self.spans]}
+
+class Tracer:
+    """
+    Samples operations and records when their first shape passes each
+    stage. Shapes are watched by object identity, so a stage can mark the
+    dicts it handles without knowing about traces. A trace stops being
+    watched at its final stage; at most `keep` traces are kept.
+    """
+    def __init__(self, sample_rate: float = 0.0, keep: int = 100, final: str = "broadcast"):
+        self.sample_rate = sample_rate
+        self.final = final
+        self.traces: deque = deque(maxlen=keep)
+        self.active: Dict[int, Tuple[Dict, Trace]] = {}  # id(shape) -> (shape, trace)
+        self._lock = threading.Lock()
+
+    def start(self, shapes: Optional[List[Dict]]) -> Optional[Trace]:
+        """Maybe trace an operation, from the ingress of the current request or event."""
+        if not self.sample_rate or not shapes or random.random() >= self.sample_rate:
+            return None
+        name, start = _ingress.get() or ("internal", time.perf_counter())
+        trace = Trace(name, start)
+        with self._lock:
+            self.traces.append(trace)
+            self.active[id(shapes[0])] = (shapes[0], trace)
+            while len(self.active) > self.traces.maxlen:
+                del self.active[next(iter(self.active))]
+        return trace
+
+    def mark(self, shapes, stage: str, replaced: Optional[List[Dict]] = None):
+        """
+        Record that shapes reached a stage. replaced are the dicts that
+        carry on in their place, if the stage copied them.
+        """
+        if not self.active:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            for i, shape in enumerate(shapes):
+                entry = self.active.get(id(shape))
+                if entry is None or entry[0] is not shape:
+                    continue
+                trace = entry[1]
+                trace.shape_id = shape.get("id", trace.shape_id)
+                if all(s != stage for s, _ in trace.spans):
+                    trace.spans.append((stage, (now - trace.start) * 1e3))
+                del self.active[id(shape)]
+                if stage != self.final:
+                    carried = replaced[i] if replaced is not None else shape
+                    self.active[id(carried)] = (carried, trace)
+
+    def recent(self) -> List[Dict]:
+        with self._lock:
+            return [trace.to_dict() for trace in self.traces]
+
+TRACER = Tracer()
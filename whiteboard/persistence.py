@@ -0,0 +1,203 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .shape_store import ShapeStore
+
+logger = logging.getLogger(__name__)
+
+class HistoryLog:
+    """
+    Durable storage for the drawing history in a data directory.
+
+    Events are appended as JSON lines to events-<seq>.log, where <seq> is the
+    history seq the log starts after. A line is either a shape as stored in
+    the history, which replaces an earlier shape with the same id, or an
+    operation: {"op": "clear", "seq": ..., "t": ...} or {"op": "delete",
+    "ids": [...], "seq": ..., "t": ...}. Writes are buffered and fsynced in
+    batches every fsync_interval seconds by a background thread. A compaction
+    writes the whole board to snapshot-<seq>.npz and starts a new log, after
+    which older files are removed. Loading reads the latest snapshot and
+    replays the logs that follow it.
+
+    The snapshot holds the ShapeStore columns of the live shapes as NumPy
+    arrays, so loading it is a few array reads rather than parsing every
+    shape; the log tail is replayed as dicts. The snapshot also keeps the
+    highest shape id ever used, so ids of deleted or cleared shapes are
+    not handed out again after a restart. snapshot-<seq>.json files
+    (the whole board as JSON, written by earlier versions) are still read.
+    """
+    def __init__(self, data_dir: str, fsync_interval: float = 0.05, snapshot_every: int = 100_000):
+        self.data_dir = data_dir
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.events_since_snapshot = 0
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._file = None
+        self._dirty = False
+        self._closed = threading.Event()
+        os.makedirs(data_dir, exist_ok=True)
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+
+    def _path(self, kind: str, seq: int) -> str:
+        ext = "npz" if kind == "snapshot" else "log"
+        return os.path.join(self.data_dir, f"{kind}-{seq:012d}.{ext}")
+
+    def _files(self, kind: str) -> List[Tuple[int, str]]:
+        """Return (seq, path) of the files of one kind, oldest first."""
+        exts = (".npz", ".json") if kind == "snapshot" else (".log",)
+        files = []
+        for path in glob.glob(os.path.join(self.data_dir, f"{kind}-*")):
+            seq, ext = os.path.splitext(os.path.basename(path)[len(kind) + 1:])
+            if seq.isdigit() and ext in exts:
+                files.append((int(seq), path))
+        return sorted(files)
+
+    @staticmethod
+    def _read_events(path: str) -> List[Dict]:
+        """Parse a log file through a memory map in a single json call."""
+        if os.path.getsize(path) == 0:
+            return []
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # A crash can leave a partial last line; it was never acknowledged
+            end = data.rfind(b"\n") + 1
+            if end == 0:
+                return []
+            body = data[:end - 1]
+        try:
+            return json.loads(b"[" + body.replace(b"\n", b",") + b"]")
+        except ValueError:
+            events = []
+            for line in body.split(b"\n"):
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping corrupt log entry in %s", path)
+            return events
+
+    def load(self) -> Tuple[int, int, int, Optional[ShapeStore], List[Dict]]:
+        """
+        Rebuild the board from the latest snapshot and the log tail.
+
+        Returns (seq, clear_seq, top_id, store, entries): the highest shape
+        id known to have been used (snapshots of earlier versions do not
+        say, nor count the shapes they dropped), the snapshot's shapes still
+        on the board as a ShapeStore (None without one) and the shapes added
+        after it, in seq order.
+        """
+        seq, clear_seq, top_id, store, shapes = 0, 0, 0, None, []
+        snapshots = self._files("snapshot")
+        if snapshots and snapshots[-1][1].endswith(".npz"):
+            with np.load(snapshots[-1][1], allow_pickle=False) as arrays:
+                seq, clear_seq, *top = (int(v) for v in arrays["snapshot"])
+                top_id = top[0] if top else int(arrays["id"].max(initial=0))
+                store = dict(arrays)
+        elif snapshots:
+            with open(snapshots[-1][1], "rb") as f:
+                snapshot = json.load(f)
+            seq, clear_seq, shapes = snapshot["seq"], snapshot["clear_seq"], snapshot["shapes"]
+        # Shapes by id (by seq if they have none), in seq order
+        key = lambda shape: shape.get("id") or ("seq", shape["seq"])
+        entries = {key(shape): shape for shape in shapes}
+        dropped = set()  # ids of snapshot shapes replaced or deleted since
+        for log_seq, path in self._files("events"):
+            if log_seq < seq:
+                continue
+            for event in self._read_events(path):
+                if event["seq"] <= seq:
+                    continue
+                seq = event["seq"]
+                op = event.get("op")
+                if op is None:
+                    # Re-inserted, so a replaced shape moves to its new place in seq order
+                    entries.pop(key(event), None)
+                    entries[key(event)] = event
+                    if event.get("id"):
+                        dropped.add(event["id"])
+                        top_id = max(top_id, event["id"])
+                elif op == "delete":
+                    for shape_id in event["ids"]:
+                        entries.pop(shape_id, None)
+                    dropped.update(event["ids"])
+                elif op == "clear":
+                    entries = {}
+                    store = None
+                    clear_seq = seq
+        if store is not None:
+            ids = store["id"]
+            rows = np.flatnonzero(~np.isin(ids, list(dropped)) | (ids == 0)) if dropped else None
+            store = ShapeStore.from_arrays(store, rows)
+        return seq, clear_seq, top_id, store, list(entries.values())
+
+    def open(self, seq: int):
+        """Start appending to a new log after seq and start the fsync thread."""
+        path = self._path("events", seq)
+        if os.path.exists(path):
+            # Drop a partial last line so new events start on a line of their own
+            with open(path, "rb+") as f:
+                f.truncate(f.read().rfind(b"\n") + 1)
+        with self._lock:
+            self._file = open(path, "a", encoding="utf-8")
+        self._flusher.start()
+
+    def append(self, event: Dict):
+        """Append one event; it becomes durable at the next batched fsync."""
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._dirty = True
+            self.events_since_snapshot += 1
+
+    def should_compact(self) -> bool:
+        return self.events_since_snapshot >= self.snapshot_every
+
+    def rotate(self, seq: int):
+        """Switch to a new log for the events after seq."""
+        with self._lock:
+            self._sync()
+            self._file.close()
+            self._file = open(self._path("events", seq), "a", encoding="utf-8")
+            self.events_since_snapshot = 0
+
+    def write_snapshot(self, seq: int, clear_seq: int, top_id: int, store: ShapeStore, rows: np.ndarray):
+        """
+        Atomically write a snapshot of the given store rows at seq, with the
+        highest shape id used so far, and drop the files it covers.
+        """
+        with self._snapshot_lock:
+            path = self._path("snapshot", seq)
+            tmp = path + ".tmp"
+            arrays = store.to_arrays(rows)
+            with open(tmp, "wb") as f:
+                np.savez(f, snapshot=np.array([seq, clear_seq, top_id], np.int64), **arrays)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            for old_seq, old_path in self._files("snapshot") + self._files("events"):
+                # A .json snapshot at the same seq is an earlier version's
+                if old_seq < seq or (old_seq == seq and old_path.endswith(".json")):
+                    os.remove(old_path)
+
+    def _sync(self):
+        if self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                self._sync()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._file:
+                self._sync()
+                self._file.close()
+                self._file = None
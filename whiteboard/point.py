@@ -1,6 +1,7 @@
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 class Point(BaseModel):
+    model_config = ConfigDict(allow_inf_nan=False)
     x: float
     y: float
\ No newline at end of file
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from . import metrics
+
+THROTTLED = metrics.counter("whiteboard_throttled_total",
+                            "Drawing requests and events rejected by the rate limiter", ["surface"])
+THROTTLED_SHAPES = metrics.counter("whiteboard_throttled_shapes_total",
+                                   "Shapes in the rejected requests and events", ["surface"])
+
+class RateLimited(Exception):
+    """Raised when a caller has used up its tokens; retry_after is in seconds."""
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"rate limit exceeded for {key}, retry in {retry_after:.2f} s")
+        self.key = key
+        self.retry_after = retry_after
+
+class OverBurst(RateLimited):
+    """
+    Raised for a cost above the burst, which no bucket ever holds: waiting
+    does not help (retry_after is None), the caller has to split it.
+    """
+    def __init__(self, key: str, cost: float, burst: float):
+        Exception.__init__(self, f"{cost:g} shapes at once is more than the burst of {burst:g} for {key}, "
+                                 f"send smaller batches")
+        self.key = key
+        self.retry_after = None
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst; starts full at now."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_for(self, cost: float) -> float:
+        """Seconds until cost tokens (at most burst) are there, 0 if they are."""
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+class RateLimiter:
+    """
+    Token buckets by key: a connection's sid, an API key or a client
+    address. Each operation costs one token per shape; a request is let
+    through only if every bucket it is charged to has the tokens. An empty
+    bucket refills at rate tokens per second up to burst, so a client can
+    draw in bursts but not sustain more than rate. An operation costing
+    more than burst is refused outright with OverBurst.
+
+    With rate 0 nothing is limited. At most max_keys buckets are kept; the
+    least recently used one is forgotten (that is, refilled) first.
+    """
+    def __init__(self, rate: float = 0, burst: float = 100, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    def _bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def charge(self, keys: Iterable[Optional[str]], cost: float = 1, surface: str = "rest"):
+        """
+        Take cost tokens from the bucket of every key (None keys are skipped)
+        or raise RateLimited, OverBurst if cost is above the burst.
+        """
+        if not self.rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            buckets = [(key, self._bucket(key, now)) for key in keys if key is not None]
+            for key, bucket in buckets:
+                bucket.refill(now)
+                if cost > self.burst:
+                    error = OverBurst(key, cost, self.burst)
+                elif bucket.wait_for(cost) > 0:
+                    error = RateLimited(key, bucket.wait_for(cost))
+                else:
+                    continue
+                self.throttled += 1
+                THROTTLED.inc(surface)
+                THROTTLED_SHAPES.inc(surface, amount=cost)
+                raise error
+            for key, bucket in buckets:
+                bucket.tokens -= cost
+            self.allowed += 1
+
+    def forget(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,85 @@
+import math
+from pydantic import BaseModel, ConfigDict, model_validator
+from typing import List, Literal, Optional, Tuple
+from . import curve
+from .point import Point
+from .shape_store import SHAPE_TYPES
+
+class Shape(BaseModel):
+    """A single shape as accepted by the batch drawing APIs."""
+    model_config = ConfigDict(allow_inf_nan=False)  # NaN or inf would break the spatial index
+    type: Literal["line", "dotted_line", "circle", "rect", "curve"]
+    start: Optional[Tuple[float, float]] = None
+    end: Optional[Tuple[float, float]] = None
+    points: Optional[List[Point]] = None
+    color: str = "#000000"
+    dot_interval: Optional[float] = None
+
+    @model_validator(mode="after")
+    def check_geometry(self):
+        if self.type == "curve":
+            if not self.points or len(self.points) < 2:
+                raise ValueError("a curve needs at least two points")
+            if len(self.points) > curve.MAX_POINTS:
+                raise ValueError(f"a curve has at most {curve.MAX_POINTS} points")
+        elif self.start is None or self.end is None:
+            raise ValueError(f"a {self.type} needs start and end")
+        if self.dot_interval is not None and self.dot_interval <= 0:
+            raise ValueError("dot_interval must be positive")
+        return self
+
+    def to_data(self) -> dict:
+        """Convert to the dict format used by the whiteboard history."""
+        return self.model_dump(exclude_none=True)
+
+def _number(value, key: str) -> float:
+    try:
+        value = float(value)
+    except TypeError:
+        raise ValueError(f"{key} must be a number")
+    if not math.isfinite(value):
+        raise ValueError(f"{key} must be a finite number")
+    return value
+
+def _pair(value, key: str) -> Tuple[float, float]:
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError(f"{key} must be an [x, y] pair")
+    return _number(value[0], key), _number(value[1], key)
+
+def check_shape(data) -> dict:
+    """
+    Validate a shape dict the way Shape does, without building a model or
+    a Point per point: the fast path for bulk imports. Returns what
+    Shape.to_data would, plus a circle's radius; raises ValueError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("a shape must be an object")
+    shape_type = data.get("type")
+    if shape_type not in SHAPE_TYPES:
+        raise ValueError(f"unknown shape type {shape_type!r}")
+    color = data.get("color", "#000000")
+    if not isinstance(color, str):
+        raise ValueError("color must be a string")
+    shape = {"type": shape_type}
+    for key in ("start", "end"):
+        if data.get(key) is not None:
+            shape[key] = _pair(data[key], key)
+    if data.get("points") is not None:
+        try:
+            points = curve.to_tuples(data["points"])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"invalid points: {e}")
+        shape["points"] = curve.to_dicts(points)
+    shape["color"] = color
+    if data.get("dot_interval") is not None:
+        shape["dot_interval"] = _number(data["dot_interval"], "dot_interval")
+        if shape["dot_interval"] <= 0:
+            raise ValueError("dot_interval must be positive")
+    if shape_type == "circle" and data.get("radius") is not None:
+        shape["radius"] = _number(data["radius"], "radius")
+    if shape_type == "curve":
+        if len(shape.get("points", ())) < 2:
+            raise ValueError("a curve needs at least two points")
+    elif "start" not in shape or "end" not in shape:
+        raise ValueError(f"a {shape_type} needs start and end")
+    return shape
@@ -0,0 +1,298 @@
+import bisect
+import json
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from .geometry import BBox, shape_bbox
+from . import curve
+
+SHAPE_TYPES = ("line", "dotted_line", "circle", "rect", "curve")
+TYPE_IDS = {name: i for i, name in enumerate(SHAPE_TYPES)}
+# Per-type optional number kept in the aux column
+AUX_KEYS = {"dotted_line": "dot_interval", "circle": "radius"}
+
+HAS_START_END = 1
+HAS_POINTS = 2
+HAS_AUX = 4
+HAS_COLOR = 8
+DELETED = 16  # the row was deleted or replaced by a newer version
+LIVE = np.iinfo(np.int64).max  # "end" of a row that was not retired
+
+_COLUMNS = {
+    "kind": np.uint8,
+    "flags": np.uint8,
+    "color": np.uint32,
+    "id": np.int64,
+    "seq": np.int64,
+    "t": np.float64,
+    "end": np.int64,
+    "x1": np.float64, "y1": np.float64, "x2": np.float64, "y2": np.float64,
+    "aux": np.float64,
+    "bx1": np.float64, "by1": np.float64, "bx2": np.float64, "by2": np.float64,
+    "pt_start": np.int64,
+    "pt_count": np.int32,
+}
+_KNOWN_KEYS = {"type", "start", "end", "points", "color", "id", "seq", "t"}
+
+class ShapeStore:
+    """
+    Columnar, append-only storage for history entries.
+
+    Every shape is one row across typed NumPy columns: a type enum, flags,
+    an interned color id, id/seq and the time t, start/end, one per-type number (aux) and
+    the bounding box. Curve points live in one flat float buffer addressed
+    by pt_start/pt_count. Rare keys the columns do not cover are kept in a
+    sparse per-row dict so rows still serialize to the original JSON shape.
+
+    Rows are never removed: delete() flags a row DELETED and scans skip it.
+    It also records the seq that retired the row in the end column, so
+    live_at() can tell which rows were live after any earlier event.
+
+    Columns grow by reallocation, never in place, so a reader that saw n
+    rows can keep reading them while the writer appends. Only one thread
+    may append or delete.
+
+    to_arrays() copies rows out as plain arrays (for np.savez) and
+    from_arrays() makes a store of them again, without going through dicts.
+    """
+    def __init__(self, capacity: int = 1024):
+        self._columns = {name: np.empty(capacity, dtype) for name, dtype in _COLUMNS.items()}
+        self._points = np.empty(capacity * 4, np.float64)
+        self._n = 0
+        self._n_points = 0
+        self.colors: List[str] = [""]
+        self._color_ids: Dict[str, int] = {}
+        self.extras: Dict[int, Dict] = {}
+        self.deleted = 0
+        self._retired_seqs = array("q")  # seq of every retirement, in order
+        self._retired_rows = array("q")
+
+    def __len__(self):
+        return self._n
+
+    def column(self, name: str) -> np.ndarray:
+        """Return the filled part of a column."""
+        return self._columns[name][:self._n]
+
+    def points(self) -> np.ndarray:
+        """Return the filled part of the flat x, y point buffer."""
+        return self._points[:self._n_points]
+
+    def color_id(self, color: str) -> Optional[int]:
+        return self._color_ids.get(color)
+
+    def _grow(self):
+        capacity = len(self._columns["kind"]) * 2
+        columns = {}
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, column.dtype)
+            grown[:self._n] = column[:self._n]
+            columns[name] = grown
+        self._columns = columns
+
+    def _add_points(self, points) -> Tuple[int, int]:
+        flat = np.asarray(curve.to_tuples(points), np.float64).ravel()
+        start = self._n_points
+        if start + len(flat) > len(self._points):
+            grown = np.empty(max(len(self._points) * 2, start + len(flat)), np.float64)
+            grown[:start] = self._points[:start]
+            self._points = grown
+        self._points[start:start + len(flat)] = flat
+        self._n_points = start + len(flat)
+        return start, len(flat) // 2
+
+    def append(self, shape_data: Dict, bbox: Optional[BBox] = None) -> int:
+        """Append a shape dict as a new row and return the row number."""
+        kind = TYPE_IDS[shape_data["type"]]
+        if self._n == len(self._columns["kind"]):
+            self._grow()
+        row = self._n
+        c = self._columns
+        flags = 0
+        if "start" in shape_data:
+            flags |= HAS_START_END
+            c["x1"][row], c["y1"][row] = shape_data["start"]
+            c["x2"][row], c["y2"][row] = shape_data["end"]
+        if "points" in shape_data:
+            flags |= HAS_POINTS
+            c["pt_start"][row], c["pt_count"][row] = self._add_points(shape_data["points"])
+        aux_key = AUX_KEYS.get(shape_data["type"])
+        if aux_key in shape_data:
+            flags |= HAS_AUX
+            c["aux"][row] = shape_data[aux_key]
+        color = shape_data.get("color")
+        if color is not None:
+            flags |= HAS_COLOR
+            color_id = self._color_ids.get(color)
+            if color_id is None:
+                color_id = self._color_ids[color] = len(self.colors)
+                self.colors.append(color)
+            c["color"][row] = color_id
+        c["kind"][row] = kind
+        c["flags"][row] = flags
+        c["id"][row] = shape_data.get("id", 0)
+        c["seq"][row] = shape_data.get("seq", 0)
+        c["t"][row] = shape_data.get("t", 0)
+        c["end"][row] = LIVE
+        c["bx1"][row], c["by1"][row], c["bx2"][row], c["by2"][row] = bbox or shape_bbox(shape_data)
+        extra = {k: v for k, v in shape_data.items() if k not in _KNOWN_KEYS and k != aux_key}
+        if extra:
+            self.extras[row] = extra
+        self._n = row + 1
+        return row
+
+    def delete(self, row: int, seq: int = 0):
+        """Flag a row as deleted, retired by event seq; scans and filters skip it from now on."""
+        self._columns["flags"][row] |= DELETED
+        self.deleted += 1
+        if seq:
+            self._columns["end"][row] = seq
+            self._retired_seqs.append(seq)
+            self._retired_rows.append(row)
+
+    def live_at(self, seq: int) -> np.ndarray:
+        """Return the rows that were live right after event seq."""
+        n = int(np.searchsorted(self.column("seq"), seq, side="right"))
+        return np.flatnonzero(self._columns["end"][:n] > seq)
+
+    def retired(self, after: int, until: int) -> Tuple[List[int], List[int]]:
+        """Return (seqs, rows) of the retirements by events in (after, until], in order."""
+        lo = bisect.bisect_right(self._retired_seqs, after)
+        hi = bisect.bisect_right(self._retired_seqs, until)
+        return self._retired_seqs[lo:hi].tolist(), self._retired_rows[lo:hi].tolist()
+
+    def rows(self, indices: Sequence[int]) -> List[Dict]:
+        """Materialize rows as dicts in the history JSON format."""
+        idx = np.asarray(indices, np.int64)
+        c = {name: column[idx].tolist() for name, column in self._columns.items()}
+        points = self._points
+        colors = self.colors
+        out = []
+        for i, row in enumerate(idx.tolist()):
+            flags = c["flags"][i]
+            type_name = SHAPE_TYPES[c["kind"][i]]
+            shape = {"type": type_name}
+            if flags & HAS_START_END:
+                shape["start"] = (c["x1"][i], c["y1"][i])
+                shape["end"] = (c["x2"][i], c["y2"][i])
+            if flags & HAS_POINTS:
+                start = c["pt_start"][i]
+                flat = points[start:start + 2 * c["pt_count"][i]].tolist()
+                shape["points"] = [{"x": x, "y": y} for x, y in zip(flat[0::2], flat[1::2])]
+            if flags & HAS_COLOR:
+                shape["color"] = colors[c["color"][i]]
+            if flags & HAS_AUX:
+                shape[AUX_KEYS[type_name]] = c["aux"][i]
+            if row in self.extras:
+                shape.update(self.extras[row])
+            shape["id"] = c["id"][i]
+            shape["seq"] = c["seq"][i]
+            if c["t"][i]:
+                shape["t"] = c["t"][i]
+            out.append(shape)
+        return out
+
+    def iter_rows(self, indices: Sequence[int], chunk_size: int = 4096) -> Iterator[Dict]:
+        """Materialize rows lazily, chunk_size rows at a time."""
+        for start in range(0, len(indices), chunk_size):
+            yield from self.rows(indices[start:start + chunk_size])
+
+    def scan(self, start: int, stop: int, types: Optional[Iterable[str]] = None,
+             colors: Optional[Iterable[str]] = None, bbox: Optional[BBox] = None) -> np.ndarray:
+        """Return the live row numbers in [start, stop) matching every given filter."""
+        mask = self._mask(lambda name: self._columns[name][start:stop], types, colors, bbox)
+        return np.flatnonzero(mask) + start
+
+    def filter_rows(self, rows: np.ndarray, types: Optional[Iterable[str]] = None,
+                    colors: Optional[Iterable[str]] = None, bbox: Optional[BBox] = None) -> np.ndarray:
+        """Return the given row numbers that are live and match every given filter."""
+        rows = np.asarray(rows, np.int64)
+        return rows[self._mask(lambda name: self._columns[name][rows], types, colors, bbox)]
+
+    def _mask(self, column, types, colors, bbox) -> np.ndarray:
+        mask = (column("flags") & DELETED) == 0
+        if types:
+            kinds = [TYPE_IDS[t] for t in types if t in TYPE_IDS]
+            mask &= np.isin(column("kind"), kinds)
+        if colors:
+            wanted = {c.lower() for c in colors}
+            ids = [i for i, c in enumerate(self.colors) if i and c.lower() in wanted]
+            has_color = (column("flags") & HAS_COLOR) != 0
+            color_mask = np.isin(column("color"), ids) & has_color
+            if "#000000" in wanted:
+                # Shapes without a color are drawn black
+                color_mask |= ~has_color
+            mask &= color_mask
+        if bbox:
+            mask &= ((column("bx1") <= bbox[2]) & (column("bx2") >= bbox[0])
+                     & (column("by1") <= bbox[3]) & (column("by2") >= bbox[1]))
+        return mask
+
+    def to_arrays(self, rows: Sequence[int]) -> Dict[str, np.ndarray]:
+        """Copy the given rows out as live rows: one array per column, "points" and a JSON "meta"."""
+        idx = np.asarray(rows, np.int64)
+        arrays = _take(self._columns, self._points, idx)
+        arrays["flags"] &= ~np.uint8(DELETED)
+        arrays["end"][:] = LIVE
+        meta = {"colors": self.colors,
+                "extras": [[i, self.extras[row]] for i, row in enumerate(idx.tolist()) if row in self.extras]}
+        arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), np.uint8)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, rows: Optional[np.ndarray] = None) -> "ShapeStore":
+        """Make a store of arrays from to_arrays(), keeping only the given rows if any."""
+        columns = {name: arrays[name] for name in _COLUMNS}
+        if rows is not None:
+            columns = _take(columns, arrays["points"], np.asarray(rows, np.int64))
+        else:
+            columns["points"] = arrays["points"]
+        n = len(columns["kind"])
+        store = cls(max(n, 1))
+        for name in _COLUMNS:
+            store._columns[name][:n] = columns[name]
+        store._points = np.array(columns["points"], np.float64)
+        store._n, store._n_points = n, len(store._points)
+        meta = json.loads(bytes(arrays["meta"]))
+        store.colors = meta["colors"]
+        store._color_ids = {color: i for i, color in enumerate(store.colors) if i}
+        extras = {i: extra for i, extra in meta["extras"]}
+        if rows is not None:
+            new_rows = {int(row): i for i, row in enumerate(rows)}
+            extras = {new_rows[i]: extra for i, extra in extras.items() if i in new_rows}
+        store.extras = extras
+        return store
+
+    def nbytes(self) -> int:
+        """Bytes used by the filled part of the columns and point buffer."""
+        return (sum(column[:self._n].nbytes for column in self._columns.values())
+                + self._n_points * self._points.itemsize
+                + (len(self._retired_seqs) + len(self._retired_rows)) * 8)
+
+
+def _take(columns: Dict[str, np.ndarray], points: np.ndarray, idx: np.ndarray) -> Dict[str, np.ndarray]:
+    """Gather rows idx of the columns, with their points moved together into a new buffer."""
+    taken = {name: columns[name][idx] for name in _COLUMNS}
+    counts = np.where(taken["flags"] & HAS_POINTS, taken["pt_count"].astype(np.int64) * 2, 0)
+    starts = np.cumsum(counts) - counts
+    # For every point value its offset in the old buffer
+    offsets = np.repeat(taken["pt_start"] - starts, counts) + np.arange(int(counts.sum()))
+    taken["points"] = points[offsets]
+    taken["pt_start"] = np.where(counts > 0, starts, 0)
+    return taken
+
+
+class ShapeView:
+    """Selected rows of a ShapeStore; iterates as history dicts, chunk by chunk."""
+    def __init__(self, store: ShapeStore, rows: Sequence[int]):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.store.iter_rows(self.rows)
+
+    def tolist(self) -> List[Dict]:
+        return self.store.rows(self.rows)
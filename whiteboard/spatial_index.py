@@ -0,0 +1,104 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+import numpy as np
+from .geometry import BBox, intersects
+
+class GridIndex:
+    """
+    Uniform-grid spatial index mapping keys to bounding boxes.
+
+    Each key is stored in every cell its box overlaps. Boxes that would
+    cover more than max_cells cells are kept in a separate list that every
+    query checks, so one huge shape does not fill the grid.
+    Not thread-safe; the owner is expected to hold a lock.
+    """
+    def __init__(self, cell_size: float = 256, max_cells: int = 64):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._cells: Dict[Tuple[int, int], Dict[int, Any]] = defaultdict(dict)
+        self._boxes: Dict[int, BBox] = {}
+        self._large: Dict[int, Any] = {}
+
+    def _cell_range(self, bbox: BBox):
+        size = self.cell_size
+        return (int(bbox[0] // size), int(bbox[1] // size),
+                int(bbox[2] // size), int(bbox[3] // size))
+
+    def insert(self, key: int, bbox: BBox, value: Any = None):
+        # First, so a box that has no cells (NaN, inf) changes nothing
+        cx1, cy1, cx2, cy2 = self._cell_range(bbox)
+        self._boxes[key] = bbox
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > self.max_cells:
+            self._large[key] = value
+            return
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                self._cells[(cx, cy)][key] = value
+
+    def insert_many(self, keys: Sequence[int], boxes: np.ndarray):
+        """Insert keys[i] with the box in row i of an (n, 4) array and the value i."""
+        keys = np.asarray(keys, np.int64)
+        ranges = (boxes // self.cell_size).astype(np.int64)
+        self._boxes.update(zip(keys.tolist(), map(tuple, boxes.tolist())))
+        # Most boxes fit in one cell: group those by cell and add each group at once
+        single = (ranges[:, 0] == ranges[:, 2]) & (ranges[:, 1] == ranges[:, 3])
+        rows = np.flatnonzero(single)
+        if len(rows):
+            rows = rows[np.lexsort((ranges[rows, 1], ranges[rows, 0]))]
+            cx, cy = ranges[rows, 0], ranges[rows, 1]
+            bounds = (np.flatnonzero((cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])) + 1).tolist()
+            firsts = [0] + bounds
+            group_keys, group_rows = keys[rows].tolist(), rows.tolist()
+            for lo, hi, x, y in zip(firsts, bounds + [len(rows)], cx[firsts].tolist(), cy[firsts].tolist()):
+                self._cells[(x, y)].update(zip(group_keys[lo:hi], group_rows[lo:hi]))
+        for row in np.flatnonzero(~single).tolist():
+            cx1, cy1, cx2, cy2 = ranges[row].tolist()
+            key = int(keys[row])
+            if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > self.max_cells:
+                self._large[key] = row
+                continue
+            for x in range(cx1, cx2 + 1):
+                for y in range(cy1, cy2 + 1):
+                    self._cells[(x, y)][key] = row
+
+    def remove(self, key: int):
+        bbox = self._boxes.pop(key, None)
+        if bbox is None:
+            return
+        if key in self._large:
+            del self._large[key]
+            return
+        cx1, cy1, cx2, cy2 = self._cell_range(bbox)
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self._cells[(cx, cy)]
+                cell.pop(key, None)
+                if not cell:
+                    del self._cells[(cx, cy)]
+
+    def clear(self):
+        self._cells.clear()
+        self._boxes.clear()
+        self._large.clear()
+
+    def query(self, bbox: BBox) -> List[Any]:
+        """Return the values whose boxes intersect bbox, ordered by key."""
+        found: Dict[int, Any] = {}
+        cx1, cy1, cx2, cy2 = self._cell_range(bbox)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self._cells):
+            # Region larger than the occupied grid: walk the occupied cells
+            cells = [cell for (cx, cy), cell in self._cells.items()
+                     if cx1 <= cx <= cx2 and cy1 <= cy <= cy2]
+        else:
+            cells = [self._cells[(cx, cy)]
+                     for cx in range(cx1, cx2 + 1)
+                     for cy in range(cy1, cy2 + 1)
+                     if (cx, cy) in self._cells]
+        for cell in cells:
+            found.update(cell)
+        found.update(self._large)
+        boxes = self._boxes
+        return [found[key] for key in sorted(found) if intersects(boxes[key], bbox)]
+
+    def __len__(self):
+        return len(self._boxes)
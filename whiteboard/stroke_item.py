@@ -0,0 +1,46 @@
+from PySide6.QtCore import QPointF, QRectF
+from PySide6.QtGui import QPainterPath, QPen
+from PySide6.QtWidgets import QGraphicsItem
+
+class StrokeItem(QGraphicsItem):
+    """
+    A curve that is still being drawn, shown as straight segments.
+
+    append() extends the item's own path and bounding rect in place. The
+    path is never rebuilt or copied (QGraphicsPathItem.setPath would copy
+    it), so a chunk of points costs as much as the chunk, however long the
+    stroke already is.
+    """
+    def __init__(self, points, pen: QPen):
+        super().__init__()
+        self._pen = pen
+        self._path = QPainterPath(QPointF(*points[0]))
+        x, y = points[0]
+        self._bounds = [x, y, x, y]  # x1, y1, x2, y2
+        self.append(points[1:])
+
+    def pen(self) -> QPen:
+        return self._pen
+
+    def setPen(self, pen: QPen):
+        self._pen = pen
+        self.update()
+
+    def append(self, points):
+        if not points:
+            return
+        self.prepareGeometryChange()
+        for x, y in points:
+            self._path.lineTo(x, y)
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        x1, y1, x2, y2 = self._bounds
+        self._bounds = [min(x1, *xs), min(y1, *ys), max(x2, *xs), max(y2, *ys)]
+
+    def boundingRect(self) -> QRectF:
+        margin = self._pen.widthF() / 2 + 1
+        x1, y1, x2, y2 = self._bounds
+        return QRectF(x1 - margin, y1 - margin, x2 - x1 + 2 * margin, y2 - y1 + 2 * margin)
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(self._pen)
+        painter.drawPath(self._path)
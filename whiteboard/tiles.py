@@ -0,0 +1,182 @@
+import hashlib
+import io
+import itertools
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from . import curve
+from .geometry import BBox, shape_bbox
+
+TILE_SIZE = 256
+MIN_ZOOM = -8
+MAX_ZOOM = 4
+PEN_WIDTH = 2  # the window's pen width in board units
+
+def tile_span(z: int, size: int = TILE_SIZE) -> float:
+    """Board units covered by one tile side; zoom 0 is one board unit per pixel."""
+    return size / 2 ** z
+
+def tile_bbox(z: int, x: int, y: int, size: int = TILE_SIZE) -> BBox:
+    span = tile_span(z, size)
+    return x * span, y * span, (x + 1) * span, (y + 1) * span
+
+def _clip(x1, y1, x2, y2, box: BBox):
+    """Liang-Barsky: the fractions (t0, t1) of the segment inside box, or None."""
+    left, top, right, bottom = box
+    dx, dy = x2 - x1, y2 - y1
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, x1 - left), (dx, right - x1), (-dy, y1 - top), (dy, bottom - y1)):
+        if p == 0:
+            if q < 0:
+                return None
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+    return (t0, t1) if t0 <= t1 else None
+
+def _dashes(x1, y1, x2, y2, dash, gap, box: BBox = None):
+    """
+    Split a line into dash segments of length dash separated by gap. With
+    a box, only the dashes inside it are made, at the same places as
+    without, so a long line costs what its part in the tile does.
+    """
+    length = math.hypot(x2 - x1, y2 - y1)
+    if length == 0:
+        return
+    start, stop = 0.0, length
+    if box is not None:
+        clipped = _clip(x1, y1, x2, y2, box)
+        if clipped is None:
+            return
+        start, stop = clipped[0] * length, clipped[1] * length
+    ux, uy = (x2 - x1) / length, (y2 - y1) / length
+    period = dash + max(gap, 0)
+    for k in range(math.floor(start / period), math.ceil(stop / period)):
+        pos = k * period
+        end = min(pos + dash, length)
+        yield (x1 + ux * pos, y1 + uy * pos, x1 + ux * end, y1 + uy * end)
+
+def render_tile(shapes: List[Dict], z: int, x: int, y: int, size: int = TILE_SIZE) -> bytes:
+    """
+    Rasterize the shapes over one tile into a transparent PNG, drawing them
+    the way the window does (curves as polylines through their points).
+    """
+    from PIL import Image, ImageDraw  # only needed once tiles are requested
+
+    scale = 2 ** z
+    ox, oy = x * tile_span(z, size), y * tile_span(z, size)
+    to_px = lambda px, py: ((px - ox) * scale, (py - oy) * scale)
+    width = max(1, round(PEN_WIDTH * scale))
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for shape in shapes:
+        color = shape.get("color", "#000000")
+        kind = shape["type"]
+        if kind == "curve":
+            points = [to_px(px, py) for px, py in curve.to_tuples(shape["points"])]
+            draw.line(points, fill=color, width=width, joint="curve")
+            continue
+        x1, y1 = to_px(*shape["start"])
+        x2, y2 = to_px(*shape["end"])
+        if kind == "line":
+            draw.line([(x1, y1), (x2, y2)], fill=color, width=width)
+        elif kind == "dotted_line":
+            # Qt's [1, interval] dash pattern is in pen widths
+            dash, gap = width, width * shape.get("dot_interval", 5)
+            for segment in _dashes(x1, y1, x2, y2, dash, gap, (-width, -width, size + width, size + width)):
+                draw.line(segment, fill=color, width=width)
+        elif kind == "rect":
+            draw.rectangle([min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)], outline=color, width=width)
+        elif kind == "circle":
+            bx1, by1, bx2, by2 = shape_bbox(shape)
+            left, top = to_px(bx1, by1)
+            right, bottom = to_px(bx2, by2)
+            draw.ellipse([left, top, right, bottom], outline=color, width=width)
+    out = io.BytesIO()
+    image.save(out, "PNG", optimize=False)
+    return out.getvalue()
+
+class TileCache:
+    """
+    Bounded LRU cache of rendered PNG tiles, keyed by (board id, z, x, y).
+
+    Register on_change as a board listener: adding, updating or deleting
+    shapes only drops the cached tiles their old and new bounding boxes
+    touch, a clear drops the board's tiles. A render that raced with a
+    change to its board is returned but not cached. Each tile carries an ETag derived from its bytes.
+    """
+    def __init__(self, max_tiles: int = 4096, size: int = TILE_SIZE):
+        self.max_tiles = max_tiles
+        self.size = size
+        self._tiles: "OrderedDict[Tuple, Tuple[bytes, str]]" = OrderedDict()
+        self._by_board: Dict[str, set] = {}  # board id -> cached keys
+        self._epochs: Dict[str, int] = {}  # board id -> changes seen, to detect racing renders
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, board_id: str, history, z: int, x: int, y: int) -> Tuple[bytes, str]:
+        """Return (png, etag) for a tile, rendering it from the history on a miss."""
+        key = (board_id, z, x, y)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+            epoch = self._epochs.get(board_id, 0)
+        # Pad by the pen so strokes just outside the tile still show their edge
+        x1, y1, x2, y2 = tile_bbox(z, x, y, self.size)
+        pad = PEN_WIDTH
+        png = render_tile(history.in_region((x1 - pad, y1 - pad, x2 + pad, y2 + pad)), z, x, y, self.size)
+        tile = (png, '"%s"' % hashlib.blake2b(png, digest_size=8).hexdigest())
+        with self._lock:
+            if self._epochs.get(board_id, 0) == epoch:
+                self._tiles[key] = tile
+                self._by_board.setdefault(board_id, set()).add(key)
+                while len(self._tiles) > self.max_tiles:
+                    old, _ = self._tiles.popitem(last=False)
+                    self._by_board[old[0]].discard(old)
+        return tile
+
+    def _drop(self, key):
+        if self._tiles.pop(key, None) is not None:
+            self._by_board[key[0]].discard(key)
+            self.invalidated += 1
+
+    def on_change(self, board_id: str, op: str, shapes=None, source=None, previous=None):
+        """Board listener: invalidate the tiles a change touches."""
+        if op.startswith("stroke_"):
+            return  # strokes are not drawn on tiles until they are finished
+        with self._lock:
+            self._epochs[board_id] = self._epochs.get(board_id, 0) + 1
+            keys = self._by_board.get(board_id)
+            if not keys:
+                return
+            if op == "clear":
+                for key in list(keys):
+                    self._drop(key)
+                return
+            zooms = {key[1] for key in keys}
+            for shape in itertools.chain(shapes, previous or ()):
+                bx1, by1, bx2, by2 = shape_bbox(shape)
+                for z in zooms:
+                    span = tile_span(z, self.size)
+                    xs = range(math.floor((bx1 - PEN_WIDTH) / span), math.floor((bx2 + PEN_WIDTH) / span) + 1)
+                    ys = range(math.floor((by1 - PEN_WIDTH) / span), math.floor((by2 + PEN_WIDTH) / span) + 1)
+                    if len(xs) * len(ys) > len(keys):
+                        # A huge shape at a deep zoom: check the cached tiles instead
+                        for key in [k for k in keys if k[1] == z and k[2] in xs and k[3] in ys]:
+                            self._drop(key)
+                    else:
+                        for tx in xs:
+                            for ty in ys:
+                                self._drop((board_id, z, tx, ty))
+
+    def stats(self) -> Dict:
+        return {"tiles": len(self._tiles), "max_tiles": self.max_tiles, "hits": self.hits,
+                "misses": self.misses, "invalidated": self.invalidated}
@@ -0,0 +1,191 @@
+"""
+Board files for /export and /import: a board's shapes, gzip compressed.
+
+The body is one of two formats:
+
+    ndjson  one history dict per line, as /history?format=ndjson
+    binary  wire frames (see wire.py) one after the other, each written as
+            <u4 header length> <header JSON> <shapes bytes> <points bytes>
+            where the header is the frame with the byte fields replaced
+            by their lengths
+
+Both sides work a chunk at a time. Export encodes a few thousand rows
+straight from the history columns and compresses them before taking the
+next; import inflates at most READ_SIZE bytes before parsing them, so
+neither holds the whole board as dicts or text, and a small upload that
+inflates to gigabytes is parsed as it goes instead of all at once.
+"""
+import json
+import struct
+import zlib
+from typing import Dict, Iterator, List, Optional
+from . import wire
+from .shape import check_shape
+from .shape_store import ShapeView
+
+FORMATS = ("ndjson", "binary")
+GZIP_MAGIC = b"\x1f\x8b"
+READ_SIZE = 1 << 20  # bytes inflated at a time
+MAX_LINE = 16 << 20  # longest accepted ndjson line or binary frame
+HEADER = struct.Struct("<I")
+
+def export_chunks(view: ShapeView, format: str = "ndjson", chunk_size: int = 5000) -> Iterator[bytes]:
+    """Yield a board file of the view's shapes, compressed chunk by chunk."""
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    store, rows = view.store, view.rows
+    deflate = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        if format == "ndjson":
+            body = "".join(json.dumps(shape, allow_nan=False) + "\n" for shape in store.rows(chunk)).encode()
+        else:
+            body = encode_frame(wire.encode_rows(store, chunk))
+        data = deflate.compress(body)
+        if data:
+            yield data
+    yield deflate.flush()
+
+def encode_frame(frame: Dict) -> bytes:
+    header = {**frame, "shapes": len(frame["shapes"]), "points": len(frame["points"])}
+    text = json.dumps(header).encode()
+    return HEADER.pack(len(text)) + text + frame["shapes"] + frame["points"]
+
+class BoardReader:
+    """
+    Parse an uploaded board file incrementally into checked shape dicts.
+
+    feed() takes the bytes as they arrive and read() returns the next
+    shapes parsed from them, [] once it needs more input. At the end of the
+    upload close() returns the rest, also a batch per call until []. The
+    input may be gzip (detected by its magic bytes) or plain. Shapes are
+    checked with check_shape, so ids and seqs are dropped; bad input raises
+    ValueError naming the record, from the call after the one that returned
+    the good shapes before it.
+    """
+    def __init__(self, format: str = "ndjson"):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        self.format = format
+        self.bytes_in = 0  # compressed bytes received
+        self.records = 0  # lines or frames parsed
+        self._input = b""
+        self._inflate = None
+        self._gzip = None  # unknown until the first two bytes are in
+        self._buffer = bytearray()
+        self._error: Optional[ValueError] = None  # bad input found after shapes that were returned first
+
+    def feed(self, data: bytes):
+        self.bytes_in += len(data)
+        self._input += data
+
+    def read(self) -> List[Dict]:
+        while True:
+            if self._error:
+                raise self._error
+            shapes = self._parse()
+            if shapes or (not self._error and not self._decompress()):
+                return shapes
+
+    def close(self) -> List[Dict]:
+        while True:
+            shapes = self.read()
+            if shapes:
+                return shapes
+            if self._input:
+                # Fewer than two bytes in all, too short to tell
+                self._gzip = False
+                self._decompress()
+                continue
+            if self._inflate is not None and not self._inflate.eof:
+                raise ValueError("truncated gzip stream")
+            if not self._buffer:
+                return []
+            if self.format == "binary":
+                raise ValueError(f"record {self.records + 1}: truncated frame")
+            self._buffer += b"\n"
+
+    def _decompress(self) -> bool:
+        """Move some input into the buffer; False if there is none to move yet."""
+        if not self._input:
+            return False
+        if self._gzip is None:
+            if len(self._input) < 2:
+                return False
+            self._gzip = self._input[:2] == GZIP_MAGIC
+        if not self._gzip:
+            self._buffer += self._input
+            self._input = b""
+            return True
+        if self._inflate is None or self._inflate.eof:
+            # The first gzip member or one concatenated after it
+            self._inflate = zlib.decompressobj(31)
+        try:
+            self._buffer += self._inflate.decompress(self._input, READ_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"invalid gzip stream: {e}")
+        self._input = self._inflate.unconsumed_tail
+        if self._inflate.eof:
+            self._input = self._inflate.unused_data + self._input
+        return True
+
+    def _parse(self) -> List[Dict]:
+        shapes = []
+        try:
+            if self.format == "ndjson":
+                self._parse_lines(shapes)
+            else:
+                self._parse_frames(shapes)
+        except ValueError as e:
+            # The shapes before the bad record still go out; the error comes next
+            self._error = e
+        return shapes
+
+    def _parse_lines(self, shapes: List[Dict]):
+        end = self._buffer.rfind(b"\n")
+        if end < 0:
+            if len(self._buffer) > MAX_LINE:
+                raise ValueError(f"record {self.records + 1}: line longer than {MAX_LINE} bytes")
+            return
+        lines = self._buffer[:end].split(b"\n")
+        del self._buffer[:end + 1]
+        for line in lines:
+            self.records += 1
+            if not line.strip():
+                continue
+            try:
+                shapes.append(check_shape(json.loads(line)))
+            except ValueError as e:  # json.JSONDecodeError is one too
+                raise ValueError(f"record {self.records}: {e}")
+
+    def _parse_frames(self, shapes: List[Dict]):
+        buffer = self._buffer
+        pos = 0
+        while len(buffer) - pos >= HEADER.size:
+            size, = HEADER.unpack_from(buffer, pos)
+            start = pos + HEADER.size
+            if size > MAX_LINE:
+                raise ValueError(f"record {self.records + 1}: frame header of {size} bytes")
+            if len(buffer) < start + size:
+                break
+            try:
+                header = json.loads(buffer[start:start + size])
+                n_shapes, n_points = int(header["shapes"]), int(header["points"])
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"record {self.records + 1}: invalid frame header: {e}")
+            if n_shapes + n_points > MAX_LINE:
+                raise ValueError(f"record {self.records + 1}: frame longer than {MAX_LINE} bytes")
+            body = start + size
+            end = body + n_shapes + n_points
+            if len(buffer) < end:
+                break
+            self.records += 1
+            frame = {**header, "shapes": bytes(buffer[body:body + n_shapes]),
+                     "points": bytes(buffer[body + n_shapes:end])}
+            try:
+                # A frame is one record, all or nothing
+                shapes.extend([check_shape(shape) for shape in wire.decode(frame)])
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                raise ValueError(f"record {self.records}: {e}")
+            pos = end
+        del buffer[:pos]
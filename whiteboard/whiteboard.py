@@ -1,16 +1,28 @@
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QGraphicsView, QGraphicsScene,
-    QGraphicsEllipseItem, QGraphicsLineItem, QGraphicsRectItem, QGraphicsPathItem, QVBoxLayout, QWidget
+    QGraphicsEllipseItem, QGraphicsLineItem, QGraphicsRectItem, QGraphicsPathItem, QVBoxLayout, QWidget,
+    QGraphicsItem
 )
 from PySide6.QtGui import QPainter, QColor, QPen, QAction, QPainterPath
-from PySide6.QtCore import Qt, QPointF, Signal, QObject
-from typing import List, Dict
+from PySide6.QtCore import Qt, QPointF, QTimer, Signal, QObject
+from typing import List, Dict, Optional
+import logging
 from .menu import WBMenu
-from .curve_shap import CurveShap
-import json
+from . import curve, metrics
+from .boards import Board, DEFAULT_BOARD
+from .dispatch import DispatchQueue, drain
+from .lod_path_item import LodPathItem
+from .stroke_item import StrokeItem
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+RENDER_DELAY = metrics.histogram("whiteboard_render_delay_seconds",
+                                 "Time from a board change to its rendering on the GUI thread")
+GUI_ERRORS = metrics.counter("whiteboard_gui_errors_total", "Exceptions in the window's mouse handlers",
+                             ["handler"])
 
 class WhiteboardWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, board: Optional[Board] = None):
         super().__init__()
         self.scense_reserved = 15
         self.window_height = 600
@@ -19,11 +31,16 @@ class WhiteboardWindow(QMainWindow):
         self.view = QGraphicsView(self.scene)
         self.setCentralWidget(self.view)
         self.init_ui()
-        self.history: List[Dict] = []
+        # The board shown in the window; the scene renders its history
+        self.board = board or Board(DEFAULT_BOARD)
+        self.history = self.board.history
+        self.items: Dict[int, QGraphicsItem] = {}  # shape id -> its item in the scene
+        self.item_count = 0  # shape items in the scene, readable from any thread
         self.view.setMouseTracking(True)
         self.view.mousePressEvent = self.mousePressEvent
         self.view.mouseMoveEvent = self.mouseMoveEvent
         self.view.mouseReleaseEvent = self.mouseReleaseEvent
+        self.view.wheelEvent = self.wheelEvent
         
         # 绘图工具状态
         self.current_tool = "line"
@@ -32,6 +49,18 @@ class WhiteboardWindow(QMainWindow):
         self.color = QColor("#000000")
         self.pen_width = 2  # 默认线宽
         self.dot_interval = 5  # Default dot interval for dotted lines
+        self.curve_tolerance = 0.5  # Max deviation in px when simplifying strokes, 0 keeps all points
+        self.curve_smoothing = True  # Draw curves as Bezier segments
+        self.stroke_interval_ms = 50  # Points of a curve being drawn are streamed to the board this often
+        self.stroke_id = None  # shape id of the curve being drawn
+        self._stroke_points: List[float] = []  # flat points not streamed yet
+        self._stroke_timer = QTimer(self)
+        self._stroke_timer.timeout.connect(self.flush_stroke)
+
+        # 渲染模式: "quality" or "fast", see set_render_mode
+        self.render_mode = "quality"
+        self.lod_min_points = 16  # Curves with fewer points are cheap enough to draw in full
+        self.antialias_min_zoom = 1.0  # In fast mode antialias only at or above this zoom
 
     def init_ui(self):
         self.setGeometry(100, 
@@ -44,12 +73,43 @@ class WhiteboardWindow(QMainWindow):
         # Add menu bar
         self.menu = WBMenu(self)
 
+    def set_render_mode(self, mode: str):
+        """
+        "quality" antialiases every item and draws curves in full.
+        "fast" is meant for large boards: curves are drawn at a level of
+        detail that follows the zoom and repainted from per-item pixmap
+        caches, antialiasing is only used when zoomed in, and painter state
+        is not saved around every item. Items outside the viewport are
+        skipped by the scene's BSP index in both modes.
+        """
+        self.render_mode = mode
+        fast = mode == "fast"
+        self.view.setOptimizationFlag(QGraphicsView.DontSavePainterState, fast)
+        self.view.setOptimizationFlag(QGraphicsView.DontAdjustForAntialiasing, fast)
+        self.update_antialiasing()
+        self.redraw_history()
+
+    def update_antialiasing(self):
+        zoom = self.view.transform().m11()
+        enabled = self.render_mode != "fast" or zoom >= self.antialias_min_zoom
+        self.view.setRenderHint(QPainter.Antialiasing, enabled)
+
+    def wheelEvent(self, event):
+        """Ctrl + wheel zooms around the mouse; plain wheel scrolls as usual."""
+        if not event.modifiers() & Qt.ControlModifier:
+            QGraphicsView.wheelEvent(self.view, event)
+            return
+        factor = 1.15 ** (event.angleDelta().y() / 120)
+        self.view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.view.scale(factor, factor)
+        self.update_antialiasing()
+
     def set_dot_interval(self, interval: float):
         """Set the interval for dotted lines"""
         self.dot_interval = interval
 
-    def add_remote_shape(self, shape_data):
-        """处理来自网络的绘图指令"""
+    def create_item(self, shape_data):
+        """Build the graphics item for a shape without adding it to the scene."""
         item = None
         color = QColor(shape_data.get('color', '#000000'))
         pen = QPen(color, self.pen_width)
@@ -87,22 +147,177 @@ class WhiteboardWindow(QMainWindow):
             )
         elif shape_data['type'] == 'curve':
             # 处理曲线绘制逻辑
-            # 这里可以使用贝塞尔曲线或其他算法来绘制曲线
-            points = shape_data['points']
-            if isinstance(points, str):
-                shape_data["points"] = json.loads(points) 
-            curve = CurveShap.model_validate(shape_data)
-            if len(curve.points) > 1:
-                path = QPainterPath()
-                path.moveTo(curve.points[0].x, curve.points[0].y)
-                for point in curve.points[1:]:
-                    path.lineTo(point.x, point.y)
-                item = self.scene.addPath(path, color)
-        
+            points = curve.to_tuples(shape_data['points'])
+            if isinstance(shape_data['points'], str):
+                shape_data["points"] = curve.to_dicts(points)
+            if len(points) > 1:
+                if self.render_mode == "fast" and len(points) >= self.lod_min_points:
+                    item = LodPathItem(points, self.build_curve_path)
+                    # Repaint from a cached pixmap until the item or the zoom changes
+                    item.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+                else:
+                    item = QGraphicsPathItem(self.build_curve_path(points))
+
         if item:
             item.setPen(pen)
+        return item
+
+    def build_curve_path(self, points):
+        """
+        Build the path through the curve points. With curve_smoothing the
+        points are joined by Catmull-Rom splines converted to cubic Beziers,
+        which keeps simplified strokes looking smooth.
+        """
+        path = QPainterPath()
+        path.moveTo(*points[0])
+        if not self.curve_smoothing or len(points) < 3:
+            for x, y in points[1:]:
+                path.lineTo(x, y)
+            return path
+        for i in range(len(points) - 1):
+            x0, y0 = points[i - 1] if i > 0 else points[i]
+            x1, y1 = points[i]
+            x2, y2 = points[i + 1]
+            x3, y3 = points[i + 2] if i + 2 < len(points) else points[i + 1]
+            path.cubicTo(x1 + (x2 - x0) / 6, y1 + (y2 - y0) / 6,
+                         x2 - (x3 - x1) / 6, y2 - (y3 - y1) / 6,
+                         x2, y2)
+        return path
+
+    def add_item(self, shape_data):
+        """Add the graphics item of a shape that is already on the board, replacing its old one."""
+        shape_id = shape_data.get("id")
+        self.remove_item(shape_id)
+        item = self.create_item(shape_data)
+        if item:
             self.scene.addItem(item)
-            self.history.append(shape_data)
+            self.item_count += 1
+            if shape_id is not None:
+                self.items[shape_id] = item
+
+    def remove_item(self, shape_id):
+        item = self.items.pop(shape_id, None)
+        if item is not None:
+            self.scene.removeItem(item)
+            self.item_count -= 1
+
+    def add_remote_shape(self, shape_data):
+        """处理来自网络的绘图指令"""
+        self.board.apply("add", [shape_data], source=self)
+        self.add_item(shape_data)
+
+    @contextmanager
+    def suspended_index(self):
+        """Suspend scene indexing; restoring it rebuilds the index once."""
+        index_method = self.scene.itemIndexMethod()
+        self.scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+        try:
+            yield
+        finally:
+            self.scene.setItemIndexMethod(index_method)
+
+    def redraw_history(self):
+        """Rebuild the scene from the history, e.g. after restoring it from disk."""
+        self.clear_scene()
+        with self.suspended_index():
+            for shape_data in self.history:
+                self.add_item(shape_data)
+
+    def clear_scene(self):
+        self.scene.clear()
+        self.temp_item = None  # deleted along with the scene items
+        self.items.clear()
+        self.item_count = 0
+
+    def clear_board(self):
+        """Remove every shape from the scene and the history."""
+        self.board.apply("clear", source=self)
+        self.clear_scene()
+
+    def undo(self):
+        """Revert the latest change drawn in the window."""
+        self._apply_op(*self.board.apply("undo", source=self))
+
+    def redo(self):
+        """Reapply the latest change undone in the window."""
+        self._apply_op(*self.board.apply("redo", source=self))
+
+    def start_dispatch(self, queue: DispatchQueue, interval_ms: int = 16, budget_ms: float = 8,
+                       bulk_threshold: int = 1000):
+        """
+        Subscribe to the board and render the operations applied to it by
+        other threads: they are queued and drained every interval_ms,
+        spending at most budget_ms per tick so the window stays responsive.
+        Ticks with at least bulk_threshold queued shapes run with scene
+        indexing suspended.
+        """
+        self.dispatch_queue = queue
+        self.board.subscribe(self._on_board_op)
+        self.dispatch_budget = budget_ms / 1000
+        self.bulk_threshold = bulk_threshold
+        self._dispatch_timer = QTimer(self)
+        self._dispatch_timer.timeout.connect(self._drain_dispatch)
+        self._dispatch_timer.start(interval_ms)
+
+    def _drain_dispatch(self):
+        if not len(self.dispatch_queue):
+            return
+        if len(self.dispatch_queue) >= self.bulk_threshold:
+            with self.suspended_index():
+                drain(self.dispatch_queue, self._apply_op, self.dispatch_budget, observe=RENDER_DELAY.observe)
+        else:
+            drain(self.dispatch_queue, self._apply_op, self.dispatch_budget, observe=RENDER_DELAY.observe)
+
+    def _on_board_op(self, op, shapes, source, previous=None):
+        # Runs on the thread that changed the board; our own changes are drawn already.
+        # Producers check for room in the queue before they apply, see main.apply
+        if source is not self:
+            self.dispatch_queue.push(op, shapes, source)
+            if shapes and metrics.TRACER.active:
+                metrics.TRACER.mark(shapes, "queued")
+
+    def _apply_op(self, op, shapes):
+        if op == "stroke_begin":
+            # Another client's curve in progress, under the id the finished curve will have
+            for stroke in shapes:
+                self.remove_item(stroke["id"])
+                points = curve.to_tuples(stroke["points"])
+                if points:
+                    item = StrokeItem(points, QPen(QColor(stroke["color"]), self.pen_width))
+                    self.scene.addItem(item)
+                    self.items[stroke["id"]] = item
+                    self.item_count += 1
+        elif op == "stroke_append":
+            for stroke in shapes:
+                item = self.items.get(stroke["id"])
+                if isinstance(item, StrokeItem):
+                    item.append(curve.to_tuples(stroke["points"]))
+        elif op == "stroke_cancel":
+            for stroke in shapes:
+                self.remove_item(stroke["id"])
+        elif op in ("add", "update"):
+            for shape_data in shapes:
+                self.add_item(shape_data)
+            if metrics.TRACER.active:
+                metrics.TRACER.mark(shapes, "rendered")
+        elif op == "delete":
+            for shape_data in shapes:
+                self.remove_item(shape_data["id"])
+        elif op == "clear":
+            self.clear_scene()
+
+    def flush_stroke(self):
+        """Send the points drawn since the last flush; runs every stroke_interval_ms while drawing."""
+        if self.stroke_id is not None and self._stroke_points:
+            points, self._stroke_points = self._stroke_points, []
+            self.board.apply("stroke_append", [{"id": self.stroke_id, "points": points}], source=self)
+
+    def end_stroke(self) -> int:
+        """Stop streaming the stroke; returns its id."""
+        self._stroke_timer.stop()
+        shape_id, self.stroke_id = self.stroke_id, None
+        self._stroke_points = []
+        return shape_id
 
     # 新增工具切换方法
     def set_drawing_tool(self, tool_name):
@@ -150,18 +365,24 @@ class WhiteboardWindow(QMainWindow):
                     self.temp_item = QGraphicsRectItem()
                     self.scene.addItem(self.temp_item)
                 elif self.current_tool == "curve":
-                    self.temp_item = QGraphicsPathItem()
+                    start = (self.start_point.x(), self.start_point.y())
+                    self.temp_item = StrokeItem([start], QPen(self.color, self.pen_width))
                     self.scene.addItem(self.temp_item)
-                    self.path = QPainterPath()
-                    self.path.moveTo(self.start_point)
                     self.points = [self.start_point]
+                    # Stream the stroke so other clients see it while it is drawn
+                    op, strokes = self.board.apply(
+                        "stroke_begin", [{"color": self.color.name(), "points": list(start)}], source=self)
+                    self.stroke_id = strokes[0]["id"]
+                    self._stroke_points = []
+                    self._stroke_timer.start(self.stroke_interval_ms)
                 # elif self.current_tool == "dotted_line":
                 #     # For dotted lines, initialize a temporary line item
                 #     self.temp_item = QGraphicsLineItem()
                 #     self.scene.addItem(self.temp_item)
 
-        except Exception as e:
-            print(f"Error in mousePressEvent: {e}")
+        except Exception:
+            logger.exception("Error in mousePressEvent")
+            GUI_ERRORS.inc("mousePressEvent")
 
     def mouseMoveEvent(self, event):
         try:
@@ -202,9 +423,12 @@ class WhiteboardWindow(QMainWindow):
                         )
                 elif self.current_tool == "curve":
                 # Add the current point to the path
-                    self.path.lineTo(end_point)
-                    self.temp_item.setPath(self.path)
-                    self.points.append(end_point) 
+                    last = self.points[-1]
+                    # Skip sub-pixel moves; they add points without changing the stroke
+                    if abs(end_point.x() - last.x()) + abs(end_point.y() - last.y()) >= 1:
+                        self.temp_item.append([(end_point.x(), end_point.y())])
+                        self.points.append(end_point)
+                        self._stroke_points += (end_point.x(), end_point.y())
                 # elif self.current_tool == "dotted_line":
                 #     # Update the end point of the temporary line item
                 #     if isinstance(self.temp_item, QGraphicsLineItem):
@@ -215,8 +439,9 @@ class WhiteboardWindow(QMainWindow):
                 #     else:
                 #         self.temp_item = QGraphicsLineItem()
                 #         self.scene.addItem(self.temp_item)
-        except Exception as e:
-            print(f"Error in mouseMoveEvent: {e}")
+        except Exception:
+            logger.exception("Error in mouseMoveEvent")
+            GUI_ERRORS.inc("mouseMoveEvent")
 
     def mouseReleaseEvent(self, event):
         try:
@@ -235,14 +460,21 @@ class WhiteboardWindow(QMainWindow):
                 # Add points only for curve type
                 if self.current_tool == "curve":
                     if hasattr(self, 'points'):
-                        shape_data["points"] = [{"x":p.x(), "y":p.y()} for p in self.points]
+                        points = curve.simplify([(p.x(), p.y()) for p in self.points], self.curve_tolerance)
+                        shape_data["points"] = curve.to_dicts(points)
                         delattr(self, 'points')  # Clean up points after use
 
+                if self.stroke_id is not None:
+                    # The finished curve takes the stroke's id, which ends the stroke
+                    shape_data["id"] = self.end_stroke()
+
                 self.scene.removeItem(self.temp_item)  # Remove temporary shape
-                self.add_remote_shape(shape_data)  # Add final shape
-                self.history.append(shape_data)
-                print(f"Shape added to history: {shape_data}")
+                self.add_remote_shape(shape_data)  # Add final shape, which also records it
                 self.temp_item = None
+            elif event.button() == Qt.LeftButton and self.stroke_id is not None:
+                # The scene was cleared under the stroke
+                self.board.apply("stroke_cancel", [{"id": self.end_stroke()}], source=self)
 
-        except Exception as e:
-            print(f"Error in mouseReleaseEvent: {e}")
\ No newline at end of file
+        except Exception:
+            logger.exception("Error in mouseReleaseEvent")
+            GUI_ERRORS.inc("mouseReleaseEvent")
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Binary wire format for shape lists, an opt-in alternative to JSON dicts.
+
+A frame is a small dict whose bulk travels as Socket.IO binary attachments:
+
+    {"v": 1,
+     "palette": ["#FF0000", ...],        colors used by the frame
+     "shapes": bytes,                    one RECORD per shape
+     "points": bytes,                    float32 x, y pairs of all curves in order
+     "extras": {"<index>": {...}}}       keys the records do not cover, if any
+
+Records store the type as a tag (an index into SHAPE_TYPES), the color as
+an index into the palette and coordinates as float32. Ids and seqs are
+uint32. Frames are built straight from the history columns, so sending a
+large board never creates a dict per shape.
+"""
+from typing import Dict, List, Sequence
+import numpy as np
+from .shape_store import (AUX_KEYS, HAS_AUX, HAS_COLOR, HAS_POINTS, HAS_START_END, SHAPE_TYPES,
+                          ShapeStore, ShapeView)
+
+VERSION = 1
+RECORD = np.dtype([
+    ("kind", "u1"), ("flags", "u1"), ("color", "<u2"),
+    ("id", "<u4"), ("seq", "<u4"),
+    ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4"),
+    ("aux", "<f4"),
+    ("npoints", "<u4"),
+])
+
+def _gather(flat: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenate flat[start:start + count] for every pair, without a Python loop."""
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, flat.dtype)
+    offsets = np.cumsum(counts) - counts
+    return flat[np.repeat(starts - offsets, counts) + np.arange(total)]
+
+def encode_rows(store: ShapeStore, rows: Sequence[int]) -> Dict:
+    """Encode rows of a ShapeStore as a binary frame."""
+    idx = np.asarray(rows, np.int64)
+    c = lambda name: store.column(name)[idx]
+    flags = c("flags")
+    rec = np.zeros(len(idx), RECORD)
+    rec["kind"] = c("kind")
+    rec["flags"] = flags
+    rec["id"] = c("id")
+    rec["seq"] = c("seq")
+    # Columns are only filled where the flags say so
+    has_start = (flags & HAS_START_END) != 0
+    for name in ("x1", "y1", "x2", "y2"):
+        rec[name] = np.where(has_start, c(name), 0)
+    rec["aux"] = np.where((flags & HAS_AUX) != 0, c("aux"), 0)
+
+    has_color = (flags & HAS_COLOR) != 0
+    color_ids = np.where(has_color, c("color"), 0)
+    used = np.unique(color_ids[has_color])
+    rec["color"] = np.searchsorted(used, color_ids)
+    palette = [store.colors[i] for i in used.tolist()]
+
+    has_points = (flags & HAS_POINTS) != 0
+    counts = np.where(has_points, c("pt_count"), 0)
+    rec["npoints"] = counts
+    points = _gather(store.points(), c("pt_start")[has_points], 2 * counts[has_points])
+
+    frame = {"v": VERSION, "palette": palette, "shapes": rec.tobytes(),
+             "points": points.astype("<f4").tobytes()}
+    if store.extras:
+        keys = np.fromiter(store.extras.keys(), np.int64, len(store.extras))
+        hits = np.flatnonzero(np.isin(idx, keys))
+        if len(hits):
+            frame["extras"] = {str(i): store.extras[row] for i, row in zip(hits.tolist(), idx[hits].tolist())}
+    return frame
+
+def encode_view(view: ShapeView) -> Dict:
+    return encode_rows(view.store, view.rows)
+
+def encode(shapes: List[Dict]) -> Dict:
+    """Encode a list of history dicts as a binary frame."""
+    store = ShapeStore(capacity=max(1, len(shapes)))
+    for shape_data in shapes:
+        store.append(shape_data)
+    return encode_rows(store, np.arange(len(shapes)))
+
+def is_frame(data) -> bool:
+    return isinstance(data, dict) and isinstance(data.get("shapes"), (bytes, bytearray))
+
+def decode(frame: Dict) -> List[Dict]:
+    """Decode a binary frame back into history dicts."""
+    if frame.get("v") != VERSION:
+        raise ValueError(f"unsupported wire format version {frame.get('v')!r}")
+    rec = np.frombuffer(frame["shapes"], RECORD)
+    points = np.frombuffer(frame["points"], "<f4").tolist()
+    palette = frame["palette"]
+    extras = frame.get("extras", {})
+    c = {name: rec[name].tolist() for name in RECORD.names}
+    out = []
+    pos = 0
+    for i in range(len(rec)):
+        flags = c["flags"][i]
+        type_name = SHAPE_TYPES[c["kind"][i]]
+        shape = {"type": type_name}
+        if flags & HAS_START_END:
+            shape["start"] = (c["x1"][i], c["y1"][i])
+            shape["end"] = (c["x2"][i], c["y2"][i])
+        if flags & HAS_POINTS:
+            end = pos + 2 * c["npoints"][i]
+            flat = points[pos:end]
+            pos = end
+            shape["points"] = [{"x": x, "y": y} for x, y in zip(flat[0::2], flat[1::2])]
+        if flags & HAS_COLOR:
+            shape["color"] = palette[c["color"][i]]
+        if flags & HAS_AUX:
+            shape[AUX_KEYS[type_name]] = c["aux"][i]
+        if str(i) in extras:
+            shape.update(extras[str(i)])
+        if c["id"][i]:
+            shape["id"] = c["id"][i]
+        if c["seq"][i]:
+            shape["seq"] = c["seq"][i]
+        out.append(shape)
+    return out